@@ -1,19 +1,44 @@
 # packages
 import dash
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import pandas as pd
-import json
+import os
 from components import html_table as ht
 from utils import graph_functions as gf
 from utils import calculation_functions as cf
+from utils import data_store as ds
+from utils import figure_cache as fc
+from utils import summary_table as st
+from utils import resampling as rs
+from utils import instrumentation as im
+from utils import request_coalescing as rc
+from utils import figure_encoding as fe
+from utils import figure_skeletons as fs
+from utils import table_metrics as tm
+from utils import stats_api as sa
+from utils import portfolio as pf
+
+
+# timing the graph and calculation functions for /metrics (see utils/instrumentation.py). Done before anything below
+# takes references to them, e.g. the figure cache wrappers. APP_METRICS=0 turns the instrumentation off
+metrics_enabled = os.environ.get('APP_METRICS', '1') == '1'
+if metrics_enabled:
+    im.instrument_module(gf)
+    im.instrument_module(cf)
+    im.instrument_module(fe)
 
 
 #ading an example stylesheet taken from the following, https://community.plotly.com/t/dash-bootstrap-components-in-ie-chrome/34362/6
 external_stylesheets = ['https://stackpath.bootstrapcdn.com/bootswatch/4.4.1/flatly/bootstrap.min.css']
 
 #creating an instance of the dash class. This is similar to Flask, where you initialize a WSGI application (Web Server Gateway Interface)
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# responses are compressed (flask-compress), which mostly shrinks the figure payloads
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, compress=True)
+
+# the underlying Flask app, which WSGI servers serve (see wsgi.py)
+server = app.server
 
 # Defining the layout of the application
 colours = {
@@ -29,123 +54,262 @@ text_colours = {
 }
 
 # DATA
-# Data
-all_tickers_stock_data = pd.read_csv('assets/data/master_data_2022-11-03.csv')   
-all_tickers_stock_data['Date'] = all_tickers_stock_data['Date'].astype("Datetime64") #set the datatype of the date column
+# Data. The CSV is converted once into a columnar store (typed .npy columns) which is then memory-mapped, see utils/data_store.py
+# (paths are relative to this file, so the app also loads when a WSGI server starts it from another directory)
+app_directory = os.path.dirname(os.path.abspath(__file__))
+master_data_csv_path = os.path.join(app_directory, 'assets/data/master_data_2022-11-03.csv')
+master_data_store_path = os.path.join(app_directory, 'assets/data/master_data_store')
+ds.load_or_convert(csv_path = master_data_csv_path, store_root = master_data_store_path)
+
+# live dataset version and its index (rows grouped per ticker with sorted dates, so callbacks slice (ticker, start, end) by
+# binary search). New versions published by utils/ingestion.py are swapped in without restarting the app
+live_dataset = ds.LiveDataset(master_data_store_path)
+
+# full-history summary statistics of every ticker, served by the data table for the default date range. Computed with a process
+# pool and saved with the store the first time, then loaded (utils/ingestion.py saves it with every version it publishes)
+st.summary_table(live_dataset.index())
+
+# figures are sent with compact trace arrays (short dates, float32 values, typed arrays where plotly.js supports them),
+# see utils/figure_encoding.py. COMPACT_FIGURES=0 sends the figures as built
+def figure_builder(figure_function):
+    return fe.encoded(figure_function) if os.environ.get('COMPACT_FIGURES', '1') == '1' else figure_function
+
+# shared LRU cache of built (and encoded) figures. Setting FIGURE_CACHE_DIR also shares the cache between worker processes through local disk
+figure_cache = fc.FigureCache(max_size = 256, disk_path = os.environ.get('FIGURE_CACHE_DIR'), store_root = master_data_store_path)
+create_candlestick_graph = figure_cache.wrap(figure_builder(gf.create_candlestick_graph))
+create_price_line_graph = figure_cache.wrap(figure_builder(gf.create_price_line_graph))
+create_returns_line_graph = figure_cache.wrap(figure_builder(gf.create_returns_line_graph))
+create_returns_histogram = figure_cache.wrap(figure_builder(gf.create_returns_histogram))
+create_correlation_heatmap = figure_cache.wrap(figure_builder(gf.create_correlation_heatmap))
+create_rolling_statistics_graph = figure_cache.wrap(figure_builder(gf.create_rolling_statistics_graph))
 
-# getting tickers from dataframe for labels
-unique_tickers = sorted(list(all_tickers_stock_data['Ticker'].unique()))
+# drops callback requests superseded by a newer one from the same browser session. A request arriving while an earlier one
+# is in flight waits COALESCE_DEBOUNCE_MS milliseconds for one (see utils/request_coalescing.py). COALESCE_DEBOUNCE_MS=0
+# only drops requests already superseded
+request_coalescer = rc.RequestCoalescer(debounce_seconds = float(os.environ.get('COALESCE_DEBOUNCE_MS', rc.DEFAULT_DEBOUNCE_SECONDS * 1000)) / 1000)
+request_coalescer.init_app(server)
+
+# JSON endpoints of the table values and OHLCV bars for other services, cached by dataset version with ETags (see utils/stats_api.py)
+stats_api = sa.StatsApi(live_dataset)
+stats_api.init_app(server)
+
+# bar interval dropdown value that lets the candlestick graph pick the finest interval fitting the date range
+AUTO_BAR_INTERVAL = 'auto'
+
+# portfolio rebalancing dropdown value for holding the initial weights (no rebalancing)
+BUY_AND_HOLD = 'hold'
+
+
+def data_index_for(portfolio_data, *tickers):
+    '''
+    the daily index, extended with the portfolio's rows when one of the tickers is the portfolio's pseudo-ticker (see utils/portfolio.py).
+    '''
+    stock_data_index = live_dataset.index()
+    portfolio = pf.from_dict(portfolio_data)
+    if portfolio is not None and portfolio.ticker in tickers:
+        return pf.with_portfolio(stock_data_index, portfolio)
+    return stock_data_index
 
 
 
 # APP
 # app visual layout. Layout structure uses dash bootstrap components (for which we must have a defined stylesheet for expected rendering)
-app.layout = dbc.Container(children = [
-    html.Br(),
-        dbc.Row([ 
-        dbc.Col([ # row 1, col 1
-            dbc.Card([
-                dbc.CardBody([
-                    html.Div(children = [
-                        dbc.Tabs([
-                                dbc.Tab(label="Candlestick Graph", id="candlestick_graph_tab", tab_id="candlestick_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'}),
-                                dbc.Tab(label="Price Line Graph", id="price_line_graph_tab", tab_id="price_line_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'}),
-                                dbc.Tab(label="Returns Line Graph", id="returns_line_graph_tab", tab_id="returns_line_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'}),
-                                dbc.Tab(label="Returns Distribution Graph", id="returns_histogram_graph_tab", tab_id="returns_histogram_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'})
-                            ],
-                            id="tabs",
-                            active_tab="candlestick_graph_tab"
+def serve_layout():
+    '''
+    the layout is built on each page load, so a page opened after a new dataset version is published shows its tickers and dates.
+    '''
+    stock_data_index = live_dataset.index()
+    unique_tickers = stock_data_index.tickers
+
+    return dbc.Container(children = [
+        html.Br(),
+            dbc.Row([ 
+            dbc.Col([ # row 1, col 1
+                dbc.Card([
+                    dbc.CardBody([
+                        html.Div(children = [
+                            dbc.Tabs([
+                                    dbc.Tab(label="Candlestick Graph", id="candlestick_graph_tab", tab_id="candlestick_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'}),
+                                    dbc.Tab(label="Price Line Graph", id="price_line_graph_tab", tab_id="price_line_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'}),
+                                    dbc.Tab(label="Returns Line Graph", id="returns_line_graph_tab", tab_id="returns_line_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'}),
+                                    dbc.Tab(label="Returns Distribution Graph", id="returns_histogram_graph_tab", tab_id="returns_histogram_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'}),
+                                    dbc.Tab(label="Correlation Heatmap", id="correlation_heatmap_graph_tab", tab_id="correlation_heatmap_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'}),
+                                    dbc.Tab(label="Rolling Statistics Graph", id="rolling_statistics_graph_tab", tab_id="rolling_statistics_graph_tab", style = {'padding-left':'5px', 'padding-right':'5px', 'height':'100%'})
+                                ],
+                                id="tabs",
+                                active_tab="candlestick_graph_tab"
+                            ),
+                        ],
+                        style = {"height":"40px"}     
                         ),
                     ],
-                    style = {"height":"40px"}     
                     ),
                 ],
-                ),
-            ],
-            style = {"background-color":colours["off white"]}
-            ),  
-        ], md = 12
+                style = {"background-color":colours["off white"]}
+                ),  
+            ], md = 12
+            ),
+        ],
+        align = "center"
         ),
-    ],
-    align = "center"
-    ),
-    html.Br(),
-    dbc.Row([
-        dbc.Col([ #row 2, col 1
-            dbc.Card( #row 2, col 1 card container
-                dbc.CardBody([
-                    html.Div(children = [
-                        html.H5(
-                            children = "Ticker & Date Picker", 
-                            style = {'color':text_colours['off white'], 'display':'inline-block', 'vertical-align':'middle', 'padding':'5px'}
-                        ),
-                        html.Div([
-                            dcc.Dropdown(
-                                id = 'ticker_dropdown',
-                                options = unique_tickers,
-                                value = unique_tickers[0],
-                                style = {'height':'40px'}
-                            ), 
+        html.Br(),
+        dbc.Row([
+            dbc.Col([ #row 2, col 1
+                dbc.Card( #row 2, col 1 card container
+                    dbc.CardBody([
+                        html.Div(children = [
+                            html.H5(
+                                children = "Ticker & Date Picker", 
+                                style = {'color':text_colours['off white'], 'display':'inline-block', 'vertical-align':'middle', 'padding':'5px'}
+                            ),
+                            html.Div([
+                                dcc.Dropdown(
+                                    id = 'ticker_dropdown',
+                                    options = unique_tickers,
+                                    value = unique_tickers[0],
+                                    style = {'height':'40px'}
+                                ), 
+                            ],
+                            style = {'display':'inline-block', 'vertical-align':'middle', 'padding':'5px', 'width':'35%'}
+                            ),
+                            html.Div([
+                                dcc.DatePickerRange(
+                                    id = 'date_picker',
+                                    min_date_allowed = stock_data_index.min_date,
+                                    max_date_allowed = stock_data_index.max_date,
+                                    start_date = stock_data_index.min_date,
+                                    end_date = stock_data_index.max_date,
+                                    display_format = 'DD MMM YY',
+                                    start_date_placeholder_text = 'DD MMM YY',
+                                    style = {'height':'40px'} #https://community.plotly.com/t/change-size-of-datepicker/25286/3
+                                ),
+                            ],
+                            style = {'display':'inline-block', 'vertical-align':'middle', 'padding':'5px'}
+                            ),
                         ],
-                        style = {'display':'inline-block', 'vertical-align':'middle', 'padding':'5px', 'width':'35%'}
-                        ),
-                        html.Div([
-                            dcc.DatePickerRange(
-                                id = 'date_picker',
-                                min_date_allowed = all_tickers_stock_data['Date'].min(),
-                                max_date_allowed = all_tickers_stock_data['Date'].max(),
-                                start_date = all_tickers_stock_data['Date'].min(),
-                                end_date = all_tickers_stock_data['Date'].max(),
-                                display_format = 'DD MMM YY',
-                                start_date_placeholder_text = 'DD MMM YY',
-                                style = {'height':'40px'} #https://community.plotly.com/t/change-size-of-datepicker/25286/3
+                        style = {'display':'inline', 'height':'60px'}
+                        ),                    
+                    ],
+                    ), 
+                    style = {"background-color":colours["deep blue"]},
+                )
+            ], md = 9
+            ),
+            dbc.Col([ #row 2, col 2
+                dbc.Card( #row 2, col 2 card container
+                    dbc.CardBody([
+                        html.Div(children = [
+                            html.Div([
+                                dcc.Dropdown(
+                                    id = 'benchmark_dropdown',
+                                    placeholder = 'Benchmark Ticker',
+                                    style = {'height':'40px'}
+                                ), 
+                            ],
+                            style = {'display':'inline-block', 'vertical-align':'middle', 'padding':'5px', 'width':'100%'}
                             ),
                         ],
-                        style = {'display':'inline-block', 'vertical-align':'middle', 'padding':'5px'}
+                        style = {'display':'inline', 'height': '60px'}
                         ),
-                    ],
-                    style = {'display':'inline', 'height':'60px'}
-                    ),                    
-                ],
-                ), 
-                style = {"background-color":colours["deep blue"]},
-            )
-        ], md = 9
+                    ]), 
+                    style = {"background-color":colours["off white"]},
+                )
+            ], md = 3
+            ),
+        ],
+        align = "center",
         ),
-        dbc.Col([ #row 2, col 2
-            dbc.Card( #row 2, col 2 card container
-                dbc.CardBody([
-                    html.Div(children = [
-                        html.Div([
-                            dcc.Dropdown(
-                                id = 'benchmark_dropdown',
-                                placeholder = 'Benchmark Ticker',
-                                style = {'height':'40px'}
-                            ), 
+        html.Br(),
+        dbc.Row([
+            dbc.Col([ # portfolio row
+                dbc.Card( # portfolio card container
+                    dbc.CardBody([
+                        html.Div(children = [
+                            html.H5(
+                                children = "Portfolio", 
+                                style = {'color':text_colours['off white'], 'display':'inline-block', 'vertical-align':'middle', 'padding':'5px'}
+                            ),
+                            html.Div([
+                                dcc.Input(
+                                    id = 'portfolio_input',
+                                    type = 'text',
+                                    debounce = True, # the portfolio is defined on enter or on leaving the input, not on every key
+                                    placeholder = 'Tickers and weights, e.g. AAPL:0.5, MSFT:0.3, SPY:0.2',
+                                    style = {'height':'36px', 'width':'100%'}
+                                ),
+                            ],
+                            style = {'display':'inline-block', 'vertical-align':'middle', 'padding':'5px', 'width':'40%'}
+                            ),
+                            html.Div([
+                                dcc.Dropdown(
+                                    id = 'portfolio_rebalance_dropdown',
+                                    options = [{'label': 'Buy and hold', 'value': BUY_AND_HOLD}] + [{'label': f'Rebalance {label.lower()}', 'value': frequency} for frequency, label in pf.REBALANCE_LABELS.items()],
+                                    value = BUY_AND_HOLD,
+                                    clearable = False
+                                ),
+                            ],
+                            style = {'display':'inline-block', 'vertical-align':'middle', 'padding':'5px', 'width':'20%'}
+                            ),
+                            html.Span(id = 'portfolio_summary', style = {'color':text_colours['off white'], 'vertical-align':'middle', 'padding':'5px'}),
+                            dcc.Store(id = 'portfolio'), # holdings and rebalancing of the defined portfolio
                         ],
-                        style = {'display':'inline-block', 'vertical-align':'middle', 'padding':'5px', 'width':'100%'}
+                        style = {'display':'inline', 'height':'60px'}
                         ),
                     ],
-                    style = {'display':'inline', 'height': '60px'}
                     ),
-                ]), 
-                style = {"background-color":colours["off white"]},
-            )
-        ], md = 3
+                    style = {"background-color":colours["deep blue"]},
+                )
+            ], md = 12
+            ),
+        ],
+        align = "center",
         ),
-    ],
-    align = "center",
-    ),
-    html.Br(),
-    dbc.Row([
-        dbc.Col([ #row 3, col 1
-            dbc.Card( #row 3, col 1 card container
-                dbc.CardBody([
-                    html.Div(children = [
-                        dcc.Graph(
-                            id = "candlestick_graph", 
-                            responsive = True, 
-                            config={"displaylogo": True,
+        html.Br(),
+        dbc.Row([
+            dbc.Col([ #row 3, col 1
+                dbc.Card( #row 3, col 1 card container
+                    dbc.CardBody([
+                        html.Div(children = [
+                            html.Div([
+                                html.Label('Bar interval', style = {'padding-right':'5px'}),
+                                dcc.Dropdown(
+                                    id = 'bar_interval_dropdown',
+                                    options = [{'label': 'Auto', 'value': AUTO_BAR_INTERVAL}] + [{'label': label, 'value': interval} for interval, label in rs.INTERVAL_LABELS.items()],
+                                    value = AUTO_BAR_INTERVAL,
+                                    clearable = False,
+                                    style = {'width':'150px'}
+                                ),
+                            ],
+                            style = {'height':'30px', 'display':'flex', 'align-items':'center'}
+                            ),
+                            dcc.Graph(
+                                id = "candlestick_graph", 
+                                responsive = True, 
+                                config={"displaylogo": True,
+                                        'modeBarButtonsToRemove': [
+                                            'zoom2d',
+                                            'toggleSpikelines',
+                                            'pan2d',
+                                            'select2d',
+                                            'lasso2d',
+                                            'autoScale2d',
+                                            'hoverClosestCartesian',
+                                            'hoverCompareCartesian']
+                                       },
+                                style = {'height':'420px', 'width':'100%'}
+                            ),
+                            dcc.Store(id = 'candlestick_graph_inputs'), # inputs the displayed figure was built from
+                            dcc.Store(id = 'candlestick_graph_update'), # traces and layout overrides of the figure, drawn on its skeleton in the browser
+                        ],
+                        id = 'candlestick_graph_div',
+                        style = {'height':'400px', 'margin':'5px', 'display':'block'}
+                        ),
+                        html.Div(children = [
+                            dcc.Graph(
+                                id = 'price_line_graph', 
+                                responsive = True, 
+                                config={
+                                    "displaylogo": True,
                                     'modeBarButtonsToRemove': [
                                         'zoom2d',
                                         'toggleSpikelines',
@@ -155,133 +319,207 @@ app.layout = dbc.Container(children = [
                                         'autoScale2d',
                                         'hoverClosestCartesian',
                                         'hoverCompareCartesian']
-                                   },
-                            style = {'height':'450px', 'width':'100%'}
+                                },
+                                style = {'height':'450px', 'width':'100%'}
+                            ),
+                            dcc.Store(id = 'price_line_graph_inputs'), # inputs the displayed figure was built from
+                            dcc.Store(id = 'price_line_graph_update'), # traces and layout overrides of the figure, drawn on its skeleton in the browser
+                        ],
+                        id = 'price_line_graph_div',         
+                        style = {'height':'450px', 'margin':'5px', 'display':'none'}
                         ),
-                    ],
-                    id = 'candlestick_graph_div',
-                    style = {'height':'400px', 'margin':'5px', 'display':'block'}
-                    ),
-                    html.Div(children = [
-                        dcc.Graph(
-                            id = 'price_line_graph', 
-                            responsive = True, 
-                            config={
-                                "displaylogo": True,
-                                'modeBarButtonsToRemove': [
-                                    'zoom2d',
-                                    'toggleSpikelines',
-                                    'pan2d',
-                                    'select2d',
-                                    'lasso2d',
-                                    'autoScale2d',
-                                    'hoverClosestCartesian',
-                                    'hoverCompareCartesian']
-                            },
-                            style = {'height':'450px', 'width':'100%'}
+                        html.Div(children = [
+                            html.Div([
+                                html.Label('Rolling ETL window (trading days)', style = {'padding-right':'5px'}),
+                                dcc.Input(
+                                    id = 'returns_line_etl_window_input',
+                                    type = 'number',
+                                    placeholder = 'whole range', # empty: the ETL of the whole date range
+                                    min = 2,
+                                    step = 1,
+                                    debounce = True # only updating once the user has finished typing
+                                ),
+                            ],
+                            style = {'height':'30px'}
+                            ),
+                            dcc.Graph(
+                                id = 'returns_line_graph', 
+                                responsive = True, 
+                                config={
+                                    "displaylogo": True,
+                                    'modeBarButtonsToRemove': [
+                                        'zoom2d',
+                                        'toggleSpikelines',
+                                        'pan2d',
+                                        'select2d',
+                                        'lasso2d',
+                                        'autoScale2d',
+                                        'hoverClosestCartesian',
+                                        'hoverCompareCartesian']
+                                },
+                                style = {'height':'420px', 'width':'100%'}
+                            ), 
+                            dcc.Store(id = 'returns_line_graph_inputs'), # inputs the displayed figure was built from
+                            dcc.Store(id = 'returns_line_graph_update'), # traces and layout overrides of the figure, drawn on its skeleton in the browser
+                        ],
+                        id = 'returns_line_graph_div',         
+                        style = {'height':'450px', 'margin':'5px', 'display':'none'} 
+                        ),
+                        html.Div(children = [
+                            html.Div([
+                                html.Label('Rolling ETL window (trading days)', style = {'padding-right':'5px'}),
+                                dcc.Input(
+                                    id = 'returns_histogram_etl_window_input',
+                                    type = 'number',
+                                    placeholder = 'whole range', # empty: the ETL of the whole date range
+                                    min = 2,
+                                    step = 1,
+                                    debounce = True # only updating once the user has finished typing
+                                ),
+                            ],
+                            style = {'height':'30px'}
+                            ),
+                            dcc.Graph(
+                                id = 'returns_histogram_graph', 
+                                responsive = True, 
+                                config={
+                                    "displaylogo": True,
+                                    'modeBarButtonsToRemove': [
+                                        'zoom2d',
+                                        'toggleSpikelines',
+                                        'pan2d',
+                                        'select2d',
+                                        'lasso2d',
+                                        'autoScale2d',
+                                        'hoverClosestCartesian',
+                                        'hoverCompareCartesian']
+                                },
+                                style = {'height':'420px', 'width':'100%'}
+                            ), 
+                            dcc.Store(id = 'returns_histogram_graph_inputs'), # inputs the displayed figure was built from
+                            dcc.Store(id = 'returns_histogram_graph_update'), # traces and layout overrides of the figure, drawn on its skeleton in the browser
+                        ],
+                        id = 'returns_histogram_graph_div',         
+                        style = {'height':'450px', 'margin':'5px', 'display':'none'}
+                        ),
+                        html.Div(children = [
+                            dcc.Graph(
+                                id = 'correlation_heatmap_graph', 
+                                responsive = True, 
+                                config={
+                                    "displaylogo": True,
+                                    'modeBarButtonsToRemove': [
+                                        'zoom2d',
+                                        'toggleSpikelines',
+                                        'pan2d',
+                                        'select2d',
+                                        'lasso2d',
+                                        'autoScale2d',
+                                        'hoverClosestCartesian',
+                                        'hoverCompareCartesian']
+                                },
+                                style = {'height':'450px', 'width':'100%'}
+                            ), 
+                            dcc.Store(id = 'correlation_heatmap_graph_inputs'), # inputs the displayed figure was built from
+                        ],
+                        id = 'correlation_heatmap_graph_div',         
+                        style = {'height':'450px', 'margin':'5px', 'display':'none'}
+                        ),
+                        html.Div(children = [
+                            html.Div([
+                                html.Label('Rolling window (trading days)', style = {'padding-right':'5px'}),
+                                dcc.Input(
+                                    id = 'rolling_window_input',
+                                    type = 'number',
+                                    value = gf.DEFAULT_ROLLING_WINDOW,
+                                    min = 2,
+                                    step = 1,
+                                    debounce = True # only updating once the user has finished typing
+                                ),
+                            ],
+                            style = {'height':'30px'}
+                            ),
+                            dcc.Graph(
+                                id = 'rolling_statistics_graph', 
+                                responsive = True, 
+                                config={
+                                    "displaylogo": True,
+                                    'modeBarButtonsToRemove': [
+                                        'zoom2d',
+                                        'toggleSpikelines',
+                                        'pan2d',
+                                        'select2d',
+                                        'lasso2d',
+                                        'autoScale2d',
+                                        'hoverClosestCartesian',
+                                        'hoverCompareCartesian']
+                                },
+                                style = {'height':'420px', 'width':'100%'}
+                            ), 
+                            dcc.Store(id = 'rolling_statistics_graph_inputs'), # inputs the displayed figure was built from
+                        ],
+                        id = 'rolling_statistics_graph_div',         
+                        style = {'height':'450px', 'margin':'5px', 'display':'none'}
                         ),
                     ],
-                    id = 'price_line_graph_div',         
-                    style = {'height':'450px', 'margin':'5px', 'display':'none'}
-                    ),
-                    html.Div(children = [
-                        dcc.Graph(
-                            id = 'returns_line_graph', 
-                            responsive = True, 
-                            config={
-                                "displaylogo": True,
-                                'modeBarButtonsToRemove': [
-                                    'zoom2d',
-                                    'toggleSpikelines',
-                                    'pan2d',
-                                    'select2d',
-                                    'lasso2d',
-                                    'autoScale2d',
-                                    'hoverClosestCartesian',
-                                    'hoverCompareCartesian']
-                            },
-                            style = {'height':'450px', 'width':'100%'}
-                        ), 
-                    ],
-                    id = 'returns_line_graph_div',         
-                    style = {'height':'450px', 'margin':'5px', 'display':'none'} 
-                    ),
-                    html.Div(children = [
-                        dcc.Graph(
-                            id = 'returns_histogram_graph', 
-                            responsive = True, 
-                            config={
-                                "displaylogo": True,
-                                'modeBarButtonsToRemove': [
-                                    'zoom2d',
-                                    'toggleSpikelines',
-                                    'pan2d',
-                                    'select2d',
-                                    'lasso2d',
-                                    'autoScale2d',
-                                    'hoverClosestCartesian',
-                                    'hoverCompareCartesian']
-                            },
-                            style = {'height':'450px', 'width':'100%'}
-                        ), 
-                    ],
-                    id = 'returns_histogram_graph_div',         
-                    style = {'height':'450px', 'margin':'5px', 'display':'none'}
                     ),
-                ],
+                style = {"background-color":colours["funky stuff"]}
                 ),
-            style = {"background-color":colours["funky stuff"]}
+            ], md = 9
             ),
-        ], md = 9
-        ),
-        dbc.Col([ #row 3, col 2
-            dbc.Card( #row 3, col 2 card container
-                dbc.CardBody([
-                    html.Div(children = [
-                        dbc.Table(
-                            ht.table_header + ht.table_body, 
-                            id = 'all_tickers_df',
-                            bordered = True, 
-                            striped = True, 
-                            style = {'padding':'5px', 'height': '100%', 'width':'100%'}
+            dbc.Col([ #row 3, col 2
+                dbc.Card( #row 3, col 2 card container
+                    dbc.CardBody([
+                        html.Div(children = [
+                            dbc.Table(
+                                ht.table_header + ht.table_body, 
+                                id = 'all_tickers_df',
+                                bordered = True, 
+                                striped = True, 
+                                style = {'padding':'5px', 'height': '100%', 'width':'100%'}
+                            ),
+                        ],
+                        style = {'color':text_colours['off white'], 'height':'450px', 'overflow':'scroll'}
                         ),
-                    ],
-                    style = {'color':text_colours['off white'], 'height':'450px', 'overflow':'scroll'}
-                    ),
                     
-                ]), 
-            style = {"background-color":colours["off white"]}
+                    ]), 
+                style = {"background-color":colours["off white"]}
+                ),
+            ], md = 3
             ),
-        ], md = 3
+        ],
+        align = "center",
         ),
-    ],
-    align = "center",
-    ),
-    html.Br(),
-    dbc.Row([
-        dbc.Col([ #row 4, col 1
-            dbc.Card( #row 4, col 1 card container
-                   dbc.CardBody([
-                       html.Div([
-                           html.Pre(id='selected_data', style={'border': 'thin lightgrey solid', 'overflowX': 'scroll'})
+        html.Br(),
+        dbc.Row([
+            dbc.Col([ #row 4, col 1
+                dbc.Card( #row 4, col 1 card container
+                       dbc.CardBody([
+                           html.Div([
+                               html.Pre(id='selected_data', style={'border': 'thin lightgrey solid', 'overflowX': 'scroll'})
+                           ],
+                           ),  
                        ],
-                       ),  
-                   ],
-                   style = {"background-color":colours["off white"]}
-                   ),
+                       style = {"background-color":colours["off white"]}
+                       ),
+                ),
+            ],
             ),
         ],
         ),
-    ],
-    ),
+        dcc.Store(id = 'figure_skeletons', data = fs.client_skeletons()), # graph layouts, sent once per page load
     
-], 
-#style = {'overflow':'scroll'}
-)
+    ], 
+    #style = {'overflow':'scroll'}
+    )
+
+app.layout = serve_layout
 
 # CALLBACKS
+# UI-only callbacks run in the browser (assets/clientside_callbacks.js), so tab clicks and graph drags don't make a server request
 # updating start and end dates when users drag over graphs. Zoom out to return to original dates
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace = 'ui', function_name = 'display_selected_data'),
     Output('selected_data', 'children'),
     Output('date_picker', 'start_date'),
     Output('date_picker', 'end_date'),
@@ -289,257 +527,291 @@ app.layout = dbc.Container(children = [
     Input('candlestick_graph', 'relayoutData'),
     Input('price_line_graph', 'relayoutData'),
     Input('returns_line_graph', 'relayoutData'),
+    Input('rolling_statistics_graph', 'relayoutData'),
     Input('date_picker', 'start_date'),
-    Input('date_picker', 'end_date')
+    Input('date_picker', 'end_date'),
+    State('date_picker', 'min_date_allowed'),
+    State('date_picker', 'max_date_allowed')
 )
-def display_selected_data(active_tab, candlestick_relayout_data, price_line_relayout_data, returns_line_relayout_data, start_date, end_date):
-    '''
-    Logic in this function:
-    
-    - upon app initialisation start and end dates are none, so we don't want to throw an error
-    - once active tab is selected we want to update start and end date values if a user has dragged over the graph, i.e., xaxis.range[0] value is present in the relayoutData
-    - if the user hasn't dragged over the graph then the start and end dates should still be the min and max limits respectively. RelayoutData contains only "autosize":true
-    - if the user has double clicked on the graph to reset the axes then we want to reset the dates to the min and max limits. RelayoutData contains "xaxis.autorange":true at this point
-    
-    '''
-    if start_date is None and end_date is None:
-        start_date = all_tickers_stock_data['Date'].min()
-        end_date = all_tickers_stock_data['Date'].max()
-        return None, start_date, end_date
-    
-    elif active_tab == 'candlestick_graph_tab':
-        min_start_date = all_tickers_stock_data['Date'].min()
-        max_end_date = all_tickers_stock_data['Date'].max()
-        
-        # user dragged over graph
-        try:
-            start_date = candlestick_relayout_data['xaxis.range[0]']
-            end_date = candlestick_relayout_data['xaxis.range[1]']
-            return json.dumps(candlestick_relayout_data, indent=2), start_date, end_date 
-            
-        except KeyError:
-            #double clicked graph
-            try: 
-                # test for KeyError
-                key_test = candlestick_relayout_data['xaxis.autorange']
-                # returning date limits
-                return json.dumps(candlestick_relayout_data, indent=2), min_start_date, max_end_date
-            
-            # no/other graph action
-            except KeyError:
-                return json.dumps(candlestick_relayout_data, indent=2), start_date, end_date
-        
-    elif active_tab == 'price_line_graph_tab':
-        min_start_date = all_tickers_stock_data['Date'].min()
-        max_end_date = all_tickers_stock_data['Date'].max()
-        
-        try:
-            start_date = price_line_relayout_data['xaxis.range[0]']
-            end_date = price_line_relayout_data['xaxis.range[1]']
-            return json.dumps(price_line_relayout_data, indent=2), start_date, end_date
-            
-        except KeyError:
-            try:
-                key_test = price_line_relayout_data['xaxis.autorange']
-                return json.dumps(price_line_relayout_data, indent=2), min_start_date, max_end_date
-            except KeyError:
-                return json.dumps(price_line_relayout_data, indent=2), start_date, end_date
-    
-    elif active_tab == 'returns_line_graph_tab':
-        min_start_date = all_tickers_stock_data['Date'].min()
-        max_end_date = all_tickers_stock_data['Date'].max()
-        
-        try:
-            start_date = returns_line_relayout_data['xaxis.range[0]']
-            end_date = returns_line_relayout_data['xaxis.range[1]']
-            return json.dumps(returns_line_relayout_data, indent=2), start_date, end_date
-            
-        except KeyError:
-            try:
-                key_test = returns_line_relayout_data['xaxis.autorange']
-                return json.dumps(returns_line_relayout_data, indent=2), min_start_date, max_end_date
-            
-            except KeyError:
-                return json.dumps(returns_line_relayout_data, indent=2), start_date, end_date
-            
-    else:
-        return None, start_date, end_date
-        
 
 # updating colour of active label (Tabs)
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace = 'ui', function_name = 'update_label_style'),
     Output('candlestick_graph_tab', 'label_style'),
     Output('price_line_graph_tab', 'label_style'),
     Output('returns_line_graph_tab', 'label_style'),
     Output('returns_histogram_graph_tab', 'label_style'),
+    Output('correlation_heatmap_graph_tab', 'label_style'),
+    Output('rolling_statistics_graph_tab', 'label_style'),
     Input('tabs', 'active_tab')
 )
-def update_label_style(active_tab):
-    
-    candlestick_tab_color = {"background-color":colours["deep blue"], "color":text_colours['off white']}
-    price_line_tab_color = {"background-color":colours["deep blue"], "color":text_colours['off white']}
-    returns_line_tab_color = {"background-color":colours["deep blue"], "color":text_colours['off white']}
-    returns_histogram_tab_color = {"background-color":colours["deep blue"], "color":text_colours['off white']}
-    
-    if active_tab == 'candlestick_graph_tab':
-        candlestick_tab_color = {"background-color":colours["funky stuff"], "color":text_colours['off white']}
-    elif active_tab == 'price_line_graph_tab':
-        price_line_tab_color = {"background-color":colours["funky stuff"], "color":text_colours['off white']}
-    elif active_tab == 'returns_line_graph_tab':
-        returns_line_tab_color = {"background-color":colours["funky stuff"], "color":text_colours['off white']}
-    elif active_tab == 'returns_histogram_graph_tab':
-        returns_histogram_tab_color = {"background-color":colours["funky stuff"], "color":text_colours['off white']}
 
-    return candlestick_tab_color, price_line_tab_color, returns_line_tab_color, returns_histogram_tab_color
+
+# graph callbacks send their figure's traces and layout overrides, which are drawn on the figure's skeleton layout in the browser
+for graph in ('candlestick_graph', 'price_line_graph', 'returns_line_graph', 'returns_histogram_graph'):
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'ui', function_name = 'apply_figure_update'),
+        Output(graph, 'figure'),
+        Input(f'{graph}_update', 'data'),
+        State('figure_skeletons', 'data')
+    )
+
+# graphs are only built for the active tab. Hidden graphs stay stale until their tab is opened, and a graph is not rebuilt
+# when its tab is reopened with the same inputs (dataset version included) it was last built from (kept in the graph's dcc.Store)
+def graph_needs_update(active_tab: str, graph_tab: str, graph_inputs: list, built_inputs: list) -> bool:
+    return active_tab == graph_tab and graph_inputs != built_inputs
 
 
 #updating the candlestick graph based on date and ticker parameters
 @app.callback(
-    Output('candlestick_graph', 'figure'), # need to parse the in the arguments needed to generate the graph (this is a 'figure')
+    Output('candlestick_graph_update', 'data'), # need to parse the in the arguments needed to generate the graph (drawn as a 'figure' in the browser)
+    Output('candlestick_graph_inputs', 'data'),
+    Input('tabs', 'active_tab'),
     Input('ticker_dropdown', 'value'),
     Input('date_picker', 'start_date'),
     Input('date_picker', 'end_date'),
+    Input('bar_interval_dropdown', 'value'),
+    State('candlestick_graph_inputs', 'data'),
+    State('portfolio', 'data')
 )
-def candlestick_graph_display(ticker, start_date, end_date):
+def candlestick_graph_display(active_tab, ticker, start_date, end_date, bar_interval, built_inputs, portfolio_data):
     '''
-    first create the required dataframe, then returned outputs based on buttons will return the graphs/tables.
-    
-    we slice the dataframe according to date parameters within this callback function, instead of the graph generation function.
+    the graph generation function slices the ticker's rows for the date range through the dataset index.
+    Candles are drawn from the stored bars (intraday bars for an intraday store), at the selected interval or coarser.
     '''
-
-    # create filtered dataframe from all stocks dataframe read in from CSV
-    returned_df = all_tickers_stock_data.loc[all_tickers_stock_data['Ticker'] == ticker].set_index('Date') # set index on date for slicing. used to be all_tickers_stock_data[all_tickers_stock_data['Ticker'] == ticker].set_index('Date')
-    returned_df = returned_df[start_date : end_date] # filter dataframe on start and end date
-    
-    # dropping index so that the dataframe in Dash displays the date column
-    returned_df.reset_index(inplace = True)
-    
-    # candlestick figure
-    candlestick_figure = gf.create_candlestick_graph(returned_df)
+    stock_data_index = data_index_for(portfolio_data, ticker)
+    # a portfolio's candles come from its daily rows, any other ticker's from the stored bars
+    if not isinstance(stock_data_index, pf.PortfolioIndex):
+        stock_data_index = live_dataset.bars_index()
+    graph_inputs = [stock_data_index.dataset_version, ticker, start_date, end_date, bar_interval]
+    if not graph_needs_update(active_tab, 'candlestick_graph_tab', graph_inputs, built_inputs):
+        raise PreventUpdate
+    # dropping the request if a newer one from the same session (e.g. a later point of a drag) has arrived
+    request_coalescer.raise_if_superseded('candlestick_graph_display')
+    
+    # candlestick figure, 'Auto' picks the finest interval that fits the date range
+    interval = None if bar_interval == AUTO_BAR_INTERVAL else bar_interval
+    candlestick_figure = create_candlestick_graph(stock_data_index, ticker, start_date, end_date, interval = interval)
     
     # return figure
-    return candlestick_figure
+    return fs.partial_update(candlestick_figure), graph_inputs
 
 # updating the price line graph figure based on dates, ticker and benchmark ticker parameters
 @app.callback(
-    Output('price_line_graph', 'figure'),
+    Output('price_line_graph_update', 'data'),
+    Output('price_line_graph_inputs', 'data'),
+    Input('tabs', 'active_tab'),
     Input('ticker_dropdown', 'value'),
     Input('benchmark_dropdown', 'value'),
     Input('date_picker', 'start_date'),
-    Input('date_picker', 'end_date')
+    Input('date_picker', 'end_date'),
+    State('price_line_graph_inputs', 'data'),
+    State('portfolio', 'data')
 )
-def price_line_graph_display(ticker, benchmark_ticker, start_date, end_date):
+def price_line_graph_display(active_tab, ticker, benchmark_ticker, start_date, end_date, built_inputs, portfolio_data):
     '''
-    first create the required dataframe, then returned outputs based on buttons will return the graphs/tables.
-    
-    we slice the dataframe according to date parameters within this callback function, instead of within the graph generation function.
+    the graph generation function slices the ticker and benchmark rows for the date range through the dataset index.
     '''
-    # create filtered dataframe from all stocks dataframe read in from CSV
-    returned_df = all_tickers_stock_data.loc[:, ['Date', 'Ticker', 'Close']].set_index('Date') # set index on date for slicing on dataframe copy (.loc[])
-    returned_df = returned_df[start_date : end_date] # filter dataframe on start and end date
-    
-    # dropping index so that the dataframe in Dash displays the date column
-    returned_df.reset_index(inplace = True)
+    stock_data_index = data_index_for(portfolio_data, ticker, benchmark_ticker)
+    graph_inputs = [stock_data_index.dataset_version, ticker, benchmark_ticker, start_date, end_date]
+    if not graph_needs_update(active_tab, 'price_line_graph_tab', graph_inputs, built_inputs):
+        raise PreventUpdate
+    # dropping the request if a newer one from the same session (e.g. a later point of a drag) has arrived
+    request_coalescer.raise_if_superseded('price_line_graph_display')
     
     # price line graph figure
-    price_line_graph_figure = gf.create_price_line_graph(returned_df, ticker, benchmark_ticker)
+    price_line_graph_figure = create_price_line_graph(stock_data_index, ticker, benchmark_ticker, start_date, end_date)
     
-    return price_line_graph_figure
+    return fs.partial_update(price_line_graph_figure), graph_inputs
 
-# updating the returns line graph figure based on dates, ticker and benchmark ticker parameters
+# updating the returns line graph figure based on dates, ticker, benchmark ticker and rolling ETL window parameters
 @app.callback(
-    Output('returns_line_graph', 'figure'),
+    Output('returns_line_graph_update', 'data'),
+    Output('returns_line_graph_inputs', 'data'),
+    Input('tabs', 'active_tab'),
     Input('ticker_dropdown', 'value'),
     Input('benchmark_dropdown', 'value'),
     Input('date_picker', 'start_date'),
-    Input('date_picker', 'end_date')
+    Input('date_picker', 'end_date'),
+    Input('returns_line_etl_window_input', 'value'),
+    State('returns_line_graph_inputs', 'data'),
+    State('portfolio', 'data')
 )
-def returns_line_graph_display(ticker, benchmark_ticker, start_date, end_date):
+def returns_line_graph_display(active_tab, ticker, benchmark_ticker, start_date, end_date, etl_window, built_inputs, portfolio_data):
     '''
-    first create the required dataframe, then returned outputs based on buttons will return the graphs/tables.
-    
-    we slice the dataframe according to date parameters within this callback function, instead of within the graph generation function.
+    the graph generation function slices the ticker and benchmark rows for the date range through the dataset index.
     '''
-    # create filtered dataframe from all stocks dataframe read in from CSV
-    returned_df = all_tickers_stock_data.loc[:, ['Date', 'Ticker', 'Daily Returns %']].set_index('Date') # set index on date for slicing on dataframe copy (.loc[])
-    returned_df = returned_df[start_date : end_date] # filter dataframe on start and end date
-    
-    # dropping index so that the dataframe in Dash displays the date column
-    returned_df.reset_index(inplace = True)
+    # an empty window input (None, also while the user is editing it) plots the ETL of the whole date range
+    etl_window = int(etl_window) if etl_window is not None else None
+    if etl_window is not None and etl_window < 2:
+        raise PreventUpdate
+    
+    stock_data_index = data_index_for(portfolio_data, ticker, benchmark_ticker)
+    graph_inputs = [stock_data_index.dataset_version, ticker, benchmark_ticker, start_date, end_date, etl_window]
+    if not graph_needs_update(active_tab, 'returns_line_graph_tab', graph_inputs, built_inputs):
+        raise PreventUpdate
+    # dropping the request if a newer one from the same session (e.g. a later point of a drag) has arrived
+    request_coalescer.raise_if_superseded('returns_line_graph_display')
     
     # returns line graph figure
-    returns_line_graph_figure = gf.create_returns_line_graph(returned_df, ticker, benchmark_ticker)
+    returns_line_graph_figure = create_returns_line_graph(stock_data_index, ticker, benchmark_ticker, start_date, end_date, etl_window = etl_window)
     
-    return returns_line_graph_figure
+    return fs.partial_update(returns_line_graph_figure), graph_inputs
 
-# updating the returns histogram figure based on dates, ticker and benchmark ticker parameters
+# updating the returns histogram figure based on dates, ticker, benchmark ticker and rolling ETL window parameters
 @app.callback(
-    Output('returns_histogram_graph', 'figure'),
+    Output('returns_histogram_graph_update', 'data'),
+    Output('returns_histogram_graph_inputs', 'data'),
+    Input('tabs', 'active_tab'),
     Input('ticker_dropdown', 'value'),
     Input('benchmark_dropdown', 'value'),
     Input('date_picker', 'start_date'),
-    Input('date_picker', 'end_date')
+    Input('date_picker', 'end_date'),
+    Input('returns_histogram_etl_window_input', 'value'),
+    State('returns_histogram_graph_inputs', 'data'),
+    State('portfolio', 'data')
 )
-def returns_histogram_graph_display(ticker, benchmark_ticker, start_date, end_date):
+def returns_histogram_graph_display(active_tab, ticker, benchmark_ticker, start_date, end_date, etl_window, built_inputs, portfolio_data):
     '''
-    first create the required dataframe, then returned outputs based on buttons will return the graphs/tables.
+    the graph generation function slices the ticker and benchmark rows for the date range through the dataset index.
+    '''
+    # an empty window input (None, also while the user is editing it) plots the ETL of the whole date range
+    etl_window = int(etl_window) if etl_window is not None else None
+    if etl_window is not None and etl_window < 2:
+        raise PreventUpdate
+    
+    stock_data_index = data_index_for(portfolio_data, ticker, benchmark_ticker)
+    graph_inputs = [stock_data_index.dataset_version, ticker, benchmark_ticker, start_date, end_date, etl_window]
+    if not graph_needs_update(active_tab, 'returns_histogram_graph_tab', graph_inputs, built_inputs):
+        raise PreventUpdate
+    # dropping the request if a newer one from the same session (e.g. a later point of a drag) has arrived
+    request_coalescer.raise_if_superseded('returns_histogram_graph_display')
+    
+    # histogram graph figure
+    returns_histogram_graph_figure = create_returns_histogram(stock_data_index, ticker, benchmark_ticker, start_date, end_date, etl_window = etl_window)
     
-    we slice the dataframe according to date parameters within this callback function, instead of within the graph generation function.
+    return fs.partial_update(returns_histogram_graph_figure), graph_inputs
+
+# updating the correlation heatmap figure based on dates and the ticker (which picks the tickers shown in large universes)
+@app.callback(
+    Output('correlation_heatmap_graph', 'figure'),
+    Output('correlation_heatmap_graph_inputs', 'data'),
+    Input('tabs', 'active_tab'),
+    Input('ticker_dropdown', 'value'),
+    Input('date_picker', 'start_date'),
+    Input('date_picker', 'end_date'),
+    State('correlation_heatmap_graph_inputs', 'data'),
+    State('portfolio', 'data')
+)
+def correlation_heatmap_graph_display(active_tab, ticker, start_date, end_date, built_inputs, portfolio_data):
+    '''
+    the all-pairs matrices for the date range are computed once and cached, so changing ticker only re-draws the heatmap.
     '''
-    # create filtered dataframe from all stocks dataframe read in from CSV
-    returned_df = all_tickers_stock_data.loc[:, ['Date', 'Ticker', 'Daily Returns %']].set_index('Date') # set index on date for slicing on dataframe copy (.loc[])
-    returned_df = returned_df[start_date : end_date] # filter dataframe on start and end date
+    stock_data_index = data_index_for(portfolio_data, ticker)
+    graph_inputs = [stock_data_index.dataset_version, ticker, start_date, end_date]
+    if not graph_needs_update(active_tab, 'correlation_heatmap_graph_tab', graph_inputs, built_inputs):
+        raise PreventUpdate
+    # dropping the request if a newer one from the same session (e.g. a later point of a drag) has arrived
+    request_coalescer.raise_if_superseded('correlation_heatmap_graph_display')
     
-    # dropping index so that the dataframe in Dash displays the date column
-    returned_df.reset_index(inplace = True)
+    # heatmap figure
+    correlation_heatmap_figure = create_correlation_heatmap(stock_data_index, ticker, start_date, end_date)
     
-    # histogram graph figure
-    returns_histogram_graph_figure = gf.create_returns_histogram(returned_df, ticker, benchmark_ticker)
+    return correlation_heatmap_figure, graph_inputs
+
+# updating the rolling statistics graph figure based on dates, ticker, benchmark ticker and rolling window parameters
+@app.callback(
+    Output('rolling_statistics_graph', 'figure'),
+    Output('rolling_statistics_graph_inputs', 'data'),
+    Input('tabs', 'active_tab'),
+    Input('ticker_dropdown', 'value'),
+    Input('benchmark_dropdown', 'value'),
+    Input('date_picker', 'start_date'),
+    Input('date_picker', 'end_date'),
+    Input('rolling_window_input', 'value'),
+    State('rolling_statistics_graph_inputs', 'data'),
+    State('portfolio', 'data')
+)
+def rolling_statistics_graph_display(active_tab, ticker, benchmark_ticker, start_date, end_date, window, built_inputs, portfolio_data):
+    '''
+    the rolling series are computed from prefix sums over the ticker's history, so any window length costs the same.
+    '''
+    # the input is empty (None) while the user is editing it, or below its minimum
+    if window is None or window < 2:
+        raise PreventUpdate
     
-    return returns_histogram_graph_figure
+    stock_data_index = data_index_for(portfolio_data, ticker, benchmark_ticker)
+    graph_inputs = [stock_data_index.dataset_version, ticker, benchmark_ticker, start_date, end_date, int(window)]
+    if not graph_needs_update(active_tab, 'rolling_statistics_graph_tab', graph_inputs, built_inputs):
+        raise PreventUpdate
+    # dropping the request if a newer one from the same session (e.g. a later point of a drag) has arrived
+    request_coalescer.raise_if_superseded('rolling_statistics_graph_display')
+    
+    # rolling statistics figure
+    rolling_statistics_figure = create_rolling_statistics_graph(stock_data_index, ticker, benchmark_ticker, start_date, end_date, int(window))
+    
+    return rolling_statistics_figure, graph_inputs
+
+
+# defining a portfolio, added to the ticker dropdown as a pseudo-ticker and selected
+@app.callback(
+    Output('portfolio', 'data'),
+    Output('portfolio_summary', 'children'),
+    Output('ticker_dropdown', 'options'),
+    Output('ticker_dropdown', 'value'),
+    Input('portfolio_input', 'value'),
+    Input('portfolio_rebalance_dropdown', 'value'),
+    State('ticker_dropdown', 'value'),
+    prevent_initial_call = True
+)
+def define_portfolio(portfolio_definition, rebalance, ticker):
+
+    stock_data_index = live_dataset.index()
+    ticker_options = list(stock_data_index.tickers)
+    # a ticker still selected after the portfolio is removed or replaced stays selected
+    selected_ticker = ticker if ticker in stock_data_index else ticker_options[0]
+
+    if not portfolio_definition or not portfolio_definition.strip():
+        return None, '', ticker_options, selected_ticker
+    try:
+        portfolio = pf.parse_portfolio(portfolio_definition, stock_data_index, None if rebalance == BUY_AND_HOLD else rebalance)
+    except ValueError as error:
+        return None, str(error), ticker_options, selected_ticker
+
+    # mean and variance (w'Σw) of holding the target weights every day, over the constituents' whole history
+    moments = pf.constant_weight_moments(stock_data_index, portfolio)
+    portfolio_summary = f"Constant weights: mean daily return {moments['mean_daily_return']:.2f}%, variance {moments['var_daily_return']:.4f}"
+
+    return portfolio.to_dict(), portfolio_summary, [{'label': 'Portfolio', 'value': portfolio.ticker}] + ticker_options, portfolio.ticker
 
 
 # disabling primary ticker from benchmark ticker options
 @app.callback(
     Output('benchmark_dropdown', 'options'), #determining the values of the benchmark dropdown. Everything exlcuding the primary selected ticker
-    Input('ticker_dropdown', 'value')
+    Input('ticker_dropdown', 'value'),
+    Input('ticker_dropdown', 'options') # the tickers, and the portfolio when one is defined
 )
 
-def benchmark_ticker_options(primary_ticker):
+def benchmark_ticker_options(primary_ticker, primary_ticker_options):
     
     # list comprehension creating list of dictionaries that form the argument for the dcc.Dropdown function
-    ticker_options = [{'label': ticker, 'value': ticker} if ticker != primary_ticker else {'label': ticker, 'value': ticker, 'disabled': True} for ticker in unique_tickers]
+    primary_ticker_options = [option if isinstance(option, dict) else {'label': option, 'value': option} for option in primary_ticker_options]
+    ticker_options = [option if option['value'] != primary_ticker else {**option, 'disabled': True} for option in primary_ticker_options]
     
     return ticker_options
 
 
 # tab selection determining displayed graph
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace = 'ui', function_name = 'show_candlestick_or_line_graph'),
     Output('candlestick_graph_div', 'style'),
     Output('price_line_graph_div', 'style'),
     Output('returns_line_graph_div', 'style'),
     Output('returns_histogram_graph_div', 'style'),
+    Output('correlation_heatmap_graph_div', 'style'),
+    Output('rolling_statistics_graph_div', 'style'),
     Input('tabs', 'active_tab')
 )
-def show_candlestick_or_line_graph(active_tab):
-    candlestick_style = {'display': 'none'}
-    price_line_graph_style = {'display': 'none'}
-    returns_line_graph_style = {'display': 'none'}
-    returns_histogram_graph_style = {'display': 'none'}   
-    
-    if active_tab == 'candlestick_graph_tab':
-        candlestick_style = {'display': 'block'}
-        
-    elif active_tab == 'price_line_graph_tab':
-        price_line_graph_style = {'display': 'block'}
-    
-    elif active_tab == 'returns_line_graph_tab':
-        returns_line_graph_style = {'display': 'block'}
-    
-    elif active_tab == 'returns_histogram_graph_tab':
-        returns_histogram_graph_style = {'display': 'block'}
-        
-    return candlestick_style, price_line_graph_style, returns_line_graph_style, returns_histogram_graph_style
 
 # table values being updated
 @app.callback(
@@ -560,50 +832,53 @@ def show_candlestick_or_line_graph(active_tab):
     Input('ticker_dropdown', 'value'),
     Input('date_picker', 'start_date'),
     Input('date_picker', 'end_date'),
-    Input('benchmark_dropdown', 'value')
+    Input('benchmark_dropdown', 'value'),
+    State('portfolio', 'data')
 )
-def update_table_values(ticker, start_date, end_date, benchmark_ticker):
+def update_table_values(ticker, start_date, end_date, benchmark_ticker, portfolio_data):
     
     '''
     could adapt this to only recalculate depending on what values change (e.g. if benchmark ticker changes then no
     need to recalculate the data points pertaining to the primary ticker only metrics such as mean return or volume.)
     '''
         
-    # create filtered dataframe from all stocks dataframe read in from CSV
-    stock_data = all_tickers_stock_data.set_index('Date') # set index on date for slicing
-    stock_data = stock_data[start_date : end_date] # filter dataframe on start and end date
-    # dropping index so that the dataframe in Dash displays the date column
-    stock_data.reset_index(inplace = True)
+    # dropping the request if a newer one from the same session (e.g. a later point of a drag) has arrived
+    request_coalescer.raise_if_superseded('update_table_values')
+
+    # one index for the whole callback, so every value comes from the same dataset version
+    stock_data_index = data_index_for(portfolio_data, ticker, benchmark_ticker)
+
+    # the values are calculated in utils/table_metrics.py (shared with the batch report) and rounded for display
+    ticker_values = tm.ticker_metrics(stock_data_index, ticker, start_date, end_date)
+    mean_daily_return = round(ticker_values['mean_daily_return'], 2)
+    var_daily_return = round(ticker_values['var_daily_return'], 4)
+    mean_volume = round(ticker_values['mean_volume'], 0)
+    etl_5_percent = round(ticker_values['etl_5_percent'], 2)
     
     if benchmark_ticker == None:
         
-        mean_daily_return = round(cf.mean(data = stock_data[stock_data['Ticker'] == ticker], col = 'Daily Returns %'), 2)
-        var_daily_return = round(cf.variance(data = stock_data[stock_data['Ticker'] == ticker], col = 'Daily Returns %'), 4)
-        mean_volume = round(cf.mean(data = stock_data[stock_data['Ticker'] == ticker], col = 'Volume'), 0)
-        etl_5_percent = round(cf.etl_5_percent_daily_returns(stock_data[stock_data['Ticker'] == ticker]), 2)
-        
         return ticker, mean_daily_return, var_daily_return, mean_volume, etl_5_percent, None, None, None, None, None, None, None, None, None
     
     else:
         
-        mean_daily_return = round(cf.mean(data = stock_data[stock_data['Ticker'] == ticker], col = 'Daily Returns %'), 2)
-        var_daily_return = round(cf.variance(data = stock_data[stock_data['Ticker'] == ticker], col = 'Daily Returns %'), 4)
-        mean_volume = round(cf.mean(data = stock_data[stock_data['Ticker'] == ticker], col = 'Volume'), 0)
-        etl_5_percent = round(cf.etl_5_percent_daily_returns(stock_data[stock_data['Ticker'] == ticker]), 2)
-        covariance = round(cf.covariance_daily_returns(data = stock_data, ticker = ticker, benchmark_ticker = benchmark_ticker), 4)
-        correlation = round(cf.correlation_daily_returns(data = stock_data, ticker = ticker, benchmark_ticker = benchmark_ticker), 4)
-        beta = round(cf.beta_daily_returns(data = stock_data, ticker = ticker, benchmark_ticker = benchmark_ticker), 4)
-        trading_day_count = cf.trading_days(data = stock_data, ticker = ticker, benchmark_ticker = benchmark_ticker)[0]
-        both_open_high = cf.trading_days(data = stock_data, ticker = ticker, benchmark_ticker = benchmark_ticker)[1]
-        both_open_low = cf.trading_days(data = stock_data, ticker = ticker, benchmark_ticker = benchmark_ticker)[2]
-        stock_high_benchmark_low = cf.trading_days(data = stock_data, ticker = ticker, benchmark_ticker = benchmark_ticker)[3]
-        stock_low_benchmark_high = cf.trading_days(data = stock_data, ticker = ticker, benchmark_ticker = benchmark_ticker)[4]
+        pair_values = tm.pair_metrics(stock_data_index, ticker, benchmark_ticker, start_date, end_date)
+        covariance = round(pair_values['covariance'], 4)
+        correlation = round(pair_values['correlation'], 4)
+        beta = round(pair_values['beta'], 4)
         
-        return ticker, mean_daily_return, var_daily_return, mean_volume, etl_5_percent, benchmark_ticker, covariance, correlation, beta, trading_day_count, both_open_high, both_open_low, stock_high_benchmark_low, stock_low_benchmark_high
+        return (ticker, mean_daily_return, var_daily_return, mean_volume, etl_5_percent, benchmark_ticker, covariance, correlation, beta,
+                *[pair_values[metric] for metric in ['trading_day_count', 'both_open_high', 'both_open_low', 'stock_high_benchmark_low', 'stock_low_benchmark_high']])
     
-  
-# running the app
-app.run_server(debug=True, use_reloader=False)  # Turn off reloading of the web app when the code changes
 
+
+# per-callback latency, payload and call count metrics, served at /metrics
+if metrics_enabled:
+    im.instrument_app(app)
+    im.metrics.add_gauges(lambda: {f'figure_cache_{name}': value for name, value in figure_cache.stats().items() if isinstance(value, int)})
+    im.metrics.add_gauges(lambda: {f'request_coalescer_{name}': value for name, value in request_coalescer.stats().items()})
+    im.metrics.add_gauges(lambda: {f'stats_api_{name}': value for name, value in stats_api.stats().items() if isinstance(value, int)})
+
+  
+# running the app with the development server (python app.py). For production serve wsgi.py, e.g. gunicorn -c gunicorn.conf.py wsgi:server
 if __name__ == '__main__':
-    app.run_server(debug=True)
\ No newline at end of file
+    app.run_server(debug=True, use_reloader=False)  # Turn off reloading of the web app when the code changes
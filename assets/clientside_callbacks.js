@@ -0,0 +1,102 @@
+/*
+CLIENTSIDE CALLBACKS
+
+Pure UI callbacks that run in the browser instead of making a request to the Dash server.
+Dash loads every .js file in the assets folder, and app.py registers these functions with ClientsideFunction(namespace = 'ui', ...).
+*/
+
+// colours from app.py ('deep blue', 'funky stuff' and text 'off white')
+const DEEP_BLUE = '#010521';
+const FUNKY_STUFF = '#04b1c4';
+const OFF_WHITE = '#f2f4f7';
+
+const GRAPH_TABS = ['candlestick_graph_tab', 'price_line_graph_tab', 'returns_line_graph_tab', 'returns_histogram_graph_tab', 'correlation_heatmap_graph_tab', 'rolling_statistics_graph_tab'];
+
+// base with the overrides applied, recursing into nested objects. Only the objects on the overridden paths are copied, so the stored skeleton isn't changed
+function merge_layout(base, overrides) {
+    const result = Object.assign({}, base);
+    Object.keys(overrides || {}).forEach(function(key) {
+        const value = overrides[key];
+        const is_object = value !== null && typeof value === 'object' && !Array.isArray(value);
+        const base_is_object = result[key] !== null && typeof result[key] === 'object' && !Array.isArray(result[key]);
+        result[key] = is_object && base_is_object ? merge_layout(result[key], value) : value;
+    });
+    return result;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ui: {
+        // updating colour of active label (Tabs)
+        update_label_style: function(active_tab) {
+            return GRAPH_TABS.map(function(tab) {
+                return {'background-color': tab === active_tab ? FUNKY_STUFF : DEEP_BLUE, 'color': OFF_WHITE};
+            });
+        },
+
+        // tab selection determining displayed graph
+        show_candlestick_or_line_graph: function(active_tab) {
+            return GRAPH_TABS.map(function(tab) {
+                return {'display': tab === active_tab ? 'block' : 'none'};
+            });
+        },
+
+        /*
+        updating start and end dates when users drag over graphs. Zoom out to return to original dates
+
+        - upon app initialisation start and end dates are none, so we set them to the min and max limits
+        - if a user has dragged over the active tab's graph, i.e., xaxis.range[0] is present in the relayoutData, the dates become the dragged range
+        - if the user has double clicked on the graph to reset the axes ("xaxis.autorange":true) the dates are reset to the min and max limits
+        - any other graph action (e.g. "autosize":true) leaves the dates as they are
+        */
+        display_selected_data: function(active_tab, candlestick_relayout_data, price_line_relayout_data, returns_line_relayout_data, rolling_statistics_relayout_data, start_date, end_date, min_date, max_date) {
+            if (start_date == null && end_date == null) {
+                return [null, min_date, max_date];
+            }
+
+            const relayout_data = {
+                'candlestick_graph_tab': candlestick_relayout_data,
+                'price_line_graph_tab': price_line_relayout_data,
+                'returns_line_graph_tab': returns_line_relayout_data,
+                'rolling_statistics_graph_tab': rolling_statistics_relayout_data
+            }[active_tab];
+
+            // histogram and heatmap tabs (no date axis), or the graph hasn't been drawn yet
+            if (relayout_data === undefined) {
+                return [null, start_date, end_date];
+            }
+            if (relayout_data === null) {
+                return window.dash_clientside.no_update;
+            }
+
+            const selected_data = JSON.stringify(relayout_data, null, 2);
+
+            // user dragged over graph
+            if ('xaxis.range[0]' in relayout_data) {
+                return [selected_data, relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']];
+            }
+            // double clicked graph
+            if ('xaxis.autorange' in relayout_data) {
+                return [selected_data, min_date, max_date];
+            }
+            // no/other graph action
+            return [selected_data, start_date, end_date];
+        },
+
+        /*
+        drawing a graph callback's update (see utils/figure_skeletons.py) on its skeleton layout
+
+        - a skeleton update has the skeleton name, the traces and the layout overrides, merged into a copy of the skeleton layout
+        - any other figure is sent whole, as {figure: ...}
+        */
+        apply_figure_update: function(update, skeletons) {
+            if (update == null) {
+                return window.dash_clientside.no_update;
+            }
+            if (update.figure !== undefined) {
+                return update.figure;
+            }
+            const layout = merge_layout(Object.assign({template: skeletons.template}, skeletons.layouts[update.skeleton]), update.layout);
+            return {data: update.data, layout: layout};
+        }
+    }
+});
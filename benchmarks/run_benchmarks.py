@@ -0,0 +1,284 @@
+'''
+BENCHMARKS
+
+Times every function in utils/calculation_functions.py, every figure builder in utils/graph_functions.py (plus the size
+and time of serializing its figure to JSON, as built, in the app's compact encoding and as the partial update a graph callback sends) and every server-side app.py callback, on synthetic data at a chosen scale
+(see benchmarks/synthetic_data.py). Results are written as JSON, and can be compared against an earlier results file to
+fail on regressions.
+
+Running from the command line:
+    python -m benchmarks.run_benchmarks --scale small
+    python -m benchmarks.run_benchmarks --scale medium --compare benchmarks/results/medium_baseline.json --max-regression 0.25
+
+The synthetic stores are written to benchmarks/data on first use and reused afterwards.
+'''
+import argparse
+import datetime
+import gzip
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, List, Tuple
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+from benchmarks.synthetic_data import SCALES, synthetic_store
+from utils import calculation_functions as cf
+from utils import cross_section as cs
+from utils import data_store as ds
+from utils import figure_encoding as fe
+from utils import figure_skeletons as fs
+from utils import graph_functions as gf
+from utils import summary_table as st
+
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, 'data')
+DEFAULT_RESULTS_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, 'results')
+
+# timings below this are dominated by noise, so they are never reported as regressions
+MIN_COMPARABLE_SECONDS = 1e-4
+
+GRAPH_TABS = {
+    'candlestick_graph_display': 'candlestick_graph_tab',
+    'price_line_graph_display': 'price_line_graph_tab',
+    'returns_line_graph_display': 'returns_line_graph_tab',
+    'returns_histogram_graph_display': 'returns_histogram_graph_tab',
+    'correlation_heatmap_graph_display': 'correlation_heatmap_graph_tab',
+    'rolling_statistics_graph_display': 'rolling_statistics_graph_tab',
+}
+
+# graph callbacks without a benchmark ticker input
+SINGLE_TICKER_CALLBACKS = ('candlestick_graph_display', 'correlation_heatmap_graph_display')
+
+
+def time_function(function: Callable, repeat: int, warmup: int = 1) -> Tuple[dict, object]:
+    '''
+    Calls function warmup times untimed and then repeat times timed. Returns the timing summary and the last result.
+    '''
+    for _ in range(warmup):
+        result = function()
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start_time)
+    return {'median_s': statistics.median(timings), 'min_s': min(timings), 'repeat': repeat}, result
+
+
+def date_ranges(data_index) -> dict:
+    # the full history, and the last year as a typical zoomed in view
+    return {
+        'full': (None, None),
+        '1y': ((data_index.max_date - pd.DateOffset(years = 1)).strftime('%Y-%m-%d'), data_index.max_date.strftime('%Y-%m-%d')),
+    }
+
+
+def calculation_cases(data_index, ticker: str, benchmark_ticker: str) -> List[Tuple[str, Callable]]:
+    data = data_index.data
+    ticker_data = data_index.get(ticker)
+    ticker_aligned, benchmark_aligned = data_index.align(ticker, benchmark_ticker)
+    daily_returns = ticker_data['Daily Returns %'].to_numpy(dtype = np.float64)
+    return [
+        ('mean', lambda: cf.mean(ticker_data, 'Daily Returns %')),
+        ('variance', lambda: cf.variance(ticker_data, 'Daily Returns %')),
+        ('covariance_daily_returns', lambda: cf.covariance_daily_returns(data, ticker, benchmark_ticker)),
+        ('correlation_daily_returns', lambda: cf.correlation_daily_returns(data, ticker, benchmark_ticker)),
+        ('beta_daily_returns', lambda: cf.beta_daily_returns(data, ticker, benchmark_ticker)),
+        ('value_at_risk_daily_returns', lambda: cf.value_at_risk_daily_returns(ticker_data)),
+        ('etl_daily_returns', lambda: cf.etl_daily_returns(ticker_data)),
+        ('etl_5_percent_daily_returns', lambda: cf.etl_5_percent_daily_returns(ticker_data)),
+        ('rolling_etl_daily_returns', lambda: cf.rolling_etl_daily_returns(ticker_data, window = 60)),
+        ('histogram_bin_size', lambda: cf.histogram_bin_size(daily_returns, 'fd')),
+        ('histogram_bins', lambda: cf.histogram_bins(daily_returns)),
+        ('trading_days', lambda: cf.trading_days(data, ticker, benchmark_ticker)),
+        ('align_daily_returns', lambda: cf.align_daily_returns(data_index.get(ticker), data_index.get(benchmark_ticker))),
+        ('pair_statistics', lambda: cf.pair_statistics(ticker_aligned, benchmark_aligned)),
+        ('rolling_variance_daily_returns', lambda: cf.rolling_variance_daily_returns(ticker_data, window = 60)),
+        ('rolling_mean_volume', lambda: cf.rolling_mean_volume(ticker_data, window = 60)),
+        ('rolling_pair_statistics', lambda: cf.rolling_pair_statistics(ticker_aligned, benchmark_aligned, window = 60)),
+        ('rolling_covariance_daily_returns', lambda: cf.rolling_covariance_daily_returns(ticker_aligned, benchmark_aligned, window = 60)),
+        ('rolling_correlation_daily_returns', lambda: cf.rolling_correlation_daily_returns(ticker_aligned, benchmark_aligned, window = 60)),
+        ('rolling_beta_daily_returns', lambda: cf.rolling_beta_daily_returns(ticker_aligned, benchmark_aligned, window = 60)),
+    ]
+
+
+def graph_cases(data_index, ticker: str, benchmark_ticker: str, start_date, end_date) -> List[Tuple[str, Callable]]:
+    return [
+        ('create_candlestick_graph', lambda: gf.create_candlestick_graph(data_index, ticker, start_date, end_date)),
+        ('create_price_line_graph', lambda: gf.create_price_line_graph(data_index, ticker, benchmark_ticker, start_date, end_date)),
+        ('create_returns_line_graph', lambda: gf.create_returns_line_graph(data_index, ticker, benchmark_ticker, start_date, end_date)),
+        ('create_returns_histogram', lambda: gf.create_returns_histogram(data_index, ticker, benchmark_ticker, start_date, end_date)),
+        ('create_correlation_heatmap', lambda: gf.create_correlation_heatmap(data_index, ticker, start_date, end_date)),
+        ('create_rolling_statistics_graph', lambda: gf.create_rolling_statistics_graph(data_index, ticker, benchmark_ticker, start_date, end_date)),
+    ]
+
+
+def load_app(store_root: str):
+    '''
+    Imports app.py and points it at the synthetic store. The callbacks read the dataset through app.live_dataset.
+    '''
+    sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+    import app
+    app.live_dataset = ds.LiveDataset(store_root)
+    return app
+
+
+def callback_cases(app, ticker: str, benchmark_ticker: str, start_date, end_date) -> List[Tuple[str, Callable]]:
+    def graph_callback(name: str) -> Callable:
+        callback = getattr(app, name)
+        if name in SINGLE_TICKER_CALLBACKS:
+            arguments = (GRAPH_TABS[name], ticker, start_date, end_date, None)
+        else:
+            arguments = (GRAPH_TABS[name], ticker, benchmark_ticker, start_date, end_date, None)
+        if name == 'rolling_statistics_graph_display':
+            arguments = arguments[:-1] + (gf.DEFAULT_ROLLING_WINDOW, None)
+        if name == 'candlestick_graph_display':
+            arguments = arguments[:-1] + (app.AUTO_BAR_INTERVAL, None)
+        if name in ('returns_line_graph_display', 'returns_histogram_graph_display'):
+            # the ETL of the whole date range, no rolling ETL window
+            arguments = arguments[:-1] + (None, None)
+        # no portfolio defined
+        arguments = arguments + (None,)
+
+        def call():
+            # measuring the figure build, not a figure cache hit
+            app.figure_cache.clear()
+            return callback(*arguments)
+        return call
+
+    cases = [(name, graph_callback(name)) for name in GRAPH_TABS]
+    cases.append(('update_table_values', lambda: app.update_table_values(ticker, start_date, end_date, benchmark_ticker, None)))
+    return cases
+
+
+def run_benchmarks(scale: str, repeat: int, data_dir: str, seed: int = 0, include_callbacks: bool = True) -> dict:
+    store_root, meta = synthetic_store(scale, data_dir, seed = seed)
+    live_dataset = ds.LiveDataset(store_root)
+    data_index = live_dataset.index()
+    ticker, benchmark_ticker = data_index.tickers[0], data_index.tickers[1]
+
+    results = {}
+    for name, function in calculation_cases(data_index, ticker, benchmark_ticker):
+        results[f'calculation_functions.{name}'], _ = time_function(function, repeat)
+        print(f'calculation_functions.{name}: {results[f"calculation_functions.{name}"]["median_s"]:.6f}s')
+
+    # the startup summary table of every ticker, through the process pool when the universe is large enough
+    results['summary_table.compute_summary_table'], _ = time_function(lambda: st.compute_summary_table(data_index, data_index.data.attrs['store_path']), repeat)
+    print(f'summary_table.compute_summary_table: {results["summary_table.compute_summary_table"]["median_s"]:.6f}s')
+
+    # the all-pairs matrices uncached (the heatmap builder below reuses them once built)
+    for range_name, (start_date, end_date) in date_ranges(data_index).items():
+        key = f'cross_section.pairwise_moments[{range_name}]'
+        results[key], _ = time_function(lambda: cs.pairwise_moments(cs.returns_matrix(data_index, start_date, end_date)[1]), repeat)
+        print(f'{key}: {results[key]["median_s"]:.6f}s')
+
+    for range_name, (start_date, end_date) in date_ranges(data_index).items():
+        for name, function in graph_cases(data_index, ticker, benchmark_ticker, start_date, end_date):
+            key = f'graph_functions.{name}[{range_name}]'
+            results[key], figure = time_function(function, repeat)
+            results[f'{key}.to_json'], figure_json = time_function(lambda: to_json_plotly(figure), repeat)
+            results[f'{key}.to_json']['json_bytes'] = len(figure_json.encode())
+            results[f'{key}.to_json']['gzip_bytes'] = len(gzip.compress(figure_json.encode()))
+            # the compact encoding the app sends (see utils/figure_encoding.py)
+            results[f'{key}.compact_json'], compact_json = time_function(lambda: to_json_plotly(fe.encode_figure(figure)), repeat)
+            results[f'{key}.compact_json']['json_bytes'] = len(compact_json.encode())
+            results[f'{key}.compact_json']['gzip_bytes'] = len(gzip.compress(compact_json.encode()))
+            # what a graph callback sends for it, the traces and layout overrides of a skeleton figure (see utils/figure_skeletons.py)
+            update_json = to_json_plotly(fs.partial_update(fe.encode_figure(figure))).encode()
+            results[f'{key}.compact_json']['update_json_bytes'] = len(update_json)
+            results[f'{key}.compact_json']['update_gzip_bytes'] = len(gzip.compress(update_json))
+            print(f'{key}: {results[key]["median_s"]:.6f}s, {results[f"{key}.to_json"]["json_bytes"]} JSON bytes, {results[f"{key}.compact_json"]["json_bytes"]} compact JSON bytes')
+
+    if include_callbacks:
+        app = load_app(store_root)
+        for name, function in [('benchmark_ticker_options', lambda: app.benchmark_ticker_options(ticker, list(app.live_dataset.index().tickers))), ('serve_layout', app.serve_layout)]:
+            results[f'app.{name}'], _ = time_function(function, repeat)
+            print(f'app.{name}: {results[f"app.{name}"]["median_s"]:.6f}s')
+        for range_name, (start_date, end_date) in date_ranges(data_index).items():
+            for name, function in callback_cases(app, ticker, benchmark_ticker, start_date, end_date):
+                key = f'app.{name}[{range_name}]'
+                results[key], _ = time_function(function, repeat)
+                print(f'{key}: {results[key]["median_s"]:.6f}s')
+
+    num_tickers, num_days = SCALES[scale]
+    return {
+        'meta': {
+            'scale': scale,
+            'tickers': num_tickers,
+            'days': num_days,
+            'rows': meta['rows'],
+            'seed': seed,
+            'dataset_version': meta['dataset_version'],
+            'repeat': repeat,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = BENCHMARK_DIRECTORY, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline: dict, current: dict, max_regression: float) -> List[Tuple[str, float, float]]:
+    '''
+    Returns (name, baseline median, current median) for every benchmark whose median time grew by more than max_regression
+    (0.25 = 25%) over the baseline. Benchmarks missing from either run, or faster than MIN_COMPARABLE_SECONDS in both, are skipped.
+    '''
+    if baseline['meta']['scale'] != current['meta']['scale']:
+        raise ValueError(f"Cannot compare a {current['meta']['scale']} run against a {baseline['meta']['scale']} baseline.")
+
+    regressions = []
+    for name, timing in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        baseline_seconds, current_seconds = baseline['results'][name]['median_s'], timing['median_s']
+        if max(baseline_seconds, current_seconds) < MIN_COMPARABLE_SECONDS:
+            continue
+        if current_seconds > baseline_seconds * (1 + max_regression):
+            regressions.append((name, baseline_seconds, current_seconds))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the calculation functions, figure builders and app callbacks.')
+    parser.add_argument('--scale', choices = list(SCALES), default = 'small')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--data-dir', default = DEFAULT_DATA_DIRECTORY)
+    parser.add_argument('--output', help = 'results JSON path (defaults to benchmarks/results/<scale>_<timestamp>.json)')
+    parser.add_argument('--skip-callbacks', action = 'store_true', help = 'do not import app.py and time its callbacks')
+    parser.add_argument('--compare', help = 'baseline results JSON to compare against')
+    parser.add_argument('--max-regression', type = float, default = 0.25, help = 'allowed slowdown against the baseline (0.25 = 25%%)')
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(arguments.scale, arguments.repeat, arguments.data_dir, seed = arguments.seed, include_callbacks = not arguments.skip_callbacks)
+
+    output_path = arguments.output or os.path.join(DEFAULT_RESULTS_DIRECTORY, f"{arguments.scale}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok = True)
+    with open(output_path, 'w') as output_file:
+        json.dump(benchmark_results, output_file, indent = 2)
+    print(f'Results written to {output_path}')
+
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            baseline_results = json.load(baseline_file)
+        found_regressions = compare_results(baseline_results, benchmark_results, arguments.max_regression)
+        for name, baseline_seconds, current_seconds in found_regressions:
+            print(f'REGRESSION {name}: {baseline_seconds:.6f}s -> {current_seconds:.6f}s ({current_seconds / baseline_seconds - 1:+.0%})')
+        if found_regressions:
+            sys.exit(1)
+        print(f'No regressions over {arguments.max_regression:.0%} against {arguments.compare}')
@@ -0,0 +1,88 @@
+'''
+SYNTHETIC DATA
+
+Generates OHLCV data in the master data schema (Date, Open, High, Low, Close, Adj Close, Volume, Ticker, Daily Returns %)
+at any number of tickers and trading days, for benchmarking. Prices are geometric random walks, a share of the tickers
+list part way through the period (as ARVL does in the master data) so date alignment is exercised, and everything is
+seeded so a scale always produces the same data.
+'''
+import os
+from typing import Tuple
+import numpy as np
+import pandas as pd
+from utils import data_store as ds
+
+
+# name: (tickers, trading days). small matches the master data CSV, large is 5,000 tickers over 20 years
+SCALES = {
+    'small': (21, 700),
+    'medium': (500, 2520),
+    'large': (5000, 5040),
+}
+
+# share of tickers that list after the first date
+LATE_LISTING_SHARE = 0.1
+
+END_DATE = '2022-11-02'
+
+
+def generate_ohlcv(num_tickers: int, num_days: int, seed: int = 0) -> pd.DataFrame:
+    '''
+    Returns num_tickers tickers of daily bars over the num_days business days ending END_DATE, sorted by (Ticker, Date).
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end = END_DATE, periods = num_days).to_numpy()
+
+    # tickers listing late start at a random day in the first half of the period
+    first_days = np.zeros(num_tickers, dtype = np.int64)
+    late = rng.random(num_tickers) < LATE_LISTING_SHARE
+    first_days[late] = rng.integers(1, max(2, num_days // 2), size = late.sum())
+    lengths = num_days - first_days
+
+    # one row per (ticker, listed day)
+    ticker_codes = np.repeat(np.arange(num_tickers), lengths)
+    day_positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(first_days, lengths)
+    num_rows = len(ticker_codes)
+
+    # geometric random walk of closes, per ticker drift and volatility, restarted at each ticker's first row
+    drift = rng.normal(0.0003, 0.0005, num_tickers)[ticker_codes]
+    volatility = rng.uniform(0.01, 0.05, num_tickers)[ticker_codes]
+    log_returns = drift + volatility * rng.standard_normal(num_rows)
+    cumulative = np.cumsum(log_returns)
+    ticker_starts = np.cumsum(lengths) - lengths
+    cumulative -= np.repeat(cumulative[ticker_starts] - log_returns[ticker_starts], lengths)
+    start_prices = rng.uniform(5, 500, num_tickers)[ticker_codes]
+    close = start_prices * np.exp(cumulative)
+
+    # the open gaps from the previous close, and the high/low extend beyond both
+    open_ = close * np.exp(-log_returns * rng.uniform(0.3, 1.0, num_rows))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.5, num_rows)) * volatility)
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.5, num_rows)) * volatility)
+    volume = rng.lognormal(14, 1, num_rows).astype(np.int64)
+
+    tickers = np.array([f'T{code:05d}' for code in range(num_tickers)])
+    return pd.DataFrame({
+        'Date': dates[day_positions],
+        'Open': open_,
+        'High': high,
+        'Low': low,
+        'Close': close,
+        'Adj Close': close,
+        'Volume': volume,
+        'Ticker': pd.Categorical.from_codes(ticker_codes, categories = tickers),
+        'Daily Returns %': (close - open_) * 100 / open_,
+    })
+
+
+def synthetic_store(scale: str, data_dir: str, seed: int = 0) -> Tuple[str, dict]:
+    '''
+    Returns the store root of the synthetic data for scale (publishing it on first use) and its metadata.
+    Stores are kept in data_dir so repeated runs skip generating and writing the data.
+    '''
+    num_tickers, num_days = SCALES[scale]
+    store_root = os.path.join(data_dir, f'{scale}_seed{seed}')
+    store_path = ds.current_store_path(store_root)
+    if store_path is None:
+        ds.publish(generate_ohlcv(num_tickers, num_days, seed = seed), store_root, source = {'synthetic': scale, 'seed': seed})
+        store_path = ds.current_store_path(store_root)
+    return store_root, ds.read_meta(store_path)
@@ -0,0 +1,14 @@
+# gunicorn settings for serving the app in production: gunicorn -c gunicorn.conf.py wsgi:server
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8050')
+
+# one worker per core. Workers share the memory-mapped dataset, so memory doesn't grow linearly with them
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('THREADS', 2))
+
+# loading the app (and the dataset) once in the master process before forking the workers, see wsgi.py
+preload_app = True
+
+timeout = 60
@@ -0,0 +1,14 @@
+import pandas as pd
+import pytest
+from tests.sample_data import load_sample_data
+from utils.dataset_index import DatasetIndex
+
+
+@pytest.fixture(scope = 'session')
+def sample_data() -> pd.DataFrame:
+    return load_sample_data()
+
+
+@pytest.fixture(scope = 'session')
+def data_index(sample_data) -> DatasetIndex:
+    return DatasetIndex(sample_data)
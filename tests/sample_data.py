@@ -0,0 +1,61 @@
+'''
+SAMPLE DATA
+
+The sample dataset the tests compare the kernels on (assets/data/master_data_2022-11-03.csv), and the direct pandas
+selections the expected values are calculated from.
+
+AI lists on 2020-12-09 and ARVL on 2020-02-03 (with many days of exactly 0% return), while most tickers start on
+2020-01-02, so the windows below give full, empty and single day ranges and a range starting before a ticker lists.
+'''
+import os
+import numpy as np
+import pandas as pd
+
+
+SAMPLE_CSV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets/data/master_data_2022-11-03.csv')
+
+# (start_date, end_date): a year, a range before AI listed (empty for AI), a single trading day, and one starting before AI listed
+WINDOWS = [
+    ('2021-01-01', '2021-12-31'),
+    ('2020-01-01', '2020-06-01'),
+    ('2021-06-01', '2021-06-01'),
+    ('2020-01-01', '2022-11-02'),
+]
+
+TICKERS = ['AAPL', 'AI', 'SPY']
+
+
+def load_sample_data() -> pd.DataFrame:
+    return pd.read_csv(SAMPLE_CSV_PATH, parse_dates = ['Date']).sort_values(['Ticker', 'Date'], ignore_index = True)
+
+
+def rows(sample_data: pd.DataFrame, ticker: str, start_date = None, end_date = None) -> pd.DataFrame:
+    # the ticker's rows between the dates, inclusive
+    selected = sample_data['Ticker'] == ticker
+    if start_date is not None:
+        selected &= sample_data['Date'] >= pd.Timestamp(start_date)
+    if end_date is not None:
+        selected &= sample_data['Date'] <= pd.Timestamp(end_date)
+    return sample_data[selected]
+
+
+def aligned(sample_data: pd.DataFrame, ticker: str, benchmark_ticker: str, start_date = None, end_date = None) -> pd.DataFrame:
+    # the dates both tickers traded, with the ticker's columns suffixed _x and the benchmark's _y
+    return pd.merge(
+        rows(sample_data, ticker, start_date, end_date),
+        rows(sample_data, benchmark_ticker, start_date, end_date),
+        on = 'Date', suffixes = ('_x', '_y')
+    )
+
+
+def pivot(sample_data: pd.DataFrame, column: str, tickers = None, start_date = None, end_date = None) -> pd.DataFrame:
+    # a Date x Ticker table of the column, NaN where a ticker has no row
+    selected = np.ones(len(sample_data), dtype = bool)
+    if start_date is not None:
+        selected &= sample_data['Date'] >= pd.Timestamp(start_date)
+    if end_date is not None:
+        selected &= sample_data['Date'] <= pd.Timestamp(end_date)
+    if tickers is not None:
+        selected &= sample_data['Ticker'].isin(tickers)
+    table = sample_data[selected].pivot(index = 'Date', columns = 'Ticker', values = column)
+    return table if tickers is None else table.reindex(columns = tickers)
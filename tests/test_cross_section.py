@@ -0,0 +1,42 @@
+'''
+CROSS SECTION TESTS
+
+The all-pairs matrices of utils/cross_section.py compared with pandas' pairwise-complete DataFrame.cov() and corr() on
+a Date x Ticker pivot of the returns, including tickers (AI, PATH, AUR) that list part way through the range.
+'''
+import numpy as np
+import pytest
+from tests.sample_data import WINDOWS, aligned, pivot
+from utils import cross_section as cs
+
+
+@pytest.mark.parametrize('tickers', [None, ['SPY', 'AI', 'AAPL']])
+@pytest.mark.parametrize('start_date, end_date', WINDOWS)
+def test_returns_matrix_matches_pivot(sample_data, data_index, tickers, start_date, end_date):
+    expected = pivot(sample_data, 'Daily Returns %', tickers, start_date, end_date).reindex(columns = tickers or data_index.tickers)
+    dates, matrix = cs.returns_matrix(data_index, start_date, end_date, tickers)
+
+    np.testing.assert_array_equal(dates, expected.index.to_numpy().view(np.int64))
+    np.testing.assert_array_equal(matrix, expected.to_numpy())
+
+
+@pytest.mark.parametrize('start_date, end_date', WINDOWS)
+def test_cross_section_matches_pandas_pairwise(sample_data, data_index, start_date, end_date):
+    returns = pivot(sample_data, 'Daily Returns %', start_date = start_date, end_date = end_date).reindex(columns = data_index.tickers)
+    cross_section = cs.cross_section(data_index, start_date, end_date)
+    present = returns.notna().astype(int)
+
+    assert cross_section.tickers == data_index.tickers
+    np.testing.assert_array_equal(cross_section.trading_days, (present.T @ present).to_numpy())
+    # pandas' cov and corr also use each pair's shared dates (ddof = 1), NaN below two
+    np.testing.assert_allclose(cross_section.covariance, returns.cov(min_periods = 2).to_numpy(), rtol = 1e-7, atol = 1e-10)
+    np.testing.assert_allclose(cross_section.correlation, returns.corr(min_periods = 2).to_numpy(), rtol = 1e-6, atol = 1e-9)
+
+    # beta of AI against SPY over their shared dates
+    ai, spy = data_index.tickers.index('AI'), data_index.tickers.index('SPY')
+    merged = aligned(sample_data, 'AI', 'SPY', start_date, end_date)
+    if len(merged) < 2:
+        assert np.isnan(cross_section.beta[ai, spy])
+    else:
+        covariance = np.cov(merged['Daily Returns %_x'], merged['Daily Returns %_y'])
+        np.testing.assert_allclose(cross_section.beta[ai, spy], covariance[0, 1] / covariance[1, 1], rtol = 1e-7)
@@ -0,0 +1,45 @@
+'''
+MOMENT ENGINE TESTS
+
+The prefix-sum window statistics of utils/moment_engine.py compared with pandas/numpy over the same rows, for a normal
+window, an empty window, a single trading day and a ticker (AI) that lists after the window starts.
+'''
+import numpy as np
+import pytest
+from tests.sample_data import TICKERS, WINDOWS, aligned, rows
+from utils import moment_engine as me
+
+
+@pytest.mark.parametrize('ticker', TICKERS)
+@pytest.mark.parametrize('start_date, end_date', WINDOWS)
+def test_ticker_moments_match_pandas(sample_data, data_index, ticker, start_date, end_date):
+    expected = rows(sample_data, ticker, start_date, end_date)
+    ticker_moments = me.ticker_moments(data_index, ticker)
+
+    assert ticker_moments.count(start_date, end_date) == len(expected)
+    np.testing.assert_allclose(ticker_moments.mean_daily_return(start_date, end_date), expected['Daily Returns %'].mean(), rtol = 1e-9, atol = 1e-12)
+    np.testing.assert_allclose(ticker_moments.variance_daily_return(start_date, end_date), expected['Daily Returns %'].var(ddof = 0), rtol = 1e-9, atol = 1e-12)
+    np.testing.assert_allclose(ticker_moments.mean_volume(start_date, end_date), expected['Volume'].mean(), rtol = 1e-9)
+
+
+@pytest.mark.parametrize('ticker, benchmark_ticker', [('AAPL', 'SPY'), ('AI', 'SPY'), ('SPY', 'AI')])
+@pytest.mark.parametrize('start_date, end_date', WINDOWS)
+def test_pair_moments_match_pandas(sample_data, data_index, ticker, benchmark_ticker, start_date, end_date):
+    merged = aligned(sample_data, ticker, benchmark_ticker, start_date, end_date)
+    x, y = merged['Daily Returns %_x'].to_numpy(), merged['Daily Returns %_y'].to_numpy()
+    pair_moments = me.pair_moments(data_index, ticker, benchmark_ticker)
+
+    assert pair_moments.trading_days(start_date, end_date) == len(merged)
+    assert pair_moments.quadrant_counts(start_date, end_date) == (
+        int(np.sum((x > 0) & (y > 0))), int(np.sum((x <= 0) & (y <= 0))), int(np.sum((x > 0) & (y <= 0))), int(np.sum((x <= 0) & (y > 0)))
+    )
+    if len(merged) < 2:
+        # fewer than two shared dates leave the sample statistics undefined
+        assert np.isnan(pair_moments.covariance(start_date, end_date))
+        assert np.isnan(pair_moments.correlation(start_date, end_date))
+        assert np.isnan(pair_moments.beta(start_date, end_date))
+        return
+    covariance = np.cov(x, y)
+    np.testing.assert_allclose(pair_moments.covariance(start_date, end_date), covariance[0, 1], rtol = 1e-9)
+    np.testing.assert_allclose(pair_moments.correlation(start_date, end_date), np.corrcoef(x, y)[0, 1], rtol = 1e-9)
+    np.testing.assert_allclose(pair_moments.beta(start_date, end_date), covariance[0, 1] / covariance[1, 1], rtol = 1e-9)
@@ -0,0 +1,86 @@
+'''
+PAIR STATISTICS TESTS
+
+cf.align_daily_returns() and the fused cf.pair_statistics() kernel compared with the merge-then-calculate route the
+benchmark table used before it (pd.merge on Date, then Series.cov/corr/var and the > 0 / <= 0 up/down split of
+cf.trading_days()).
+'''
+import numpy as np
+import pandas as pd
+import pytest
+from tests.sample_data import WINDOWS, aligned, rows
+from utils import calculation_functions as cf
+
+
+PAIRS = [('AAPL', 'SPY'), ('AI', 'SPY'), ('SPY', 'AI'), ('ARVL', 'SPY')]
+
+# ARVL's first four days all closed at their open: a ticker with no variance
+FLAT_WINDOW = ('2020-02-03', '2020-02-06')
+
+
+def _window_rows(sample_data: pd.DataFrame, ticker: str, benchmark_ticker: str, start_date, end_date) -> tuple:
+    return rows(sample_data, ticker, start_date, end_date), rows(sample_data, benchmark_ticker, start_date, end_date)
+
+
+@pytest.mark.parametrize('ticker, benchmark_ticker', PAIRS)
+@pytest.mark.parametrize('start_date, end_date', WINDOWS + [FLAT_WINDOW])
+def test_align_daily_returns_matches_merge(sample_data, ticker, benchmark_ticker, start_date, end_date):
+    expected = aligned(sample_data, ticker, benchmark_ticker, start_date, end_date).sort_values('Date')
+    ticker_returns, benchmark_returns = cf.align_daily_returns(*_window_rows(sample_data, ticker, benchmark_ticker, start_date, end_date))
+
+    np.testing.assert_array_equal(ticker_returns, expected['Daily Returns %_x'].to_numpy())
+    np.testing.assert_array_equal(benchmark_returns, expected['Daily Returns %_y'].to_numpy())
+
+
+# Series.cov warns on the single day window before returning NaN
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('ticker, benchmark_ticker', PAIRS)
+@pytest.mark.parametrize('start_date, end_date', WINDOWS + [FLAT_WINDOW])
+def test_pair_statistics_match_merged_series(sample_data, ticker, benchmark_ticker, start_date, end_date):
+    merged = aligned(sample_data, ticker, benchmark_ticker, start_date, end_date)
+    x, y = merged['Daily Returns %_x'], merged['Daily Returns %_y']
+    pair = cf.pair_statistics(*_window_rows(sample_data, ticker, benchmark_ticker, start_date, end_date))
+
+    # pandas gives NaN for fewer than two shared days and for a correlation with a constant series, as the kernel does
+    np.testing.assert_allclose(pair.covariance, x.cov(y), rtol = 1e-9, atol = 1e-12)
+    np.testing.assert_allclose(pair.correlation, x.corr(y), rtol = 1e-9)
+    np.testing.assert_allclose(pair.benchmark_variance, y.var(ddof = 1), rtol = 1e-9)
+    np.testing.assert_allclose(pair.beta, x.cov(y) / y.var(ddof = 1), rtol = 1e-9)
+
+    assert pair.trading_days == len(merged)
+    assert (pair.both_high, pair.both_low, pair.ticker_high_benchmark_low, pair.ticker_low_benchmark_high) == (
+        int(((x > 0) & (y > 0)).sum()), int(((x <= 0) & (y <= 0)).sum()), int(((x > 0) & (y <= 0)).sum()), int(((x <= 0) & (y > 0)).sum())
+    )
+
+
+@pytest.mark.parametrize('ticker, benchmark_ticker', PAIRS)
+@pytest.mark.parametrize('start_date, end_date', WINDOWS + [FLAT_WINDOW])
+def test_pair_statistics_counts_match_trading_days(sample_data, ticker, benchmark_ticker, start_date, end_date):
+    window_data = sample_data[(sample_data['Date'] >= pd.Timestamp(start_date)) & (sample_data['Date'] <= pd.Timestamp(end_date))]
+    pair = cf.pair_statistics(*_window_rows(sample_data, ticker, benchmark_ticker, start_date, end_date))
+
+    # trading_days() returns a one column count per value
+    expected_counts = tuple(int(count.iloc[0]) for count in cf.trading_days(window_data, ticker, benchmark_ticker))
+    assert (pair.trading_days, pair.both_high, pair.both_low, pair.ticker_high_benchmark_low, pair.ticker_low_benchmark_high) == expected_counts
+
+
+def test_pair_statistics_of_empty_and_single_day_overlaps(sample_data):
+    # AI hadn't listed in the first half of 2020
+    empty = cf.pair_statistics(*_window_rows(sample_data, 'AI', 'SPY', '2020-01-01', '2020-06-01'))
+    assert (empty.trading_days, empty.both_high, empty.both_low, empty.ticker_high_benchmark_low, empty.ticker_low_benchmark_high) == (0, 0, 0, 0, 0)
+    assert np.isnan([empty.covariance, empty.correlation, empty.beta, empty.benchmark_variance]).all()
+
+    single_day = cf.pair_statistics(*_window_rows(sample_data, 'AAPL', 'SPY', '2021-06-01', '2021-06-01'))
+    assert single_day.trading_days == 1
+    assert single_day.both_high + single_day.both_low + single_day.ticker_high_benchmark_low + single_day.ticker_low_benchmark_high == 1
+    assert np.isnan([single_day.covariance, single_day.correlation, single_day.beta, single_day.benchmark_variance]).all()
+
+
+def test_zero_returns_count_as_low():
+    # a close equal to the open is a low day, for the ticker and the benchmark
+    dates = pd.to_datetime(['2021-01-04', '2021-01-05', '2021-01-06', '2021-01-07', '2021-01-08'])
+    ticker_data = pd.DataFrame({'Date': dates, 'Daily Returns %': [0.0, 1.0, 0.0, -1.0, 2.0]})
+    benchmark_data = pd.DataFrame({'Date': dates, 'Daily Returns %': [0.0, 0.0, 1.0, 0.0, 3.0]})
+    pair = cf.pair_statistics(ticker_data, benchmark_data)
+
+    assert (pair.both_high, pair.both_low, pair.ticker_high_benchmark_low, pair.ticker_low_benchmark_high) == (1, 2, 1, 1)
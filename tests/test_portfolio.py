@@ -0,0 +1,123 @@
+'''
+PORTFOLIO TESTS
+
+The weighted portfolio rows of utils/portfolio.py compared with direct calculations on the constituents' prices and
+returns: daily rebalancing, buy and hold, a holdings loop for the periodic rebalances, w'Σw for the constant weight
+moments, and a constituent (AI) that lists after the portfolio starts, held at its first price until then.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+from tests.sample_data import pivot
+from utils import cross_section as cs
+from utils import portfolio as pf
+from utils.dataset_index import DatasetIndex
+
+
+def _portfolio_rows(data_index: DatasetIndex, definition: str, rebalance = None) -> tuple:
+    portfolio = pf.parse_portfolio(definition, data_index, rebalance)
+    return portfolio, pf.portfolio_rows(data_index, portfolio).set_index('Date')
+
+
+def _held_prices(sample_data: pd.DataFrame, tickers: list, dates: pd.Index) -> pd.DataFrame:
+    # Adj Close on every date, held at the last price between rows and at the first price before a ticker lists
+    return pivot(sample_data, 'Adj Close', tickers).reindex(dates).ffill().bfill()
+
+
+def test_daily_rebalanced_portfolio_is_weighted_returns(sample_data, data_index):
+    portfolio, rows = _portfolio_rows(data_index, 'AAPL:0.5, AI:0.3, SPY:0.2', 'D')
+    weights = np.asarray(portfolio.weights)
+
+    # every date any constituent traded, with no return on dates a constituent has no row (before AI listed)
+    returns = pivot(sample_data, 'Daily Returns %', portfolio.tickers).fillna(0.0)
+    assert rows.index.equals(returns.index)
+    np.testing.assert_allclose(rows['Daily Returns %'].to_numpy(), returns.to_numpy() @ weights, rtol = 1e-12)
+
+    prices = _held_prices(sample_data, list(portfolio.tickers), rows.index)
+    growth = (prices / prices.shift(1)).fillna(1.0).to_numpy() @ weights
+    np.testing.assert_allclose(rows['Close'].to_numpy(), pf.STARTING_VALUE * np.cumprod(growth), rtol = 1e-9)
+
+
+def test_buy_and_hold_portfolio_is_weighted_normalised_prices(sample_data, data_index):
+    portfolio, rows = _portfolio_rows(data_index, 'AAPL:0.5, AI:0.3, SPY:0.2')
+    prices = _held_prices(sample_data, list(portfolio.tickers), rows.index)
+    expected = pf.STARTING_VALUE * (prices / prices.iloc[0]).to_numpy() @ np.asarray(portfolio.weights)
+
+    np.testing.assert_allclose(rows['Close'].to_numpy(), expected, rtol = 1e-9)
+    np.testing.assert_allclose(rows['Adj Close'].to_numpy(), expected, rtol = 1e-9)
+
+
+@pytest.mark.parametrize('rebalance', ['W', 'M', 'Q', 'Y'])
+def test_rebalanced_portfolio_matches_holdings_loop(sample_data, data_index, rebalance):
+    portfolio, rows = _portfolio_rows(data_index, 'AAPL:0.5, AI:0.3, SPY:0.2', rebalance)
+    weights = np.asarray(portfolio.weights)
+    prices = _held_prices(sample_data, list(portfolio.tickers), rows.index)
+    periods = rows.index.to_period(rebalance)
+
+    # buying the target weights at the previous close on the first day of each period, and holding them to its end
+    value = pf.STARTING_VALUE
+    holdings = value * weights / prices.iloc[0].to_numpy()
+    expected = []
+    for position in range(len(rows)):
+        if position > 0 and periods[position] != periods[position - 1]:
+            holdings = value * weights / prices.iloc[position - 1].to_numpy()
+        value = float(holdings @ prices.iloc[position].to_numpy())
+        expected.append(value)
+
+    np.testing.assert_allclose(rows['Close'].to_numpy(), expected, rtol = 1e-9)
+
+
+def test_single_day_portfolio(sample_data):
+    # one date of data: the portfolio starts (and stays) at its starting value
+    single_day_index = DatasetIndex(sample_data[sample_data['Date'] == pd.Timestamp('2021-06-01')])
+    _, rows = _portfolio_rows(single_day_index, 'AAPL, SPY')
+
+    assert len(rows) == 1
+    np.testing.assert_allclose(rows['Close'].to_numpy(), [pf.STARTING_VALUE])
+
+
+def test_constant_weight_moments_match_weighted_returns(sample_data, data_index):
+    portfolio = pf.parse_portfolio('AAPL:0.5, MSFT:0.3, SPY:0.2', data_index)
+    # every constituent traded every date of the window, so w'Σw is the variance of the weighted returns
+    weighted_returns = pivot(sample_data, 'Daily Returns %', portfolio.tickers, '2021-01-01', '2021-12-31').to_numpy() @ np.asarray(portfolio.weights)
+    moments = pf.constant_weight_moments(data_index, portfolio, '2021-01-01', '2021-12-31')
+
+    np.testing.assert_allclose(moments['mean_daily_return'], weighted_returns.mean(), rtol = 1e-9)
+    np.testing.assert_allclose(moments['var_daily_return'], weighted_returns.var(ddof = 1), rtol = 1e-9)
+
+    empty_moments = pf.constant_weight_moments(data_index, portfolio, '2030-01-01', '2030-12-31')
+    assert np.isnan(empty_moments['mean_daily_return']) and np.isnan(empty_moments['var_daily_return'])
+
+
+def test_portfolio_index_delegates_to_base_index(data_index):
+    portfolio = pf.parse_portfolio('AAPL:0.5, AI:0.5', data_index, 'M')
+    portfolio_index = pf.with_portfolio(data_index, portfolio)
+
+    assert portfolio_index.tickers == data_index.tickers + [portfolio.ticker]
+    assert portfolio.ticker in portfolio_index and 'AAPL' in portfolio_index and portfolio.ticker not in data_index
+    # base tickers' rows are the base index's own, not copies
+    assert portfolio_index.get('AAPL', '2021-01-01', '2021-12-31') is not None
+    assert np.shares_memory(portfolio_index.get('AAPL')['Close'].to_numpy(), data_index.get('AAPL')['Close'].to_numpy())
+    assert len(portfolio_index.data) == len(portfolio_index.get(portfolio.ticker))
+
+    # the portfolio's pair moments against a base ticker come from their shared dates
+    ticker_df, benchmark_df = portfolio_index.align(portfolio.ticker, 'SPY', '2021-01-01', '2021-12-31')
+    np.testing.assert_array_equal(ticker_df['Date'].to_numpy(), benchmark_df['Date'].to_numpy())
+    cross_section = cs.cross_section(portfolio_index, '2021-01-01', '2021-12-31')
+    spy = portfolio_index.tickers.index('SPY')
+    np.testing.assert_allclose(
+        cross_section.correlation[-1, spy],
+        np.corrcoef(ticker_df['Daily Returns %'], benchmark_df['Daily Returns %'])[0, 1],
+        rtol = 1e-9
+    )
+
+
+@pytest.mark.parametrize('definition', ['', 'AAPL:inf, MSFT:2', 'AAPL:0, MSFT:1', 'AAPL:-1', 'AAPL:x', 'NOPE:1', 'AAPL, AAPL', 'AAPL:1, MSFT'])
+def test_invalid_portfolios_are_rejected(data_index, definition):
+    with pytest.raises(ValueError):
+        pf.parse_portfolio(definition, data_index)
+
+
+def test_portfolio_weights_are_normalised(data_index):
+    assert pf.parse_portfolio('aapl:2, msft:6', data_index).weights == (0.25, 0.75)
+    assert pf.parse_portfolio('AAPL, MSFT, SPY, AI', data_index).weights == (0.25, 0.25, 0.25, 0.25)
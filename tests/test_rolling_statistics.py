@@ -0,0 +1,47 @@
+'''
+ROLLING STATISTICS TESTS
+
+The prefix-sum rolling variance, mean volume and pair statistics of utils/calculation_functions.py compared with
+pandas' rolling windows, for windows of one row, a few rows, and longer than the ticker's history (all NaN), and for a
+ticker (AI) that lists after its benchmark.
+'''
+import numpy as np
+import pytest
+from tests.sample_data import TICKERS, aligned, rows
+from utils import calculation_functions as cf
+
+
+@pytest.mark.parametrize('ticker', TICKERS)
+@pytest.mark.parametrize('window', [1, 20, 10000])
+def test_rolling_ticker_statistics_match_pandas(sample_data, ticker, window):
+    ticker_data = rows(sample_data, ticker)
+    # pandas gives NaN for windows longer than the series, as the kernels do
+    expected_variance = ticker_data['Daily Returns %'].rolling(window).var(ddof = 0).to_numpy()
+    expected_volume = ticker_data['Volume'].rolling(window).mean().to_numpy()
+
+    np.testing.assert_allclose(cf.rolling_variance_daily_returns(ticker_data, window), expected_variance, rtol = 1e-7, atol = 1e-9)
+    np.testing.assert_allclose(cf.rolling_mean_volume(ticker_data, window), expected_volume, rtol = 1e-9)
+
+
+@pytest.mark.parametrize('ticker, benchmark_ticker', [('AAPL', 'SPY'), ('AI', 'SPY')])
+@pytest.mark.parametrize('window', [5, 20, 10000])
+def test_rolling_pair_statistics_match_pandas(sample_data, ticker, benchmark_ticker, window):
+    merged = aligned(sample_data, ticker, benchmark_ticker)
+    x, y = merged['Daily Returns %_x'], merged['Daily Returns %_y']
+    rolling_pair = cf.rolling_pair_statistics(rows(sample_data, ticker), rows(sample_data, benchmark_ticker), window)
+
+    expected_covariance = x.rolling(window).cov(y).to_numpy()
+    expected_benchmark_variance = y.rolling(window).var().to_numpy()
+    np.testing.assert_allclose(rolling_pair.covariance, expected_covariance, rtol = 1e-7, atol = 1e-9)
+    np.testing.assert_allclose(rolling_pair.benchmark_variance, expected_benchmark_variance, rtol = 1e-7, atol = 1e-9)
+    np.testing.assert_allclose(rolling_pair.correlation, x.rolling(window).corr(y).to_numpy(), rtol = 1e-6, atol = 1e-9)
+    np.testing.assert_allclose(rolling_pair.beta, expected_covariance / expected_benchmark_variance, rtol = 1e-6, atol = 1e-9)
+
+
+def test_rolling_pair_wrappers_match_pair_statistics(sample_data):
+    ticker_data, benchmark_data = rows(sample_data, 'AI'), rows(sample_data, 'SPY')
+    rolling_pair = cf.rolling_pair_statistics(ticker_data, benchmark_data, 20)
+
+    np.testing.assert_array_equal(cf.rolling_covariance_daily_returns(ticker_data, benchmark_data, 20), rolling_pair.covariance)
+    np.testing.assert_array_equal(cf.rolling_correlation_daily_returns(ticker_data, benchmark_data, 20), rolling_pair.correlation)
+    np.testing.assert_array_equal(cf.rolling_beta_daily_returns(ticker_data, benchmark_data, 20), rolling_pair.beta)
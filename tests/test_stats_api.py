@@ -0,0 +1,155 @@
+'''
+STATS API TESTS
+
+The /api endpoints through the app's own Flask server (app.server, which Dash wraps in flask_compress), so a
+flask_compress or werkzeug upgrade that changes the ETag or If-None-Match handling shows up here rather than as every
+poll rebuilding its response: 304s for a plain ETag, a gzip suffixed ETag and *, responses cached by dataset version,
+and JSON errors for bad requests.
+'''
+import flask
+import pytest
+from utils import stats_api as sa
+from utils.dataset_index import DatasetIndex
+
+
+STATS_URL = '/api/stats?tickers=AAPL,AI,SPY&start_date=2021-01-01&end_date=2021-12-31'
+
+
+@pytest.fixture(scope = 'module')
+def app_module():
+    # importing the app loads (or converts) the sample dataset's store
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.server.test_client()
+
+
+def test_stats_response(client):
+    response = client.get(STATS_URL)
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.get_etag()[0]
+    body = response.get_json()
+    assert set(body['stats']) == {'AAPL', 'AI', 'SPY'}
+    assert set(body['stats']['AAPL']) == {'mean_daily_return', 'var_daily_return', 'mean_volume', 'etl_5_percent'}
+
+
+@pytest.mark.parametrize('url', [
+    STATS_URL,
+    '/api/pair_stats?tickers=AAPL,AI&benchmark=SPY&start_date=2021-01-01',
+    '/api/ohlcv?tickers=AAPL&start_date=2022-01-01&end_date=2022-02-01',
+])
+def test_plain_etag_is_not_modified(app_module, client, url):
+    etag = client.get(url).headers['ETag']
+    not_modified = app_module.stats_api.stats()['not_modified']
+    response = client.get(url, headers = {'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert app_module.stats_api.stats()['not_modified'] == not_modified + 1
+
+
+def test_gzip_suffixed_etag_is_not_modified(app_module, client):
+    compressed = client.get(STATS_URL, headers = {'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    # flask_compress appends the encoding to the ETag of a compressed response
+    etag, _ = compressed.get_etag()
+    assert etag.endswith(':gzip')
+
+    not_modified = app_module.stats_api.stats()['not_modified']
+    response = client.get(STATS_URL, headers = {'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['ETag']})
+    assert response.status_code == 304
+    assert app_module.stats_api.stats()['not_modified'] == not_modified + 1
+
+    # and the uncompressed response's ETag is the suffixed one without its suffix
+    assert client.get(STATS_URL).get_etag()[0] == etag[:-len(':gzip')]
+
+
+def test_star_is_not_modified(client):
+    assert client.get(STATS_URL, headers = {'If-None-Match': '*'}).status_code == 304
+
+
+def test_changed_etag_is_rebuilt(client):
+    response = client.get(STATS_URL, headers = {'If-None-Match': '"0123456789abcdef0123456789abcdef"'})
+    assert response.status_code == 200
+    assert response.get_json()['stats']
+
+
+def test_equal_dates_share_an_etag(client):
+    date_etag = client.get('/api/stats?tickers=AAPL&start_date=2021-01-01&end_date=2021-12-31').headers['ETag']
+    datetime_etag = client.get('/api/stats?tickers=AAPL&start_date=2021-01-01T00:00:00&end_date=2021-12-31').headers['ETag']
+    other_etag = client.get('/api/stats?tickers=AAPL&start_date=2021-01-04&end_date=2021-12-31').headers['ETag']
+
+    assert date_etag == datetime_etag
+    assert date_etag != other_etag
+
+
+@pytest.mark.parametrize('url, status_code, error', [
+    ('/api/stats?tickers=AAPL&start_date=2021-13-45', 400, 'Dates must be ISO dates'),
+    ('/api/stats?tickers=AAPL&end_date=yesterday', 400, 'Dates must be ISO dates'),
+    ('/api/stats?tickers=AAPL,NOTATICKER', 404, 'Tickers not in the dataset: NOTATICKER'),
+    ('/api/stats', 400, "'tickers' is required."),
+    ('/api/pair_stats?tickers=AAPL&benchmark=SPY,AI', 400, "'benchmark' takes one ticker."),
+    ('/api/pair_stats?tickers=AAPL&benchmark=NOTATICKER', 404, 'Tickers not in the dataset: NOTATICKER'),
+    ('/api/ohlcv?tickers=NOTATICKER', 404, 'Tickers not in the dataset: NOTATICKER'),
+])
+def test_bad_requests_are_json_errors(client, url, status_code, error):
+    response = client.get(url)
+
+    assert response.status_code == status_code
+    assert response.mimetype == 'application/json'
+    assert response.get_json()['error'].startswith(error)
+    assert 'ETag' not in response.headers
+
+
+class _LiveDataset():
+    # the LiveDataset interface the API reads, with a version that can be published by hand
+    def __init__(self, data_index: DatasetIndex):
+        self.data_index = data_index
+
+    def index(self) -> DatasetIndex:
+        return self.data_index
+
+    def bars_index(self) -> DatasetIndex:
+        return self.data_index
+
+
+def _versioned_index(sample_data, dataset_version: str) -> DatasetIndex:
+    data = sample_data.copy()
+    data.attrs['dataset_version'] = dataset_version
+    return DatasetIndex(data)
+
+
+def test_responses_are_cached_by_dataset_version(sample_data):
+    live_dataset = _LiveDataset(_versioned_index(sample_data, 'version-1'))
+    stats_api = sa.StatsApi(live_dataset)
+    server = flask.Flask(__name__)
+    stats_api.init_app(server)
+    client = server.test_client()
+
+    first = client.get(STATS_URL)
+    assert stats_api.stats()['misses'] == 1
+    repeated = client.get(STATS_URL)
+    assert stats_api.stats()['hits'] == 1
+    assert repeated.data == first.data
+    assert repeated.headers['ETag'] == first.headers['ETag']
+    assert first.get_json()['dataset_version'] == 'version-1'
+
+    # a 304 is answered from the headers, without reading the cache
+    assert client.get(STATS_URL, headers = {'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert (stats_api.stats()['hits'], stats_api.stats()['misses']) == (1, 1)
+
+    # a new version changes the ETag, so the old one no longer matches and the response is rebuilt
+    live_dataset.data_index = _versioned_index(sample_data, 'version-2')
+    published = client.get(STATS_URL, headers = {'If-None-Match': first.headers['ETag']})
+    assert published.status_code == 200
+    assert published.headers['ETag'] != first.headers['ETag']
+    assert published.get_json()['dataset_version'] == 'version-2'
+    assert published.get_json()['stats'] == first.get_json()['stats']
+    assert stats_api.stats()['misses'] == 2
@@ -0,0 +1,88 @@
+'''
+TAIL LOSS TESTS
+
+The selection-based VaR and ETL (cf.value_at_risk_daily_returns(), cf.etl_daily_returns()) and the rolling ETL compared
+with the full sort they replace: the lowest ceil(n * tail_percent / 100) returns of the sorted array. Checked at tail
+percentages other than 5%, over empty and single day windows, and on ARVL's many days of exactly 0% return, where
+the tail boundary falls among ties.
+'''
+import math
+from fractions import Fraction
+import numpy as np
+import pandas as pd
+import pytest
+from tests.sample_data import TICKERS, WINDOWS, rows
+from utils import calculation_functions as cf
+
+
+TAIL_PERCENTS = [0.5, 1, 2.2, 5, 7.5, 10, 33.3, 50, 99, 100]
+
+
+def _sorted_tail(day_returns: np.ndarray, tail_percent: float) -> np.ndarray:
+    # the lowest returns, by a full sort, with the tail size in exact arithmetic
+    num_tail_losses = math.ceil(Fraction(len(day_returns)) * Fraction(str(tail_percent)) / 100)
+    return np.sort(day_returns)[:num_tail_losses]
+
+
+@pytest.mark.parametrize('ticker', TICKERS + ['ARVL'])
+@pytest.mark.parametrize('start_date, end_date', WINDOWS)
+@pytest.mark.parametrize('tail_percent', TAIL_PERCENTS)
+def test_var_and_etl_match_sorted_returns(sample_data, ticker, start_date, end_date, tail_percent):
+    ticker_data = rows(sample_data, ticker, start_date, end_date)
+    tail = _sorted_tail(ticker_data['Daily Returns %'].to_numpy(), tail_percent)
+
+    if len(tail) == 0:
+        assert np.isnan(cf.value_at_risk_daily_returns(ticker_data, tail_percent))
+        assert np.isnan(cf.etl_daily_returns(ticker_data, tail_percent))
+        return
+    assert cf.value_at_risk_daily_returns(ticker_data, tail_percent) == tail[-1]
+    np.testing.assert_allclose(cf.etl_daily_returns(ticker_data, tail_percent), tail.mean(), rtol = 1e-12)
+
+
+@pytest.mark.parametrize('tail_percent', TAIL_PERCENTS)
+def test_var_and_etl_with_ties_at_the_tail_boundary(tail_percent):
+    # 40 returns with only four distinct values, so every tail ends among equal returns
+    day_returns = np.repeat([-2.0, -1.0, 0.0, 1.5], [3, 7, 20, 10])
+    np.random.default_rng(0).shuffle(day_returns)
+    ticker_data = pd.DataFrame({'Daily Returns %': day_returns})
+    tail = _sorted_tail(day_returns, tail_percent)
+
+    assert cf.value_at_risk_daily_returns(ticker_data, tail_percent) == tail[-1]
+    np.testing.assert_allclose(cf.etl_daily_returns(ticker_data, tail_percent), tail.mean(), rtol = 1e-12)
+
+
+def test_tail_size_is_exact_for_decimal_percentages():
+    # 2.2% of 500 returns is exactly 11
+    day_returns = np.arange(500, dtype = np.float64)
+    ticker_data = pd.DataFrame({'Daily Returns %': day_returns})
+
+    assert cf.value_at_risk_daily_returns(ticker_data, 2.2) == 10.0
+    assert cf.etl_daily_returns(ticker_data, 2.2) == 5.0
+
+
+def test_etl_5_percent_is_the_default_tail(sample_data):
+    ticker_data = rows(sample_data, 'AAPL')
+    assert cf.etl_5_percent_daily_returns(ticker_data) == cf.etl_daily_returns(ticker_data)
+    np.testing.assert_allclose(cf.etl_5_percent_daily_returns(ticker_data), _sorted_tail(ticker_data['Daily Returns %'].to_numpy(), 5).mean(), rtol = 1e-12)
+
+
+@pytest.mark.parametrize('ticker', TICKERS + ['ARVL'])
+@pytest.mark.parametrize('window, tail_percent', [(1, 5), (20, 5), (60, 2.2), (60, 10), (60, 100), (250, 33.3), (10000, 5)])
+def test_rolling_etl_matches_sorted_windows(sample_data, ticker, window, tail_percent):
+    ticker_data = rows(sample_data, ticker)
+    day_returns = ticker_data['Daily Returns %'].to_numpy()
+    expected = np.full(len(day_returns), np.nan)
+    for position in range(window - 1, len(day_returns)):
+        expected[position] = _sorted_tail(day_returns[position - window + 1:position + 1], tail_percent).mean()
+
+    np.testing.assert_allclose(cf.rolling_etl_daily_returns(ticker_data, window, tail_percent), expected, rtol = 1e-9, atol = 1e-12)
+
+
+@pytest.mark.parametrize('tail_percent', [0, -5, 100.5, 101])
+def test_tail_percent_outside_range_is_rejected(sample_data, tail_percent):
+    ticker_data = rows(sample_data, 'AAPL')
+    for tail_function in (cf.value_at_risk_daily_returns, cf.etl_daily_returns):
+        with pytest.raises(ValueError):
+            tail_function(ticker_data, tail_percent)
+    with pytest.raises(ValueError):
+        cf.rolling_etl_daily_returns(ticker_data, 20, tail_percent)
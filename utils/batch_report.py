@@ -0,0 +1,185 @@
+'''
+BATCH REPORT
+
+The app's data table values (utils/table_metrics.py) for every ticker against each of a list of benchmarks, over each of
+a list of windows ending on the dataset's last date, written to a CSV or Parquet file without running the app.
+
+The tickers are split into chunks computed by a process pool (each worker memory-maps the store version itself, as the
+summary table's workers do), and each chunk's rows are appended to the output as soon as it and the chunks before it
+are done, so the report is never held in memory whole. Rows are in ticker order, then window, then benchmark.
+
+Windows are 'full' (each ticker's whole history) or a length back from the last date: a number followed by d (days),
+w (weeks), m (months) or y (years), e.g. '3m' or '1y'. Parquet output needs pyarrow.
+
+Running from the command line:
+    python -m utils.batch_report assets/data/master_data_store report.csv
+    python -m utils.batch_report assets/data/master_data_store report.parquet --benchmarks SPY,QQQ --windows 1m,1y,full
+'''
+import argparse
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+import pandas as pd
+from utils import data_store as ds
+from utils import summary_table as st
+from utils import table_metrics as tm
+from utils.dataset_index import DatasetIndex, to_nanoseconds
+
+
+DEFAULT_BENCHMARKS = ['SPY']
+
+DEFAULT_WINDOWS = ['1m', '3m', '6m', '1y', '3y', 'full']
+
+FULL_WINDOW = 'full'
+
+REPORT_COLUMNS = ['ticker', 'benchmark_ticker', 'window', 'start_date', 'end_date'] + tm.TICKER_METRICS + tm.PAIR_METRICS
+
+WINDOW_UNITS = {'d': 'days', 'w': 'weeks', 'm': 'months', 'y': 'years'}
+
+
+def window_dates(window: str, last_date: pd.Timestamp) -> Tuple[Optional[str], Optional[str]]:
+    '''
+    Returns the (start_date, end_date) of a window ending on last_date, both None for the full window.
+    '''
+    if window == FULL_WINDOW:
+        return None, None
+    match = re.fullmatch(r'(\d+)([dwmy])', window)
+    if match is None:
+        raise ValueError(f"Unknown window '{window}'. Use '{FULL_WINDOW}' or a length such as '5d', '4w', '3m' or '1y'.")
+    start_date = last_date - pd.DateOffset(**{WINDOW_UNITS[match.group(2)]: int(match.group(1))})
+    return start_date.strftime('%Y-%m-%d'), last_date.strftime('%Y-%m-%d')
+
+
+def _report_rows(data_index: DatasetIndex, tickers: List[str], benchmark_tickers: List[Optional[str]], windows: List[tuple]) -> pd.DataFrame:
+    # window dates as nanosecond Timestamps (the end one covering its whole day), parsed once rather than on every lookup
+    window_timestamps = [
+        (None, None) if start_date is None else (pd.Timestamp(start_date), pd.Timestamp(to_nanoseconds(end_date, end_of_range = True)))
+        for _, start_date, end_date in windows
+    ]
+    rows = []
+    for ticker in tickers:
+        for (window, start_date, end_date), (start_timestamp, end_timestamp) in zip(windows, window_timestamps):
+            # ticker values don't depend on the benchmark, so they are calculated once per window
+            ticker_values = tm.ticker_metrics(data_index, ticker, start_timestamp, end_timestamp)
+            for benchmark_ticker in benchmark_tickers:
+                pair_values = {} if benchmark_ticker is None else tm.pair_metrics(data_index, ticker, benchmark_ticker, start_timestamp, end_timestamp)
+                rows.append({
+                    'ticker': ticker, 'benchmark_ticker': benchmark_ticker, 'window': window, 'start_date': start_date, 'end_date': end_date,
+                    **ticker_values, **pair_values,
+                })
+    return pd.DataFrame(rows, columns = REPORT_COLUMNS)
+
+
+@lru_cache(maxsize = 1)
+def _store_index(store_path: str) -> DatasetIndex:
+    # one index per worker process, so its moment engines and summary table are reused across the chunks it computes
+    return DatasetIndex(ds.load_daily_view(store_path))
+
+
+def _store_report_rows(store_path: str, tickers: List[str], benchmark_tickers: List[Optional[str]], windows: List[tuple]) -> pd.DataFrame:
+    # process pool worker: memory-maps the store rather than receiving the data
+    return _report_rows(_store_index(store_path), tickers, benchmark_tickers, windows)
+
+
+def _report_chunks(store_path: str, data_index: DatasetIndex, benchmark_tickers: List[Optional[str]], windows: List[tuple], max_workers: int) -> Iterator[pd.DataFrame]:
+    tickers = data_index.tickers
+    if max_workers == 1 or len(tickers) < st.PARALLEL_MIN_TICKERS:
+        yield _report_rows(data_index, tickers, benchmark_tickers, windows)
+        return
+
+    chunk_size = math.ceil(len(tickers) / (max_workers * st.CHUNKS_PER_WORKER))
+    chunks = [tickers[first:first + chunk_size] for first in range(0, len(tickers), chunk_size)]
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        yield from executor.map(_store_report_rows, [store_path] * len(chunks), chunks, [benchmark_tickers] * len(chunks), [windows] * len(chunks))
+
+
+def iter_report(store_path: str, benchmark_tickers: Optional[List[str]] = None, windows: Optional[List[str]] = None, max_workers: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    '''
+    Returns an iterator over the report rows of a store version in chunks of tickers, in ticker order. With enough tickers
+    the chunks are computed by a process pool. An empty benchmark list gives rows of the ticker values only.
+    The benchmarks and windows are checked straight away, before any rows are computed.
+    '''
+    data_index = _store_index(store_path)
+    benchmark_tickers = DEFAULT_BENCHMARKS if benchmark_tickers is None else benchmark_tickers
+    unknown_tickers = [benchmark_ticker for benchmark_ticker in benchmark_tickers if benchmark_ticker not in data_index]
+    if unknown_tickers:
+        raise ValueError(f"Benchmark tickers not in the data store: {', '.join(unknown_tickers)}")
+    windows = [(window, *window_dates(window, data_index.max_date)) for window in (windows or DEFAULT_WINDOWS)]
+    # full-history values are read from the summary table, so it is saved (if it isn't yet) before the workers load it
+    st.summary_table(data_index)
+    return _report_chunks(store_path, data_index, benchmark_tickers or [None], windows, max_workers or os.cpu_count() or 1)
+
+
+def _write_csv(chunks: Iterator[pd.DataFrame], output_path: str) -> int:
+    rows = 0
+    for chunk_number, chunk in enumerate(chunks):
+        chunk.to_csv(output_path, mode = 'w' if chunk_number == 0 else 'a', header = chunk_number == 0, index = False)
+        rows += len(chunk)
+    return rows
+
+
+def _write_parquet(chunks: Iterator[pd.DataFrame], output_path: str) -> int:
+    # pyarrow is only needed (and imported) for Parquet output
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            # the first chunk fixes the schema, so every chunk is written with the same column types
+            table = pa.Table.from_pandas(chunk, schema = None if writer is None else writer.schema, preserve_index = False)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def write_report(store_root: str, output_path: str, benchmark_tickers: Optional[List[str]] = None, windows: Optional[List[str]] = None, max_workers: Optional[int] = None) -> dict:
+    '''
+    Writes the report of the live version of the store root to output_path, as Parquet if it ends in .parquet and CSV
+    otherwise. Returns the dataset version reported on and the number of rows written.
+    '''
+    store_path = ds.current_store_path(store_root)
+    if store_path is None:
+        raise FileNotFoundError(f'No published data store found at {store_root}. Publish one with utils.data_store first.')
+    write_chunks = _write_parquet if output_path.endswith('.parquet') else _write_csv
+
+    # the version is resolved once, so a version published while the report runs doesn't mix into it.
+    # Writing to a temporary file and renaming it, so readers never see a partial report
+    report_chunks = iter_report(store_path, benchmark_tickers, windows, max_workers)
+    tmp_path = f'{output_path}.tmp'
+    try:
+        rows = write_chunks(report_chunks, tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+    return {'dataset_version': ds.read_meta(store_path)['dataset_version'], 'rows': rows}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Write the data table's values for every ticker, benchmark and window to a CSV or Parquet file.")
+    parser.add_argument('store_root')
+    parser.add_argument('output_path', help = 'report file, written as Parquet if it ends in .parquet and CSV otherwise')
+    parser.add_argument('--benchmarks', default = ','.join(DEFAULT_BENCHMARKS), help = f"comma separated benchmark tickers, empty for ticker values only (default {','.join(DEFAULT_BENCHMARKS)})")
+    parser.add_argument('--windows', default = ','.join(DEFAULT_WINDOWS), help = f"comma separated windows (default {','.join(DEFAULT_WINDOWS)})")
+    parser.add_argument('--workers', type = int, help = 'worker processes (defaults to the number of cores)')
+    arguments = parser.parse_args()
+
+    report_meta = write_report(
+        arguments.store_root,
+        arguments.output_path,
+        benchmark_tickers = [ticker for ticker in arguments.benchmarks.split(',') if ticker],
+        windows = arguments.windows.split(','),
+        max_workers = arguments.workers,
+    )
+    print(f"Wrote {report_meta['rows']} rows to {arguments.output_path} (dataset version {report_meta['dataset_version']})")
@@ -1,7 +1,11 @@
+import heapq
+import math
 import typing
-from typing import Tuple
+from fractions import Fraction
+from typing import NamedTuple, Tuple
 import numpy as np
 import pandas as pd
+from utils.moment_engine import compensated_cumsum
 
 
 # mean
@@ -82,24 +86,164 @@ def beta_daily_returns(data: pd.DataFrame, ticker: str, benchmark_ticker: str) -
         how = 'inner'
 )
     
-    # calculating beta, using the variance and covariance functions already defined
-    # beta = cov(x,y) / var(y), where y is the benchmark data
-    beta = covariance_daily_returns(data, ticker, benchmark_ticker) / merged_data['Daily Returns %_y'].std(ddof = 0)
+    # calculating beta, using the covariance function already defined
+    # beta = cov(x,y) / var(y), where y is the benchmark data. ddof = 1 to match np.cov in the covariance function
+    beta = covariance_daily_returns(data, ticker, benchmark_ticker) / merged_data['Daily Returns %_y'].var(ddof = 1)
     return beta
     
-# 5% ETL - In future we can vary the % within an input and callback. See RiskMetrics file in Code/Stock Data folder
+# ETL (expected tail loss) and VaR (value at risk) at any tail percentage. Selection (np.partition) finds the tail in O(n) without a full sort
+def _num_tail_losses(num_returns: int, tail_percent: float) -> int:
+    if not 0 < tail_percent <= 100:
+        raise ValueError(f'The tail percentage must be above 0 and at most 100, got {tail_percent}.')
+    # ceiling of num_returns * tail_percent / 100, in exact arithmetic on the percentage as written. Dividing by the float
+    # 100 / tail_percent rounds up one too many for some percentages (2.2% of 500 returns is 11, not 12)
+    return math.ceil(Fraction(num_returns) * Fraction(str(tail_percent)) / 100)
+
+
+def value_at_risk_daily_returns(data: pd.DataFrame, tail_percent: float = 5) -> float:
+    '''
+    Returns the largest daily return within the lowest tail_percent % of daily returns, i.e. the boundary of the tail.
+    '''
+    day_returns_numpy = data.loc[:, 'Daily Returns %'].to_numpy(dtype = np.float64)
+    num_tail_losses = _num_tail_losses(len(day_returns_numpy), tail_percent)
+    if num_tail_losses == 0:
+        return np.nan
+    return np.partition(day_returns_numpy, num_tail_losses - 1)[num_tail_losses - 1]
+
+
+def etl_daily_returns(data: pd.DataFrame, tail_percent: float = 5) -> float:
+    '''
+    Returns the mean of the lowest tail_percent % of daily returns (the expected tail loss).
+    '''
+    day_returns_numpy = data.loc[:, 'Daily Returns %'].to_numpy(dtype = np.float64)
+    num_tail_losses = _num_tail_losses(len(day_returns_numpy), tail_percent)
+    if num_tail_losses == 0:
+        return np.nan
+    # partitioning (a copy) places the lowest num_tail_losses values first, in no particular order
+    return np.partition(day_returns_numpy, num_tail_losses - 1)[:num_tail_losses].mean()
+
+
+# 5% ETL, kept for the existing callers
 def etl_5_percent_daily_returns(data: pd.DataFrame) -> float:
+    return etl_daily_returns(data, tail_percent = 5)
+
+
+def rolling_etl_daily_returns(data: pd.DataFrame, window: int, tail_percent: float = 5) -> np.ndarray:
+    '''
+    Returns the ETL of each trailing window of daily returns, one value per row (NaN until the first full window).
+    The window is split between two heaps, the lowest num_tail_losses returns (a max-heap) and the rest (a min-heap), and
+    the sum of the lowest is kept up to date as returns enter and leave the window, so each row costs O(log window).
+    Returns leaving the window are removed lazily, when they reach the top of their heap.
+    '''
+    day_returns_numpy = data.loc[:, 'Daily Returns %'].to_numpy(dtype = np.float64)
+    rolling_etl = np.full(len(day_returns_numpy), np.nan)
+    num_tail_losses = _num_tail_losses(window, tail_percent)
+    if window <= 0 or num_tail_losses == 0:
+        return rolling_etl
+    
+    # NaN returns sort above every other return, as np.partition places them in etl_daily_returns. Python floats and
+    # lists, since the loop works on one value at a time
+    day_returns = day_returns_numpy.tolist()
+    is_nan = np.isnan(day_returns_numpy).tolist()
+    sort_keys = np.where(np.isnan(day_returns_numpy), np.inf, day_returns_numpy).tolist()
+    lowest, highest = [], []    # heap entries of (-key, position) and (key, position)
+    in_lowest = [False] * len(day_returns)
+    lowest_count = lowest_nan_count = 0
+    lowest_sum = 0.0
     
-    #ceiling division using upside-down floor division
-    num_tail_losses = int(-(len(data) // -(100/5)))
+    def add_to_lowest(position: int):
+        nonlocal lowest_count, lowest_nan_count, lowest_sum
+        heapq.heappush(lowest, (-sort_keys[position], position))
+        in_lowest[position] = True
+        lowest_count += 1
+        if is_nan[position]:
+            lowest_nan_count += 1
+        else:
+            lowest_sum += day_returns[position]
     
-    #converting to numpy, sorting the array, calculating the mean of a split array
-    day_returns_numpy = data.loc[:, 'Daily Returns %'].copy().to_numpy() 
-    day_returns_numpy.sort()
-    etl_5_percent =  day_returns_numpy[:num_tail_losses].mean()
-    return etl_5_percent
+    def remove_from_lowest(position: int):
+        nonlocal lowest_count, lowest_nan_count, lowest_sum
+        in_lowest[position] = False
+        lowest_count -= 1
+        if is_nan[position]:
+            lowest_nan_count -= 1
+        else:
+            lowest_sum -= day_returns[position]
+    
+    def top(heap: list, first_in_window: int):
+        # the heap's top entry in the window, after dropping entries that have left it
+        while heap and (heap[0][1] < first_in_window or (heap is lowest) != in_lowest[heap[0][1]]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+    
+    for position in range(len(day_returns)):
+        first_in_window = position - window + 1
+        
+        # the new return goes with the lowest if it is below the highest of them
+        lowest_top = top(lowest, first_in_window)
+        if lowest_top is not None and sort_keys[position] < -lowest_top[0]:
+            add_to_lowest(position)
+        else:
+            heapq.heappush(highest, (sort_keys[position], position))
+        
+        # the return leaving the window
+        if first_in_window > 0 and in_lowest[first_in_window - 1]:
+            remove_from_lowest(first_in_window - 1)
         
+        # moving returns between the heaps until the lowest holds num_tail_losses (or every return in the window)
+        while lowest_count > num_tail_losses:
+            moved = top(lowest, first_in_window)[1]
+            remove_from_lowest(moved)
+            heapq.heappush(highest, (sort_keys[moved], moved))
+        while lowest_count < num_tail_losses and top(highest, first_in_window) is not None:
+            add_to_lowest(heapq.heappop(highest)[1])
+        
+        if position >= window - 1:
+            rolling_etl[position] = np.nan if lowest_nan_count else lowest_sum / num_tail_losses
+    return rolling_etl
+        
+    
+# histogram binning: server-side counts so the browser only receives one bar per bin
+def histogram_bin_size(values: np.ndarray, bin_rule = 1.0) -> float:
+    '''
+    Returns the bin width for a bin rule: a number is a fixed width (1.0 = 1% bins for daily returns %),
+    'fd' is the Freedman-Diaconis rule and 'sturges' is Sturges' rule.
+    '''
+    if not isinstance(bin_rule, str):
+        return float(bin_rule)
+    
+    values = np.asarray(values, dtype = np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) < 2 or values.max() == values.min():
+        return 1.0
+    if bin_rule == 'fd':
+        q75, q25 = np.percentile(values, [75, 25])
+        if q75 > q25:
+            return 2 * (q75 - q25) / len(values) ** (1/3)
+        return (values.max() - values.min()) / (np.log2(len(values)) + 1)
+    if bin_rule == 'sturges':
+        return (values.max() - values.min()) / (np.log2(len(values)) + 1)
+    raise ValueError(f"Bin rule {bin_rule} is not supported. Use a bin width, 'fd' or 'sturges'.")
+
+
+def histogram_bins(values: np.ndarray, bin_size: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Counts values into right-closed bins (edge - bin_size, edge] whose edges are multiples of bin_size, in one vectorized pass.
+    Returns (right bin edges, counts), including the empty bins between the lowest and highest value.
+    Because the edges are multiples of bin_size, histograms of different series with the same bin_size share bins.
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return np.empty(0), np.empty(0, dtype = np.int64)
     
+    bin_numbers = np.ceil(values / bin_size).astype(np.int64)
+    first_bin = bin_numbers.min()
+    counts = np.bincount(bin_numbers - first_bin)
+    right_edges = (first_bin + np.arange(len(counts))) * bin_size
+    return right_edges, counts
+
+
 def trading_days(data: pd.DataFrame, ticker: str, benchmark_ticker: str  = None) -> Tuple[int, int, int, int, int]:
     '''
     Function provides count of trading days over the timeseries provided (simply the count).
@@ -170,3 +314,150 @@ def trading_days(data: pd.DataFrame, ticker: str, benchmark_ticker: str  = None)
         ticker_low_benchmark_high_count = ticker_low_benchmark_high.count()
         
         return trading_days_count, both_high_count, both_low_count, ticker_high_benchmark_low_count, ticker_low_benchmark_high_count
+
+
+# pair statistics: every ticker vs benchmark metric from a single date alignment
+class PairStatistics(NamedTuple):
+    covariance: float
+    correlation: float
+    beta: float
+    benchmark_variance: float
+    trading_days: int
+    both_high: int
+    both_low: int
+    ticker_high_benchmark_low: int
+    ticker_low_benchmark_high: int
+
+
+def align_daily_returns(ticker_data: pd.DataFrame, benchmark_data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns the 'Daily Returns %' arrays of the ticker and the benchmark restricted to the dates both traded on (an inner join on Date).
+    Each dataframe should hold the rows of one ticker only, so dates are unique.
+    '''
+    _, ticker_positions, benchmark_positions = np.intersect1d(
+        ticker_data['Date'].to_numpy(),
+        benchmark_data['Date'].to_numpy(),
+        assume_unique = True,
+        return_indices = True
+    )
+    ticker_returns = ticker_data['Daily Returns %'].to_numpy(dtype = np.float64)[ticker_positions]
+    benchmark_returns = benchmark_data['Daily Returns %'].to_numpy(dtype = np.float64)[benchmark_positions]
+    return ticker_returns, benchmark_returns
+
+
+def pair_statistics(ticker_data: pd.DataFrame, benchmark_data: pd.DataFrame) -> PairStatistics:
+    '''
+    Function aligns the ticker and benchmark daily returns once and calculates all of the pair metrics from the aligned arrays:
+    covariance, correlation and beta (sample statistics, ddof = 1, matching np.cov), the variance of the benchmark,
+    the number of days both traded, and the up/down counts that trading_days() provides.
+    '''
+    ticker_returns, benchmark_returns = align_daily_returns(ticker_data, benchmark_data)
+    num_days = len(ticker_returns)
+    
+    # sums of squared deviations and cross deviations, from which every second moment follows
+    if num_days > 1:
+        ticker_deviations = ticker_returns - ticker_returns.mean()
+        benchmark_deviations = benchmark_returns - benchmark_returns.mean()
+        sum_xx = ticker_deviations @ ticker_deviations
+        sum_yy = benchmark_deviations @ benchmark_deviations
+        sum_xy = ticker_deviations @ benchmark_deviations
+        
+        covariance = sum_xy / (num_days - 1)
+        benchmark_variance = sum_yy / (num_days - 1)
+        correlation = sum_xy / np.sqrt(sum_xx * sum_yy) if sum_xx > 0 and sum_yy > 0 else np.nan
+        beta = sum_xy / sum_yy if sum_yy > 0 else np.nan
+    else:
+        covariance = correlation = beta = benchmark_variance = np.nan
+    
+    # 'Daily Returns %' higher than 0 is a close higher than the open, lower or equal to 0 is a close lower or even
+    ticker_high = ticker_returns > 0
+    benchmark_high = benchmark_returns > 0
+    both_high = int(np.count_nonzero(ticker_high & benchmark_high))
+    both_low = int(np.count_nonzero(~ticker_high & ~benchmark_high))
+    ticker_high_benchmark_low = int(np.count_nonzero(ticker_high & ~benchmark_high))
+    ticker_low_benchmark_high = num_days - both_high - both_low - ticker_high_benchmark_low
+    
+    return PairStatistics(
+        covariance = float(covariance),
+        correlation = float(correlation),
+        beta = float(beta),
+        benchmark_variance = float(benchmark_variance),
+        trading_days = num_days,
+        both_high = both_high,
+        both_low = both_low,
+        ticker_high_benchmark_low = ticker_high_benchmark_low,
+        ticker_low_benchmark_high = ticker_low_benchmark_high
+    )
+
+
+# rolling window statistics: one value per row (NaN until the first full window), each from differences of prefix sums,
+# so a series of any length costs O(n) however long the window is
+def _window_sums(values: np.ndarray, window: int) -> np.ndarray:
+    window_sums = np.full(len(values), np.nan)
+    if 0 < window <= len(values):
+        prefix = compensated_cumsum(values)
+        window_sums[window - 1:] = prefix[window:] - prefix[:-window]
+    return window_sums
+
+
+def _centred(values: np.ndarray) -> np.ndarray:
+    # shifting by the series mean doesn't change any second moment, but keeps the sums small so differences stay precise
+    return values - values.mean() if len(values) else values
+
+
+def rolling_variance_daily_returns(data: pd.DataFrame, window: int) -> np.ndarray:
+    '''
+    Returns the variance (ddof = 0, as variance()) of each trailing window of daily returns.
+    '''
+    day_returns = _centred(data.loc[:, 'Daily Returns %'].to_numpy(dtype = np.float64))
+    window_mean = _window_sums(day_returns, window) / window
+    window_mean_square = _window_sums(day_returns * day_returns, window) / window
+    return np.maximum(window_mean_square - window_mean * window_mean, 0.0)
+
+
+def rolling_mean_volume(data: pd.DataFrame, window: int) -> np.ndarray:
+    volume = data.loc[:, 'Volume'].to_numpy(dtype = np.float64)
+    return _window_sums(volume, window) / window
+
+
+class RollingPairStatistics(NamedTuple):
+    covariance: np.ndarray
+    correlation: np.ndarray
+    beta: np.ndarray
+    benchmark_variance: np.ndarray
+
+
+def rolling_pair_statistics(ticker_data: pd.DataFrame, benchmark_data: pd.DataFrame, window: int) -> RollingPairStatistics:
+    '''
+    Returns the covariance, correlation and beta (ddof = 1, as pair_statistics()) and the benchmark variance of each trailing
+    window of the dates both traded, one value per aligned date.
+    '''
+    ticker_returns, benchmark_returns = align_daily_returns(ticker_data, benchmark_data)
+    x = _centred(ticker_returns)
+    y = _centred(benchmark_returns)
+    
+    sum_x = _window_sums(x, window)
+    sum_y = _window_sums(y, window)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        sum_xx = np.maximum(_window_sums(x * x, window) - sum_x * sum_x / window, 0.0)
+        sum_yy = np.maximum(_window_sums(y * y, window) - sum_y * sum_y / window, 0.0)
+        sum_xy = _window_sums(x * y, window) - sum_x * sum_y / window
+        
+        covariance = sum_xy / (window - 1)
+        benchmark_variance = sum_yy / (window - 1)
+        correlation = np.where((sum_xx > 0) & (sum_yy > 0), sum_xy / np.sqrt(sum_xx * sum_yy), np.nan)
+        beta = np.where(sum_yy > 0, sum_xy / sum_yy, np.nan)
+    
+    return RollingPairStatistics(covariance, correlation, beta, benchmark_variance)
+
+
+def rolling_covariance_daily_returns(ticker_data: pd.DataFrame, benchmark_data: pd.DataFrame, window: int) -> np.ndarray:
+    return rolling_pair_statistics(ticker_data, benchmark_data, window).covariance
+
+
+def rolling_correlation_daily_returns(ticker_data: pd.DataFrame, benchmark_data: pd.DataFrame, window: int) -> np.ndarray:
+    return rolling_pair_statistics(ticker_data, benchmark_data, window).correlation
+
+
+def rolling_beta_daily_returns(ticker_data: pd.DataFrame, benchmark_data: pd.DataFrame, window: int) -> np.ndarray:
+    return rolling_pair_statistics(ticker_data, benchmark_data, window).beta
@@ -0,0 +1,136 @@
+'''
+CROSS SECTION
+
+All-pairs covariance, correlation and beta over a date range. The universe is pivoted once into a date x ticker matrix
+of daily returns (NaN where a ticker didn't trade), and every pair's statistics come from a handful of matrix products
+over that matrix, so the whole matrix costs a few BLAS calls instead of one merge per pair.
+
+Missing dates are handled pairwise-complete: each pair uses exactly the dates both tickers traded, which is what
+cf.pair_statistics does for a single pair after aligning the two tickers (ddof = 1).
+'''
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from utils.dataset_index import DatasetIndex, index_cache, to_nanoseconds
+
+
+# each cached matrix set holds four tickers x tickers matrices, so only a few date ranges are kept
+CROSS_SECTION_CACHE_SIZE = 4
+
+
+class CrossSection(NamedTuple):
+    tickers: List[str]
+    trading_days: np.ndarray    # [i, j] dates both tickers traded
+    covariance: np.ndarray
+    correlation: np.ndarray
+    beta: np.ndarray            # [i, j] beta of ticker i with ticker j as the benchmark
+
+
+def column_matrices(data_index: DatasetIndex, columns: List[str], start_date = None, end_date = None, tickers: Optional[List[str]] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    '''
+    Returns the sorted dates in the range that any of the tickers (every ticker by default) traded, and for each column
+    a dates x tickers matrix of its values (columns in the order of tickers) with NaN where the ticker has no row on that date.
+    '''
+    base_index = getattr(data_index, 'base_index', None)
+    if tickers is None and base_index is not None:
+        # an index extending another with extra tickers (a portfolio, see utils/portfolio.py): the other's matrices, then
+        # the extra tickers' columns, on the dates either traded
+        base_dates, base_matrices = column_matrices(base_index, columns, start_date, end_date)
+        extra_dates, extra_matrices = column_matrices(data_index, columns, start_date, end_date, data_index.tickers[len(base_index.tickers):])
+        unique_dates = np.union1d(base_dates, extra_dates)
+        base_rows, extra_rows = np.searchsorted(unique_dates, base_dates), np.searchsorted(unique_dates, extra_dates)
+        matrices = {}
+        for column in columns:
+            matrix = np.full((len(unique_dates), len(data_index.tickers)), np.nan)
+            matrix[base_rows, :len(base_index.tickers)] = base_matrices[column]
+            matrix[extra_rows, len(base_index.tickers):] = extra_matrices[column]
+            matrices[column] = matrix
+        return unique_dates, matrices
+
+    if tickers is None:
+        dates = data_index.data['Date'].to_numpy().view(np.int64)
+        rows = np.ones(len(dates), dtype = bool)
+        if start_date is not None:
+            rows &= dates >= to_nanoseconds(start_date)
+        if end_date is not None:
+            rows &= dates <= to_nanoseconds(end_date, end_of_range = True)
+        row_dates = dates[rows]
+        column_positions = data_index.data['Ticker'].cat.codes.to_numpy()[rows]
+        num_columns = len(data_index.tickers)
+        column_values = lambda column: data_index.data[column].to_numpy()[rows]
+    else:
+        # only the tickers' rows, found through the index rather than by a pass over every row
+        ticker_frames = [data_index.get(ticker, start_date, end_date) for ticker in tickers]
+        row_dates = np.concatenate([data_index.dates(ticker, start_date, end_date) for ticker in tickers] + [np.zeros(0, dtype = np.int64)])
+        column_positions = np.repeat(np.arange(len(tickers)), [len(ticker_frame) for ticker_frame in ticker_frames])
+        num_columns = len(tickers)
+        column_values = lambda column: np.concatenate([ticker_frame[column].to_numpy() for ticker_frame in ticker_frames] + [np.zeros(0)])
+
+    unique_dates, date_positions = np.unique(row_dates, return_inverse = True)
+    matrices = {}
+    for column in columns:
+        matrix = np.full((len(unique_dates), num_columns), np.nan)
+        matrix[date_positions, column_positions] = column_values(column)
+        matrices[column] = matrix
+    return unique_dates, matrices
+
+
+def returns_matrix(data_index: DatasetIndex, start_date = None, end_date = None, tickers: Optional[List[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns the sorted dates in the range that any of the tickers (every ticker by default) traded, and a dates x tickers
+    matrix of daily returns with NaN where the ticker has no row on that date.
+    '''
+    unique_dates, matrices = column_matrices(data_index, ['Daily Returns %'], start_date, end_date, tickers)
+    return unique_dates, matrices['Daily Returns %']
+
+
+def pairwise_moments(matrix: np.ndarray) -> CrossSection:
+    '''
+    Pairwise-complete covariance, correlation and beta of every pair of columns of a dates x tickers matrix (NaN = missing).
+    For columns i, j every sum runs over the dates both are present, using the present mask M and the zero-filled values X:
+        n = M'M, sum x_i = X'M, sum x_j = M'X, sum x_i x_j = X'X, sum x_i^2 = (X^2)'M, sum x_j^2 = M'(X^2)
+    '''
+    present = ~np.isnan(matrix)
+
+    # centring each column on its own mean first keeps the sums small, so the subtraction below doesn't lose precision
+    column_counts = present.sum(axis = 0)
+    column_sums = np.where(present, matrix, 0.0).sum(axis = 0)
+    column_means = np.divide(column_sums, column_counts, out = np.zeros(matrix.shape[1]), where = column_counts > 0)
+    values = np.where(present, matrix - column_means, 0.0)
+    mask = present.astype(np.float64)
+
+    pair_counts = mask.T @ mask
+    sum_x = values.T @ mask
+    sum_y = sum_x.T
+    sum_xy = values.T @ values
+    sum_xx = (values * values).T @ mask
+    sum_yy = sum_xx.T
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        covariance = (sum_xy - sum_x * sum_y / pair_counts) / (pair_counts - 1)
+        variance_x = (sum_xx - sum_x * sum_x / pair_counts) / (pair_counts - 1)
+        variance_y = (sum_yy - sum_y * sum_y / pair_counts) / (pair_counts - 1)
+        correlation = covariance / np.sqrt(variance_x * variance_y)
+        beta = covariance / variance_y
+
+    # fewer than two shared dates leave a pair undefined
+    undefined = pair_counts < 2
+    for statistic in (covariance, correlation, beta):
+        statistic[undefined] = np.nan
+
+    return CrossSection(None, pair_counts.astype(np.int64), covariance, correlation, beta)
+
+
+@index_cache(maxsize = CROSS_SECTION_CACHE_SIZE)
+def _cross_section(data_index: DatasetIndex, start_ns, end_ns) -> CrossSection:
+    _, matrix = returns_matrix(data_index, start_ns, end_ns)
+    return pairwise_moments(matrix)._replace(tickers = list(data_index.tickers))
+
+
+def cross_section(data_index: DatasetIndex, start_date = None, end_date = None) -> CrossSection:
+    '''
+    All-pairs statistics for the date range, cached per (dataset, range). The matrices are shared between callers and must not be modified.
+    '''
+    # normalising the dates, so the same range in different formats shares a cache entry
+    start_ns = None if start_date is None else to_nanoseconds(start_date)
+    end_ns = None if end_date is None else to_nanoseconds(end_date, end_of_range = True)
+    return _cross_section(data_index, start_ns, end_ns)
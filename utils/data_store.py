@@ -0,0 +1,363 @@
+'''
+DATA STORE
+
+Columnar on-disk store for the master stock data. The CSV is converted once into one typed .npy file per column
+plus a meta.json describing the columns, and the app memory-maps those files at startup instead of parsing text.
+
+Store layout (a directory):
+    meta.json         - column names, file names, dtypes, ticker categories, row count and dataset version
+    <column>.npy      - one array per column. Dates are int64 nanoseconds, tickers are integer category codes
+
+Rows are written sorted by (Ticker, Date) so each ticker's rows are contiguous on disk. Bars can be daily or intraday
+(minute or hourly). An intraday store also holds its daily view, the same data resampled to daily bars, in daily/.
+
+The app reads a versioned store root: each published dataset version is a store directory inside the root and the
+CURRENT file names the live one. Publishing writes the new version first and then replaces CURRENT in one rename, and
+LiveDataset swaps a running app over to the new version without a restart (see utils/ingestion.py for incremental updates).
+
+Converting from the command line:
+    python -m utils.data_store assets/data/master_data_2022-11-03.csv assets/data/master_data_store
+'''
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Callable, Optional, Tuple
+import numpy as np
+import pandas as pd
+from utils.dataset_index import DatasetIndex, clear_index_caches
+from utils import resampling as rs
+
+
+STORE_FORMAT_VERSION = 1
+META_FILE_NAME = 'meta.json'
+CURRENT_FILE_NAME = 'CURRENT'
+
+# stores of intraday bars keep the daily bars resampled from them in this subdirectory, for the daily metrics
+DAILY_VIEW_DIR_NAME = 'daily'
+
+# published versions kept in a store root, so processes still mapping an older version can finish with it
+KEEP_VERSIONS = 3
+
+# float columns are only stored as float32 when every value survives the round trip within this relative error
+FLOAT32_RELATIVE_TOLERANCE = 1e-12
+
+
+def _column_file_name(column: str) -> str:
+    # 'Daily Returns %' -> 'daily_returns_pct.npy'
+    safe_name = column.lower().replace('%', 'pct').replace(' ', '_')
+    return f'{safe_name}.npy'
+
+
+def _downcast_float(values: np.ndarray) -> np.ndarray:
+    # float32 halves the memory per price column, but only if the values are (near enough) float32 values already
+    values = values.astype(np.float64)
+    values_32 = values.astype(np.float32)
+    round_trip_error = np.abs(values_32.astype(np.float64) - values)
+    finite = np.isfinite(values)
+    if np.all(round_trip_error[finite] <= FLOAT32_RELATIVE_TOLERANCE * np.abs(values[finite])) and np.array_equal(finite, np.isfinite(values_32)):
+        return values_32
+    return values
+
+
+def _downcast_int(values: np.ndarray) -> np.ndarray:
+    int32_info = np.iinfo(np.int32)
+    if len(values) == 0 or (values.min() >= int32_info.min and values.max() <= int32_info.max):
+        return values.astype(np.int32)
+    return values.astype(np.int64)
+
+
+def _category_code_dtype(num_categories: int) -> np.dtype:
+    if num_categories <= np.iinfo(np.int16).max:
+        return np.dtype(np.int16)
+    return np.dtype(np.int32)
+
+
+def write_store(data: pd.DataFrame, store_path: str, source: Optional[str] = None) -> dict:
+    '''
+    Writes a dataframe in the master data schema to a columnar store directory and returns the store metadata.
+    The store is written to a temporary directory first and then moved into place, so readers never see a half written store.
+    '''
+    data = data.copy()
+    data['Date'] = pd.to_datetime(data['Date'])
+    data['Ticker'] = data['Ticker'].astype(str)
+
+    # sorting so each ticker's rows are contiguous and in date order
+    data = data.sort_values(['Ticker', 'Date'], kind = 'mergesort').reset_index(drop = True)
+
+    tmp_path = f'{store_path}.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    version_hash = hashlib.sha1()
+    columns_meta = []
+    for column in data.columns:
+        file_name = _column_file_name(column)
+
+        if column == 'Date':
+            values = data[column].to_numpy(dtype = 'datetime64[ns]').view(np.int64)
+            column_meta = {'name': column, 'file': file_name, 'kind': 'datetime'}
+
+        elif column == 'Ticker':
+            categorical = pd.Categorical(data[column])
+            categories = [str(category) for category in categorical.categories]
+            values = categorical.codes.astype(_category_code_dtype(len(categories)))
+            column_meta = {'name': column, 'file': file_name, 'kind': 'categorical', 'categories': categories}
+
+        elif pd.api.types.is_float_dtype(data[column]):
+            values = _downcast_float(data[column].to_numpy())
+            column_meta = {'name': column, 'file': file_name, 'kind': 'numeric'}
+
+        elif pd.api.types.is_integer_dtype(data[column]):
+            values = _downcast_int(data[column].to_numpy())
+            column_meta = {'name': column, 'file': file_name, 'kind': 'numeric'}
+
+        else:
+            raise TypeError(f'Column {column} has dtype {data[column].dtype}, which the data store does not support.')
+
+        column_meta['dtype'] = values.dtype.str
+        np.save(os.path.join(tmp_path, file_name), values, allow_pickle = False)
+        version_hash.update(column.encode())
+        version_hash.update(values.tobytes())
+        columns_meta.append(column_meta)
+
+    meta = {
+        'format_version': STORE_FORMAT_VERSION,
+        'source': source,
+        'rows': len(data),
+        'base_interval': rs.base_interval(data['Date'].to_numpy(dtype = 'datetime64[ns]').view(np.int64), pd.Categorical(data['Ticker']).codes),
+        'dataset_version': version_hash.hexdigest()[:16],
+        'columns': columns_meta
+    }
+    with open(os.path.join(tmp_path, META_FILE_NAME), 'w') as meta_file:
+        json.dump(meta, meta_file, indent = 2)
+
+    # swapping the new store into place
+    if os.path.exists(store_path):
+        old_path = f'{store_path}.old'
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        os.replace(store_path, old_path)
+        os.replace(tmp_path, store_path)
+        shutil.rmtree(old_path)
+    else:
+        os.replace(tmp_path, store_path)
+
+    return meta
+
+
+def read_csv_source(csv_path: str) -> Tuple[pd.DataFrame, dict]:
+    # reads a master data CSV and describes it, so a store can tell when the CSV it was built from has changed
+    data = pd.read_csv(csv_path)
+    source_stat = os.stat(csv_path)
+    source = {'path': os.path.basename(csv_path), 'size': source_stat.st_size, 'mtime': source_stat.st_mtime}
+    return data, source
+
+
+def convert_csv_to_store(csv_path: str, store_path: str) -> dict:
+    '''
+    One-shot conversion of a master data CSV (as written by assets/data/data_download.ipynb) into a columnar store.
+    '''
+    data, source = read_csv_source(csv_path)
+    return write_store(data, store_path, source = source)
+
+
+def current_version(store_root: str) -> Optional[str]:
+    # name of the live version directory in a store root
+    try:
+        with open(os.path.join(store_root, CURRENT_FILE_NAME)) as current_file:
+            return current_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_store_path(store_root: str) -> Optional[str]:
+    version_name = current_version(store_root)
+    return None if version_name is None else os.path.join(store_root, version_name)
+
+
+def publish(data: pd.DataFrame, store_root: str, source: Optional[dict] = None, prepare: Optional[Callable[[str], object]] = None) -> dict:
+    '''
+    Writes data as a new version in the store root and makes it the live version.
+    CURRENT is replaced with a single rename, so readers see either the old or the new version, never a partial one.
+    prepare, if given, is called with the new version's path before it goes live (e.g. to save derived tables next to it).
+    '''
+    os.makedirs(store_root, exist_ok = True)
+    version_name = f'version_{time.time_ns()}'
+    meta = write_store(data, os.path.join(store_root, version_name), source = source)
+    if prepare is not None:
+        prepare(os.path.join(store_root, version_name))
+
+    tmp_current_path = os.path.join(store_root, f'{CURRENT_FILE_NAME}.tmp')
+    with open(tmp_current_path, 'w') as current_file:
+        current_file.write(version_name)
+    os.replace(tmp_current_path, os.path.join(store_root, CURRENT_FILE_NAME))
+
+    # removing the oldest versions. Processes that still have them memory-mapped keep their pages until they unmap
+    versions = sorted(name for name in os.listdir(store_root) if name.startswith('version_') and not name.endswith(('.tmp', '.old')))
+    for old_version in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(store_root, old_version), ignore_errors = True)
+
+    return meta
+
+
+def read_meta(store_path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(store_path, META_FILE_NAME)) as meta_file:
+            return json.load(meta_file)
+    except FileNotFoundError:
+        return None
+
+
+def load_store(store_path: str) -> pd.DataFrame:
+    '''
+    Memory-maps every column of the store and wraps them in a dataframe without copying.
+    Pages are read lazily by the OS and shared between processes that map the same files.
+    '''
+    meta = read_meta(store_path)
+    if meta is None:
+        raise FileNotFoundError(f'No data store found at {store_path}. Create one with convert_csv_to_store().')
+    if meta['format_version'] != STORE_FORMAT_VERSION:
+        raise ValueError(f"Data store format version {meta['format_version']} is not supported (expected {STORE_FORMAT_VERSION}).")
+
+    columns = {}
+    for column_meta in meta['columns']:
+        values = np.load(os.path.join(store_path, column_meta['file']), mmap_mode = 'r', allow_pickle = False)
+
+        if column_meta['kind'] == 'datetime':
+            columns[column_meta['name']] = values.view('datetime64[ns]')
+        elif column_meta['kind'] == 'categorical':
+            columns[column_meta['name']] = pd.Categorical.from_codes(values, categories = column_meta['categories'])
+        else:
+            columns[column_meta['name']] = values
+
+    # copy = False keeps each column backed by its memory map
+    data = pd.DataFrame(columns, copy = False)
+    data.attrs['dataset_version'] = meta['dataset_version']
+    data.attrs['store_path'] = store_path
+    data.attrs['base_interval'] = meta.get('base_interval', '1D')
+    # write_store() sorts the rows, so the index doesn't need to check
+    data.attrs['sorted_by_ticker_and_date'] = True
+    return data
+
+
+def is_intraday(store_path: str) -> bool:
+    return read_meta(store_path).get('base_interval', '1D') in ('1min', '1h')
+
+
+def daily_view_path(store_path: str) -> str:
+    # the store directory holding a store's daily bars
+    return os.path.join(store_path, DAILY_VIEW_DIR_NAME) if is_intraday(store_path) else store_path
+
+
+def write_daily_view(store_path: str) -> Optional[dict]:
+    '''
+    Resamples an intraday store to daily bars and writes them as a store in its daily/ subdirectory, returning its metadata.
+    Daily stores are their own daily view, so nothing is written for them.
+    '''
+    if not is_intraday(store_path):
+        return None
+    daily_data = rs.resample_dataset(load_store(store_path), '1D')
+    return write_store(daily_data, daily_view_path(store_path), source = {'resampled_from': read_meta(store_path)['dataset_version']})
+
+
+def load_daily_view(store_path: str) -> pd.DataFrame:
+    # the daily bars of a store: the store itself if it is daily, otherwise its daily view (written on first use)
+    if not is_intraday(store_path):
+        return load_store(store_path)
+    daily_path = daily_view_path(store_path)
+    if read_meta(daily_path) is None:
+        write_daily_view(store_path)
+    daily_data = load_store(daily_path)
+    # the daily view is derived from the bars, so it shares their dataset version
+    daily_data.attrs['dataset_version'] = read_meta(store_path)['dataset_version']
+    return daily_data
+
+
+def load_or_convert(csv_path: str, store_root: str) -> pd.DataFrame:
+    '''
+    Loads the live version of the store root, converting the CSV into a new version first if there is none
+    or the live version was built from a different version of the CSV.
+    '''
+    store_path = current_store_path(store_root)
+    meta = None if store_path is None else read_meta(store_path)
+    source_stat = os.stat(csv_path)
+    stale = (
+        meta is None
+        or meta.get('format_version') != STORE_FORMAT_VERSION
+        or meta.get('source') is None
+        or meta['source'].get('path') != os.path.basename(csv_path)
+        or meta['source'].get('size') != source_stat.st_size
+        or meta['source'].get('mtime') != source_stat.st_mtime
+    )
+    if stale:
+        data, source = read_csv_source(csv_path)
+        publish(data, store_root, source = source, prepare = write_daily_view)
+        store_path = current_store_path(store_root)
+    return load_store(store_path)
+
+
+class LiveDataset():
+    '''
+    The live version of a store root and its DatasetIndex. Every poll_interval seconds index() checks CURRENT, and when a
+    new version has been published it loads and indexes it and swaps it in with a single reference assignment.
+    Requests already running keep the index they started with, so none are dropped during the swap. The caches keyed
+    by index (utils/dataset_index.py index_cache) are cleared on each swap.
+
+    index() is over the daily bars, which every daily metric uses. bars_index() is over the stored bars, which are
+    intraday bars for an intraday store (the candlestick graph's finer pyramid levels) and the same index otherwise.
+    '''
+
+    def __init__(self, store_root: str, poll_interval: float = 2.0):
+        self.store_root = store_root
+        self.poll_interval = poll_interval
+        self._reload_lock = threading.Lock()
+        self._last_check = time.monotonic()
+        self._current = self._load(current_version(store_root))
+
+    def _load(self, version_name: str) -> tuple:
+        store_path = os.path.join(self.store_root, version_name)
+        if not is_intraday(store_path):
+            daily_index = DatasetIndex(load_store(store_path))
+            return version_name, daily_index, daily_index
+        return version_name, DatasetIndex(load_daily_view(store_path)), DatasetIndex(load_store(store_path))
+
+    @property
+    def version(self) -> str:
+        return self._current[0]
+
+    def _check_for_new_version(self):
+        now = time.monotonic()
+        if now - self._last_check >= self.poll_interval:
+            self._last_check = now
+            version_name = current_version(self.store_root)
+            # one thread reloads while the others carry on serving the current version
+            if version_name is not None and version_name != self._current[0] and self._reload_lock.acquire(blocking = False):
+                try:
+                    self._current = self._load(version_name)
+                    # results cached for the old version's indexes would otherwise keep them, and the memory maps of
+                    # versions publish() has since pruned, alive
+                    clear_index_caches()
+                finally:
+                    self._reload_lock.release()
+
+    def index(self) -> DatasetIndex:
+        self._check_for_new_version()
+        return self._current[1]
+
+    def bars_index(self) -> DatasetIndex:
+        self._check_for_new_version()
+        return self._current[2]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python -m utils.data_store <csv_path> <store_root>')
+        sys.exit(1)
+    csv_data, csv_source = read_csv_source(sys.argv[1])
+    store_meta = publish(csv_data, sys.argv[2], source = csv_source, prepare = write_daily_view)
+    print(f"Published {store_meta['rows']} rows to {sys.argv[2]} (dataset version {store_meta['dataset_version']})")
@@ -0,0 +1,138 @@
+'''
+DATASET INDEX
+
+Index over the master stock data, built once at load. Rows are grouped contiguously per ticker and sorted by date
+within each ticker, so a (ticker, start date, end date) lookup is two binary searches followed by a zero-copy row slice.
+The cost of a lookup depends on the window length, not on the number of tickers in the dataset.
+'''
+from functools import lru_cache
+from typing import Callable, Tuple
+import numpy as np
+import pandas as pd
+
+
+# lru caches keyed by DatasetIndex objects (moment engines, pyramids, cross sections, summary tables, portfolios)
+_index_caches = []
+
+
+def to_nanoseconds(date, end_of_range: bool = False) -> int:
+    '''
+    Converts a date (string, datetime or Timestamp) to int64 nanoseconds since the epoch.
+    Date-only strings used as the end of a range cover the whole day, matching pandas partial string slicing.
+    '''
+    timestamp = pd.Timestamp(date)
+    if end_of_range and isinstance(date, str) and len(date.strip()) <= 10:
+        timestamp = timestamp + pd.Timedelta(days = 1) - pd.Timedelta(nanoseconds = 1)
+    return timestamp.value
+
+
+def index_cache(maxsize: int) -> Callable:
+    '''
+    lru_cache for functions of a DatasetIndex, registered so clear_index_caches() can empty it.
+    '''
+    def decorate(function: Callable) -> Callable:
+        cached_function = lru_cache(maxsize = maxsize)(function)
+        _index_caches.append(cached_function)
+        return cached_function
+    return decorate
+
+
+def clear_index_caches():
+    # called when a new dataset version goes live, so cached results don't keep retired indexes (and their memory maps) alive
+    for cached_function in _index_caches:
+        cached_function.cache_clear()
+
+
+class DatasetIndex():
+
+    def __init__(self, data: pd.DataFrame):
+
+        if not isinstance(data['Ticker'].dtype, pd.CategoricalDtype):
+            data = data.assign(Ticker = pd.Categorical(data['Ticker']))
+
+        ticker_codes = data['Ticker'].cat.codes.to_numpy()
+        dates = data['Date'].to_numpy().view(np.int64)
+
+        # the data store writes rows sorted by (Ticker, Date) and marks them so, so sorting (and checking, which costs
+        # several passes over hundreds of millions of intraday rows) is only needed for data from elsewhere
+        if data.attrs.get('sorted_by_ticker_and_date'):
+            grouped = sorted_within_ticker = True
+        else:
+            grouped = np.all(np.diff(ticker_codes) >= 0)
+            sorted_within_ticker = np.all((np.diff(dates) >= 0) | (np.diff(ticker_codes) != 0))
+        if not (grouped and sorted_within_ticker):
+            order = np.lexsort((dates, ticker_codes))
+            data = data.take(order).reset_index(drop = True)
+            ticker_codes = ticker_codes[order]
+            dates = dates[order]
+
+        self.data = data
+        self.tickers = list(data['Ticker'].cat.categories)
+        self.dataset_version = data.attrs.get('dataset_version')
+        self._dates = dates
+        self._ticker_positions = {ticker: position for position, ticker in enumerate(self.tickers)}
+
+        # row offsets for each ticker: rows of ticker i are [offsets[i], offsets[i + 1])
+        self._offsets = np.searchsorted(ticker_codes, np.arange(len(self.tickers) + 1), side = 'left')
+
+        # each ticker's first and last rows hold its earliest and latest dates, so no pass over every date is needed
+        non_empty = self._offsets[1:] > self._offsets[:-1]
+        self.min_date = pd.Timestamp(dates[self._offsets[:-1][non_empty]].min()) if len(dates) else None
+        self.max_date = pd.Timestamp(dates[self._offsets[1:][non_empty] - 1].max()) if len(dates) else None
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self._ticker_positions
+
+    def bounds(self, ticker: str, start_date = None, end_date = None) -> Tuple[int, int]:
+        '''
+        Returns the [first, last) row positions of the ticker's rows between start_date and end_date (inclusive).
+        Unknown tickers return an empty range.
+        '''
+        position = self._ticker_positions.get(ticker)
+        if position is None:
+            return 0, 0
+
+        first, last = self._offsets[position], self._offsets[position + 1]
+        ticker_dates = self._dates[first:last]
+
+        if start_date is not None:
+            first = first + np.searchsorted(ticker_dates, to_nanoseconds(start_date), side = 'left')
+        if end_date is not None:
+            last = self._offsets[position] + np.searchsorted(ticker_dates, to_nanoseconds(end_date, end_of_range = True), side = 'right')
+
+        return int(first), int(max(first, last))
+
+    def get(self, ticker: str, start_date = None, end_date = None) -> pd.DataFrame:
+        '''
+        Returns the ticker's rows between start_date and end_date (inclusive) as a view on the underlying data.
+        The returned frame should be treated as read only.
+        '''
+        first, last = self.bounds(ticker, start_date, end_date)
+        return self.data.iloc[first:last]
+
+    def dates(self, ticker: str, start_date = None, end_date = None) -> np.ndarray:
+        # int64 nanosecond dates of the ticker's rows in the window
+        first, last = self.bounds(ticker, start_date, end_date)
+        return self._dates[first:last]
+
+    def align(self, ticker: str, benchmark_ticker: str, start_date = None, end_date = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        '''
+        Returns the ticker's and the benchmark ticker's rows restricted to the dates they both traded on (an inner join on Date).
+        Both frames have the same length and are in the same date order.
+        '''
+        # dates are unique and sorted per ticker so the intersection can skip the sort
+        _, ticker_positions, benchmark_positions = np.intersect1d(
+            self.dates(ticker, start_date, end_date),
+            self.dates(benchmark_ticker, start_date, end_date),
+            assume_unique = True,
+            return_indices = True
+        )
+
+        ticker_df = self.get(ticker, start_date, end_date)
+        benchmark_df = self.get(benchmark_ticker, start_date, end_date)
+
+        # a full overlap keeps the zero-copy slices
+        if len(ticker_positions) == len(ticker_df) and len(benchmark_positions) == len(benchmark_df):
+            return ticker_df, benchmark_df
+        return ticker_df.iloc[ticker_positions], benchmark_df.iloc[benchmark_positions]
+
@@ -0,0 +1,75 @@
+'''
+DOWNSAMPLING
+
+Largest-Triangle-Three-Buckets (LTTB) downsampling for line traces. A series longer than the point budget is reduced to
+the budget by keeping, from each bucket of consecutive points, the point forming the largest triangle with the point kept
+from the previous bucket and the mean of the next bucket. Peaks and troughs survive, so the line looks the same at screen
+resolution while the payload stays a fixed size however long the date range is.
+
+Series already within the budget are returned untouched (exact). Zooming in narrows the date range through the
+relayoutData -> date picker flow, so the narrower window is re-fetched and falls back to full resolution once it fits.
+'''
+import numpy as np
+
+
+# a line graph is roughly 1000 pixels wide, two points per pixel is visually lossless
+DEFAULT_POINT_BUDGET = 2000
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, num_out: int) -> np.ndarray:
+    '''
+    Returns the sorted positions of the points LTTB keeps when reducing (x, y) to num_out points.
+    The first and last points are always kept. x must be increasing.
+    '''
+    num_points = len(x)
+    if num_out >= num_points:
+        return np.arange(num_points)
+    if num_out < 3:
+        return np.array([0, num_points - 1])
+
+    x = np.asarray(x, dtype = np.float64)
+    y = np.asarray(y, dtype = np.float64)
+
+    # the interior points are split into num_out - 2 buckets of (almost) equal size
+    bucket_edges = np.linspace(1, num_points - 1, num_out - 1).astype(np.int64)
+
+    # mean of each bucket, used as the third triangle vertex for the bucket before it
+    bucket_sizes = np.diff(bucket_edges)
+    bucket_mean_x = np.add.reduceat(x[1:num_points - 1], bucket_edges[:-1] - 1) / bucket_sizes
+    bucket_mean_y = np.add.reduceat(np.nan_to_num(y[1:num_points - 1]), bucket_edges[:-1] - 1) / bucket_sizes
+    bucket_mean_x = np.append(bucket_mean_x, x[-1])
+    bucket_mean_y = np.append(bucket_mean_y, y[-1])
+
+    selected = np.empty(num_out, dtype = np.int64)
+    selected[0] = 0
+    selected[-1] = num_points - 1
+    previous = 0
+    for bucket in range(num_out - 2):
+        first, last = bucket_edges[bucket], bucket_edges[bucket + 1]
+        next_x, next_y = bucket_mean_x[bucket + 1], bucket_mean_y[bucket + 1]
+
+        # twice the triangle area for every candidate in the bucket (the constant factor doesn't change the argmax)
+        areas = np.abs(
+            (x[previous] - next_x) * (y[first:last] - y[previous])
+            - (x[previous] - x[first:last]) * (next_y - y[previous])
+        )
+        areas[np.isnan(areas)] = -1.0
+        previous = first + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return selected
+
+
+def downsample_trace(x, y, max_points: int = DEFAULT_POINT_BUDGET):
+    '''
+    Downsamples a line trace to at most max_points points with LTTB. Dates in x are handled as int64 nanoseconds.
+    Returns numpy arrays (x keeps its datetime dtype). max_points of None disables downsampling.
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if max_points is None or len(x) <= max_points:
+        return x, y
+
+    x_numeric = x.view(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x
+    positions = lttb_indices(x_numeric, y, max_points)
+    return x[positions], y[positions]
@@ -0,0 +1,191 @@
+'''
+FIGURE CACHE
+
+LRU cache for the figures built in utils/graph_functions.py, keyed by (graph, dataset version, ticker, benchmark ticker,
+date range and any other arguments). Flicking back to a ticker/benchmark/range that was just viewed, or another user on the
+same dashboard asking for the same view, returns the cached figure instead of rebuilding it.
+
+Entries are kept in-process by default. If a disk_path is given, figures are also written there as JSON so every worker
+process on the machine (e.g. gunicorn workers) shares hits. The in-process entries are dropped when the dataset version
+changes. Workers reload at different moments, so the disk directories of other versions are only removed once they are
+older than the live version of the store root (and kept if no store_root is given).
+
+Cached figures are shared between callers and must not be modified.
+'''
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Optional
+from plotly.io.json import to_json_plotly
+from utils import data_store as ds
+from utils.dataset_index import DatasetIndex, to_nanoseconds
+
+
+class FigureCache():
+
+    def __init__(self, max_size: int = 256, disk_path: Optional[str] = None, max_disk_entries: int = 4096, store_root: Optional[str] = None):
+        self.max_size = max_size
+        self.disk_path = disk_path
+        self.store_root = store_root
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._dataset_version = None
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'dataset_version': self._dataset_version
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_version(self, dataset_version: str):
+        # a new dataset version makes every cached figure stale
+        if dataset_version == self._dataset_version:
+            return
+        self._entries.clear()
+        self._dataset_version = dataset_version
+        self._prune_disk()
+
+    def _prune_disk(self):
+        # removing the disk directories of versions older than the live one. A newer directory may belong to a worker that
+        # has already reloaded, and the live one to workers about to, so those (and this worker's own) are kept
+        if self.disk_path is None or self.store_root is None or not os.path.isdir(self.disk_path):
+            return
+        live_version = ds.current_version(self.store_root)
+        if live_version is None:
+            return
+        kept_versions = {self._dataset_version}
+        for version_name in os.listdir(self.store_root):
+            if version_name.startswith('version_') and not version_name.endswith(('.tmp', '.old')) and version_name >= live_version:
+                store_meta = ds.read_meta(os.path.join(self.store_root, version_name))
+                if store_meta is not None:
+                    kept_versions.add(store_meta['dataset_version'])
+        for version_dir in os.listdir(self.disk_path):
+            if version_dir not in kept_versions:
+                shutil.rmtree(os.path.join(self.disk_path, version_dir), ignore_errors = True)
+
+    def _disk_file(self, key: tuple) -> str:
+        key_hash = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.disk_path, str(self._dataset_version), f'{key_hash}.json')
+
+    def _read_disk(self, key: tuple):
+        file_path = self._disk_file(key)
+        try:
+            with open(file_path) as figure_file:
+                figure = json.load(figure_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        # touching the file marks it as recently used for the disk eviction
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+        return figure
+
+    def _write_disk(self, key: tuple, figure):
+        file_path = self._disk_file(key)
+        # plotly's encoder also handles the numpy arrays of encoded figure dicts
+        figure_json = figure.to_json() if hasattr(figure, 'to_json') else to_json_plotly(figure)
+
+        # writing to a temporary file and renaming it, so other workers never read a partial file. A worker on a newer
+        # version may remove the directory meanwhile, and the figure is then only cached in memory
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok = True)
+            file_descriptor, tmp_path = tempfile.mkstemp(dir = os.path.dirname(file_path), suffix = '.tmp')
+            with os.fdopen(file_descriptor, 'w') as tmp_file:
+                tmp_file.write(figure_json)
+            os.replace(tmp_path, file_path)
+            self._evict_disk(os.path.dirname(file_path))
+        except OSError:
+            pass
+
+    def _evict_disk(self, version_dir: str):
+        entries = [entry for entry in os.scandir(version_dir) if entry.name.endswith('.json')]
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort(key = lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def get_or_build(self, key: tuple, dataset_version: str, build: Callable):
+        '''
+        Returns the cached figure for key, building (and caching) it with build() on a miss.
+        '''
+        with self._lock:
+            self._check_version(dataset_version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        figure = self._read_disk(key) if self.disk_path is not None else None
+        if figure is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            figure = build()
+            with self._lock:
+                self.misses += 1
+            if self.disk_path is not None:
+                self._write_disk(key, figure)
+
+        with self._lock:
+            if dataset_version == self._dataset_version:
+                self._entries[key] = figure
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last = False)
+                    self.evictions += 1
+        return figure
+
+    def wrap(self, figure_function: Callable) -> Callable:
+        '''
+        Wraps a graph_functions figure builder so its figures are cached. The builder's DatasetIndex argument supplies the
+        dataset version, and start_date/end_date are normalised so equal dates in different formats share an entry.
+        '''
+        signature = inspect.signature(figure_function)
+
+        @wraps(figure_function)
+        def cached_figure_function(*args, **kwargs):
+            bound_arguments = signature.bind(*args, **kwargs)
+            bound_arguments.apply_defaults()
+
+            dataset_version = None
+            key = [figure_function.__name__]
+            for name, value in bound_arguments.arguments.items():
+                if isinstance(value, DatasetIndex):
+                    dataset_version = value.dataset_version if value.dataset_version is not None else str(id(value))
+                elif name == 'start_date' and value is not None:
+                    key.append((name, to_nanoseconds(value)))
+                elif name == 'end_date' and value is not None:
+                    key.append((name, to_nanoseconds(value, end_of_range = True)))
+                else:
+                    key.append((name, value))
+
+            return self.get_or_build(tuple(key), dataset_version, lambda: figure_function(*args, **kwargs))
+
+        cached_figure_function.cache = self
+        return cached_figure_function
@@ -0,0 +1,180 @@
+'''
+FIGURE ENCODING
+
+Compact encoding of the figures built in utils/graph_functions.py before Dash serializes them. Most of a figure's bytes
+are its trace arrays, so encode_figure() rewrites them:
+    - dates are sent as the shortest exact ISO string ('2022-11-02' rather than '2022-11-02T00:00:00.000000000')
+    - floats are sent at float32 precision (about 7 significant digits, more than any axis or hover label shows)
+    - with plotly.js 2.28 or later, numeric arrays are sent as base64 typed arrays ({'dtype', 'bdata', 'shape'}) rather
+      than as text. Older plotly.js (Dash 2.6 bundles 2.13) can't decode them, so the bundled version is checked first
+Dates are looked up in a table of day strings rather than formatted each time, and an array shared by several traces is
+encoded once. Dash serializes the result with plotly's orjson engine (orjson is in stock_analysis_env.yaml; without it
+plotly falls back to the much slower standard library encoder), and the app compresses responses.
+
+payload_report() compares a figure's default and compact encodings (bytes, gzipped bytes and encoding time).
+'''
+import base64
+import gzip
+import os
+import re
+import statistics
+import time
+from functools import wraps
+from typing import Callable, Optional, Tuple
+import numpy as np
+import pandas as pd
+import plotly.io.json as pio_json
+from plotly.basedatatypes import BaseFigure
+
+
+NANOSECONDS_PER_DAY = 24 * 60 * 60 * 10**9
+
+# plotly.js typed array dtypes. int64 isn't one, so larger integers are sent as float64
+TYPED_ARRAY_DTYPES = {
+    np.dtype(np.int8): 'i1', np.dtype(np.uint8): 'u1', np.dtype(np.int16): 'i2', np.dtype(np.uint16): 'u2',
+    np.dtype(np.int32): 'i4', np.dtype(np.uint32): 'u4', np.dtype(np.float32): 'f4', np.dtype(np.float64): 'f8',
+}
+
+# the first plotly.js release that decodes typed arrays in figure data
+TYPED_ARRAYS_MIN_PLOTLYJS = (2, 28)
+
+
+def bundled_plotlyjs_version() -> Optional[Tuple[int, ...]]:
+    # the plotly.js version dcc.Graph renders with, read from the header of the bundle Dash serves
+    try:
+        from dash import dcc
+        with open(os.path.join(os.path.dirname(dcc.__file__), 'plotly.min.js')) as bundle:
+            match = re.search(r'plotly\.js v(\d+)\.(\d+)\.(\d+)', bundle.read(512))
+    except OSError:
+        return None
+    return tuple(int(part) for part in match.groups()) if match else None
+
+
+def typed_arrays_supported() -> bool:
+    version = bundled_plotlyjs_version()
+    return version is not None and version >= TYPED_ARRAYS_MIN_PLOTLYJS
+
+
+# ('YYYY-MM-DD' strings of consecutive days, the day number of the first). Formatting dates is most of the cost of
+# encoding a daily figure, so the strings are made once and looked up; the table grows to cover any day it is asked for
+_day_strings_table = (np.empty(0, dtype = object), 0)
+
+
+def _day_strings(days: np.ndarray) -> list:
+    global _day_strings_table
+    day_strings, first_day = _day_strings_table
+    if len(days) == 0:
+        return []
+    low, high = int(days.min()), int(days.max())
+    if low < first_day or high >= first_day + len(day_strings):
+        if len(day_strings):
+            low, high = min(low, first_day), max(high, first_day + len(day_strings) - 1)
+        day_strings = np.datetime_as_string(np.arange(low, high + 1).astype('datetime64[D]'), unit = 'D').astype(object)
+        first_day = low
+        _day_strings_table = (day_strings, first_day)
+    return day_strings[days - first_day].tolist()
+
+
+def _date_strings(values: np.ndarray) -> list:
+    # the coarsest ISO unit that still represents every date exactly
+    nanoseconds = values.astype('datetime64[ns]').view(np.int64)
+    days, day_nanoseconds = np.divmod(nanoseconds, NANOSECONDS_PER_DAY)
+    if not day_nanoseconds.any():
+        return _day_strings(days)
+    for unit, unit_nanoseconds in (('m', 60 * 10**9), ('s', 10**9)):
+        if np.all(nanoseconds % unit_nanoseconds == 0):
+            return np.datetime_as_string(values, unit = unit).tolist()
+    return np.datetime_as_string(values, unit = 'ms').tolist()
+
+
+def _typed_array(values: np.ndarray) -> dict:
+    if values.dtype not in TYPED_ARRAY_DTYPES:
+        values = values.astype(np.float64)
+    typed_array = {'dtype': TYPED_ARRAY_DTYPES[values.dtype], 'bdata': base64.b64encode(np.ascontiguousarray(values).tobytes()).decode('ascii')}
+    if values.ndim > 1:
+        typed_array['shape'] = ', '.join(str(length) for length in values.shape)
+    return typed_array
+
+
+def encode_array(values, typed_arrays: bool = False):
+    '''
+    Returns the compact form of one trace array, or the values unchanged if they aren't a numeric or date array.
+    '''
+    if isinstance(values, (pd.Series, pd.Index)):
+        values = values.to_numpy()
+    if not isinstance(values, np.ndarray):
+        return values
+
+    if values.dtype.kind == 'M':
+        return _date_strings(values)
+    if values.dtype.kind in 'OUS':
+        # e.g. bar colours. orjson only serializes numeric numpy arrays itself
+        return values.tolist()
+    if values.dtype.kind == 'f' and values.dtype.itemsize > 4:
+        values = values.astype(np.float32)
+    elif values.dtype.kind == 'i' and values.dtype.itemsize > 4 and typed_arrays:
+        int32_info = np.iinfo(np.int32)
+        if len(values) == 0 or (values.min() >= int32_info.min and values.max() <= int32_info.max):
+            values = values.astype(np.int32)
+    if typed_arrays and values.dtype.kind in 'iuf':
+        return _typed_array(values)
+    return values
+
+
+def _encode_object(plotly_object, typed_arrays: bool, encoded_arrays: dict):
+    if isinstance(plotly_object, dict):
+        return {key: _encode_object(value, typed_arrays, encoded_arrays) for key, value in plotly_object.items()}
+    if isinstance(plotly_object, (list, tuple)):
+        return [_encode_object(value, typed_arrays, encoded_arrays) for value in plotly_object]
+    if not isinstance(plotly_object, (np.ndarray, pd.Series, pd.Index)):
+        return plotly_object
+    # traces often share an array (every trace of a date-aligned graph has the same x), so each is encoded once
+    if id(plotly_object) not in encoded_arrays:
+        encoded_arrays[id(plotly_object)] = encode_array(plotly_object, typed_arrays)
+    return encoded_arrays[id(plotly_object)]
+
+
+def encode_figure(figure, typed_arrays: Optional[bool] = None) -> dict:
+    '''
+    Returns the figure as a dict with its trace arrays in compact form. Layouts are left as they are (and not copied).
+    typed_arrays defaults to whether the bundled plotly.js can decode them.
+    '''
+    if typed_arrays is None:
+        typed_arrays = TYPED_ARRAYS
+    if isinstance(figure, BaseFigure):
+        # to_plotly_json() deep copies the layout (template and all), which cost more than the rest of the encoding.
+        # The traces are rebuilt below, so only the layout is shared with the figure
+        figure_dict = {'data': figure._data, 'layout': figure._layout}
+    else:
+        figure_dict = figure.to_plotly_json() if hasattr(figure, 'to_plotly_json') else dict(figure)
+    encoded_arrays = {}
+    return {**figure_dict, 'data': [_encode_object(trace, typed_arrays, encoded_arrays) for trace in figure_dict.get('data', [])]}
+
+
+def encoded(figure_function: Callable) -> Callable:
+    # wraps a graph_functions figure builder so it returns the encoded figure
+    @wraps(figure_function)
+    def encoded_figure_function(*args, **kwargs):
+        return encode_figure(figure_function(*args, **kwargs))
+    return encoded_figure_function
+
+
+def payload_report(figure, repeat: int = 20) -> dict:
+    '''
+    Bytes (raw and gzipped) and median encoding time over repeat runs of the figure's default JSON and of its compact
+    encoding (encode_figure() plus serialization).
+    '''
+    report = {}
+    for name, encode in (('default', lambda: pio_json.to_json_plotly(figure)), ('compact', lambda: pio_json.to_json_plotly(encode_figure(figure)))):
+        figure_json = encode().encode()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encode()
+            timings.append(time.perf_counter() - start)
+        report[name] = {'encode_s': statistics.median(timings), 'json_bytes': len(figure_json), 'gzip_bytes': len(gzip.compress(figure_json))}
+    return report
+
+
+# checked once at import, the bundle doesn't change while the app runs
+TYPED_ARRAYS = typed_arrays_supported()
@@ -0,0 +1,84 @@
+'''
+FIGURE SKELETONS
+
+Figure layouts (template, fonts, legend, margins, gridlines, subplots) built once per graph type and mode instead of on
+every figure build. Applying the plotly_white template through update_layout was most of the time a figure took to build.
+
+A graph function registers a skeleton's layout with @skeleton(name) and builds its figures with skeleton_figure(), which
+returns a plain figure dict: the traces, the skeleton layout merged with any per-figure layout overrides, and under
+'skeleton' the skeleton name and those overrides. plotly.js ignores the extra key, so the dict is a usable figure.
+
+The app sends each browser every skeleton layout once (client_skeletons(), the shared template only once), and its graph
+callbacks send partial_update(figure): just the traces and layout overrides. A clientside callback rebuilds the figure
+(apply_figure_update in assets/clientside_callbacks.js), so a date range change doesn't resend the layout.
+'''
+from functools import lru_cache
+from typing import Callable, Optional
+
+
+SKELETON_KEY = 'skeleton'
+
+_skeleton_builders = {}
+
+
+def skeleton(name: str) -> Callable:
+    '''
+    Registers a function returning a go.Figure whose layout is the named skeleton. The function's traces are ignored.
+    '''
+    def register(build_figure: Callable) -> Callable:
+        _skeleton_builders[name] = build_figure
+        return build_figure
+    return register
+
+
+@lru_cache(maxsize = None)
+def skeleton_layout(name: str) -> dict:
+    # the layout as a plain dict, shared by every figure built on the skeleton, so it must not be modified
+    return _skeleton_builders[name]().to_plotly_json()['layout']
+
+
+def merged(base: dict, overrides: Optional[dict]) -> dict:
+    # base with the overrides applied, recursing into nested dicts. Only the dicts on the overridden paths are copied
+    if not overrides:
+        return base
+    result = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merged(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def skeleton_figure(name: str, traces: list, layout: Optional[dict] = None) -> dict:
+    '''
+    Returns a figure dict of the traces (plain trace dicts) on the named skeleton, with layout overriding parts of its layout.
+    '''
+    layout = layout or {}
+    return {'data': traces, 'layout': merged(skeleton_layout(name), layout), SKELETON_KEY: {'name': name, 'layout': layout}}
+
+
+def client_skeletons() -> dict:
+    '''
+    Every registered skeleton layout for the browser, with the template (shared by all of them) sent once.
+    '''
+    layouts = {name: skeleton_layout(name) for name in _skeleton_builders}
+    templates = {repr(layout.get('template')) for layout in layouts.values()}
+    if len(templates) > 1:
+        raise ValueError('Figure skeletons must share one template to be sent to the browser together.')
+    template = next(iter(layouts.values())).get('template') if layouts else None
+    return {
+        'template': template,
+        'layouts': {name: {key: value for key, value in layout.items() if key != 'template'} for name, layout in layouts.items()},
+    }
+
+
+def partial_update(figure) -> dict:
+    '''
+    What a graph callback sends for a figure: the skeleton name, traces and layout overrides of a skeleton figure,
+    or the whole figure for any other figure.
+    '''
+    if isinstance(figure, dict) and SKELETON_KEY in figure:
+        return {'skeleton': figure[SKELETON_KEY]['name'], 'data': figure['data'], 'layout': figure[SKELETON_KEY]['layout']}
+    return {'figure': figure}
+
@@ -4,14 +4,69 @@ GRAPH CREATIONS
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 from dash import dash_table
+from typing import Tuple
 import numpy as np
 import pandas as pd
 from utils import calculation_functions as cf
+from utils.dataset_index import DatasetIndex, to_nanoseconds
+from utils import downsampling as dsp
+from utils import resampling as rs
+from utils import cross_section as cs
+from utils import figure_skeletons as fs
+
+
+# tickers shown on the correlation heatmap at most (the cells are tickers squared)
+MAX_HEATMAP_TICKERS = 50
+
+# default rolling window of the rolling statistics graph, in trading days (about three months)
+DEFAULT_ROLLING_WINDOW = 60
 
 
 # candlestick graph figure
-def create_candlestick_graph(stock_df: pd.DataFrame) -> go.Candlestick:
-    
+def _session_rangebreak(bar_dates: np.ndarray, interval: str):
+    '''
+    rangebreak hiding the hours outside the trading session of intraday bars (int64 nanoseconds), so nights don't leave gaps.
+    None for bars that trade around the clock.
+    '''
+    minutes_of_day = (bar_dates % rs.NANOSECONDS_PER_DAY) // rs.NANOSECONDS_PER_MINUTE
+    bar_minutes = 1 if interval == '1min' else 60
+    session_open = minutes_of_day.min() / 60
+    session_close = (minutes_of_day.max() + bar_minutes) / 60
+    if session_close - session_open >= 24:
+        return None
+    return dict(bounds=[session_close, session_open], pattern="hour")
+
+
+# layout skeletons (see utils/figure_skeletons.py). Each layout is built once, the first time a figure needs it
+
+# styling shared by every graph
+def _decorate(figure: go.Figure, **layout_kwargs) -> go.Figure:
+    figure.update_layout(
+        template="plotly_white",
+        font=dict( 
+            size=14,
+            color='Navy'
+        ),
+        autosize=True, #graph size adjusts with screen
+        margin=dict(l=10, r=10, t=30, b=0), #margins within figure
+        **layout_kwargs
+    )
+    # update gridlines and automargin scaling
+    figure.update_xaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
+    figure.update_yaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
+    return figure
+
+# legend in a row above the plot
+TOP_LEGEND = dict(
+    orientation="h",
+    yanchor="bottom",
+    y=1.02,
+    xanchor="left",
+    x=0
+)
+
+@fs.skeleton('candlestick')
+def _candlestick_skeleton() -> go.Figure:
     #declaring figure comprised of subplots
     price_figure = make_subplots(
                         rows=2, 
@@ -20,310 +75,348 @@ def create_candlestick_graph(stock_df: pd.DataFrame) -> go.Candlestick:
                         vertical_spacing=0.05
                     ) #shared x axis & distance between subplots 
     
-    #first subplot
-    price_figure.add_trace(
-        go.Candlestick(x=stock_df['Date'],
-                    open=stock_df['Open'],
-                    high=stock_df['High'],
-                    low=stock_df['Low'],
-                    close=stock_df['Close'],
-                    name="Price"),
-        row=1,col=1
-    )
-    
-    #second subplot, using the marker argument to determine the bar colour based on closing lower or higher
-    price_figure.add_trace(
-        go.Bar(x=stock_df['Date'],
-            y=stock_df['Volume'],
-            name="Volume",
-            marker=dict(color = ['green' if x>0 else 'red' for x in stock_df['Close'] - stock_df['Open']])),
-        row=2,col=1
-    )
-    
     # removing rangeslider
     price_figure.update_layout(xaxis_rangeslider_visible=False)
     
     # hide weekends
     price_figure.update_xaxes(rangebreaks=[dict(bounds=["sat", "mon"])])
     
-    # update gridlines and automargin scaling
-    price_figure.update_xaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
-    price_figure.update_yaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
+    return _decorate(price_figure, yaxis1_title="Price (Exchange CCY)", showlegend=False)
+
+@fs.skeleton('price_line')
+def _price_line_skeleton() -> go.Figure:
+    return _decorate(go.Figure(), legend=TOP_LEGEND, yaxis_title="Price (Exchange CCY)")
+
+@fs.skeleton('price_line_benchmark')
+def _price_line_benchmark_skeleton() -> go.Figure:
+    return _decorate(go.Figure(), legend=TOP_LEGEND, yaxis_title="Price rebased to 100")
+
+@fs.skeleton('returns_line')
+def _returns_line_skeleton() -> go.Figure:
+    return _decorate(go.Figure(), legend=TOP_LEGEND, yaxis_title="Returns %")
+
+@fs.skeleton('returns_histogram')
+def _returns_histogram_skeleton() -> go.Figure:
+    return _decorate(go.Figure(), yaxis_title="Frequency", barmode="overlay", bargap=0)
+
+@fs.skeleton('returns_histogram_benchmark')
+def _returns_histogram_benchmark_skeleton() -> go.Figure:
+    return _decorate(go.Figure(), legend=TOP_LEGEND, xaxis_title="Daily Returns %", yaxis_title="Frequency", barmode="group", bargap=0)
+
+
+def create_candlestick_graph(data_index: DatasetIndex, ticker: str, start_date = None, end_date = None, max_candles: int = rs.MAX_CANDLES, interval: str = None) -> dict:
+    '''
+    candles come from the ticker's OHLCV pyramid: the finest interval (minute, hourly, daily, weekly or monthly, from the
+    stored bars up) that fits the date range into at most max_candles candles. None plots the stored bars.
+    An interval sets the finest level used, e.g. '1D' for daily candles from an intraday store.
+    '''
     
-    #naming and decorating
-    price_figure.update_layout(
-        yaxis1_title="Price (Exchange CCY)",
-        yaxis2_title="Daily Volume",
-        showlegend=False,
-        template="plotly_white",
-        font=dict( 
-                size=14,
-                color='Navy'
-        ),
-        autosize=True, #graph size adjusts with screen
-        margin=dict(l=10, r=10, t=30, b=0) #margins within figure
+    # picking the pyramid level and slicing its bars for the date range
+    interval, bars = rs.ohlcv_pyramid(data_index, ticker).select(start_date, end_date, max_candles, interval)
+    bar_dates = bars['Date'].view('datetime64[ns]')
+    
+    #first subplot, candles
+    candlestick_trace = dict(
+        type="candlestick",
+        x=bar_dates,
+        open=bars['Open'],
+        high=bars['High'],
+        low=bars['Low'],
+        close=bars['Close'],
+        name="Price",
+        xaxis="x", yaxis="y"
     )
     
+    #second subplot, using the marker argument to determine the bar colour based on closing lower or higher
+    volume_trace = dict(
+        type="bar",
+        x=bar_dates,
+        y=bars['Volume'],
+        name="Volume",
+        marker=dict(color = np.where(bars['Close'] - bars['Open'] > 0, 'green', 'red')),
+        xaxis="x2", yaxis="y2"
+    )
+    
+    # volume axis named by the interval, and nights between intraday sessions hidden along with the skeleton's weekends
+    layout = {'yaxis2': {'title': {'text': f"{rs.INTERVAL_LABELS[interval]} Volume"}}}
+    if interval in ('1min', '1h') and len(bars['Date']) > 0:
+        session_rangebreak = _session_rangebreak(bars['Date'], interval)
+        if session_rangebreak is not None:
+            rangebreaks = [dict(bounds=["sat", "mon"]), session_rangebreak]
+            layout.update(xaxis={'rangebreaks': rangebreaks}, xaxis2={'rangebreaks': rangebreaks})
+    
     # return graph
-    return price_figure
+    return fs.skeleton_figure('candlestick', [candlestick_trace, volume_trace], layout)
 
 # labelling subplot axes: https://community.plotly.com/t/subplots-with-shared-x-axes-but-show-x-axis-for-each-plot/34800/2
 
+# line trace downsampled (LTTB) to the point budget. Windows within the budget are plotted exactly
+def _line_trace(x, y, max_points: int, **trace_kwargs) -> dict:
+    x, y = dsp.downsample_trace(x, y, max_points)
+    return dict(type = 'scatter', x = x, y = y, **trace_kwargs)
+
 # Line graph comparing one ticker's rebase closee prices to another ticker's (benchmark) over time
-def create_price_line_graph(stock_df: pd.DataFrame, ticker: str, benchmark_ticker: str) -> go.Scatter:
+def create_price_line_graph(data_index: DatasetIndex, ticker: str, benchmark_ticker: str, start_date = None, end_date = None, max_points: int = dsp.DEFAULT_POINT_BUDGET) -> dict:
     '''
     creating plotly line graph comparing two tickers results over time. We will use the close price only
+    
+    each line is downsampled to at most max_points points (None plots every point)
     '''
     if benchmark_ticker is None:
         # slicing df for plotting
-        sliced_stock_df = stock_df.loc[stock_df['Ticker'] == ticker, ('Ticker', 'Date', 'Close')].set_index('Date')
+        sliced_stock_df = data_index.get(ticker, start_date, end_date)
         # plotting line figure
-        line_figure = go.Figure()
-        line_figure.add_trace(go.Scatter(x = sliced_stock_df.index, y = sliced_stock_df['Close'], name = f'{ticker} price'))
-    
-        # updating figure titles and labels
-        line_figure.update_layout(
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="left",
-                x=0
-            ),
-            yaxis_title="Price (Exchange CCY)",
-            template="plotly_white",
-            font=dict( 
-                size=14,
-                color='Navy'
-            ),
-            autosize=True, #graph size adjusts with screen
-            margin=dict(l=10, r=10, t=30, b=0) #margins within figure
-            )
-        
-    else:
-        # creating a merged dataframe using copies of the individual ticker dataframes. This ensures the same date range (inner merge)
-        merged_df = pd.merge(
-            stock_df.loc[stock_df['Ticker'] == ticker, ('Ticker', 'Date', 'Close')].set_index('Date'),
-            stock_df.loc[stock_df['Ticker'] == benchmark_ticker, ('Ticker', 'Date', 'Close')].set_index('Date'),     
-            on = 'Date',
-            how = 'inner'
-        )
-        
-        ## first find factor for which to rebase Close values by per ticker
-        rebasing_factor_ticker = round(100/(merged_df.loc[merged_df['Ticker_x'] == ticker, 'Close_x'].iloc[0]),10) # identifies first close value in dataframe for ticker
-        rebasing_factor_benchmark = round(100/(merged_df.loc[merged_df['Ticker_y'] == benchmark_ticker, 'Close_y'].iloc[0]),10) # identifies first close value in dataframe for ticker
-        
-        ## rebase using pandas.apply()
-        merged_df.loc[merged_df['Ticker_x'] == ticker, 'Close_x'] = merged_df['Close_x'][merged_df['Ticker_x'] == ticker].apply(lambda x: round(x * rebasing_factor_ticker, 4))
-        merged_df.loc[merged_df['Ticker_y'] == benchmark_ticker, 'Close_y'] = merged_df['Close_y'][merged_df['Ticker_y'] == benchmark_ticker].apply(lambda x: round(x * rebasing_factor_benchmark, 4))
-        
-        ## plotting the line graphs, make 'color' ticker to create distinct coloured lines
-        line_figure = go.Figure()
-        # add ticker trace
-        line_figure.add_trace(go.Scatter(x = merged_df.index, y = merged_df['Close_x'], name = f'{ticker} price'))
-        # add benchmark trace
-        line_figure.add_trace(go.Scatter(x = merged_df.index, y = merged_df['Close_y'], name = f'{benchmark_ticker} price'))
-    
-        # updating figure titles and labels
-        line_figure.update_layout(
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="left",
-                x=0
-            ),
-            yaxis_title="Price rebased to 100",
-            template="plotly_white",
-            font=dict( 
-                size=14,
-                color='Navy'
-            ),
-            autosize=True, #graph size adjusts with screen
-            margin=dict(l=10, r=10, t=30, b=0) #margins within figure
-            )
+        return fs.skeleton_figure('price_line', [_line_trace(sliced_stock_df['Date'], sliced_stock_df['Close'], max_points, name = f'{ticker} price')])
     
-    # update gridlines and automargin scaling
-    line_figure.update_xaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
-    line_figure.update_yaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
+    # aligning the ticker and benchmark rows on the dates they both traded. This ensures the same date range (inner join)
+    ticker_df, benchmark_df = data_index.align(ticker, benchmark_ticker, start_date, end_date)
+    ticker_close = ticker_df['Close'].to_numpy(dtype = np.float64)
+    benchmark_close = benchmark_df['Close'].to_numpy(dtype = np.float64)
+    
+    ## rebase both tickers to 100 at the first close value in the date range
+    if len(ticker_close) > 0:
+        rebasing_factor_ticker = round(100/ticker_close[0], 10)
+        rebasing_factor_benchmark = round(100/benchmark_close[0], 10)
+        ticker_close = np.round(ticker_close * rebasing_factor_ticker, 4)
+        benchmark_close = np.round(benchmark_close * rebasing_factor_benchmark, 4)
+    
+    ## plotting the line graphs, one trace per ticker to create distinct coloured lines
+    return fs.skeleton_figure('price_line_benchmark', [
+        _line_trace(ticker_df['Date'], ticker_close, max_points, name = f'{ticker} price'),
+        _line_trace(benchmark_df['Date'], benchmark_close, max_points, name = f'{benchmark_ticker} price'),
+    ])
+
+# ETL line for the returns graphs: either the ETL of the whole date range as a constant, or a rolling ETL series
+def _etl_line(data_index: DatasetIndex, ticker: str, start_date, end_date, tail_percent: float, etl_window: int = None) -> Tuple[pd.Series, np.ndarray, str]:
+    
+    if etl_window is None:
+        sliced_stock_df = data_index.get(ticker, start_date, end_date)
+        etl = round(cf.etl_daily_returns(sliced_stock_df, tail_percent), 2)
+        return sliced_stock_df['Date'], np.full(len(sliced_stock_df), etl), f'{ticker} Expected Tail Loss of {tail_percent:g}%'
     
-    return line_figure
+    # rolling from the start of the ticker's history so the first visible windows are full
+    history_df = data_index.get(ticker, None, end_date)
+    rolling_etl = np.round(cf.rolling_etl_daily_returns(history_df, etl_window, tail_percent), 2)
+    first_visible = len(history_df) - len(data_index.get(ticker, start_date, end_date))
+    return history_df['Date'].iloc[first_visible:], rolling_etl[first_visible:], f'{ticker} {etl_window}-day Rolling Expected Tail Loss of {tail_percent:g}%'
+
 
 # stock returns time series scatter graph
-def create_returns_line_graph(stock_df: pd.DataFrame, ticker: str, benchmark_ticker: str) -> go.Scatter:
+def create_returns_line_graph(data_index: DatasetIndex, ticker: str, benchmark_ticker: str, start_date = None, end_date = None, tail_percent: float = 5, etl_window: int = None, max_points: int = dsp.DEFAULT_POINT_BUDGET) -> dict:
+    '''
+    tail_percent sets the ETL tail. If etl_window (number of trading days) is given then the ETL lines are rolling ETL series
+    instead of a constant ETL over the date range. Each line is downsampled to at most max_points points (None plots every point).
+    '''
     
     if benchmark_ticker is None:
         # slicing df for plotting
-        sliced_stock_df = stock_df.loc[stock_df['Ticker'] == ticker, ('Ticker', 'Date', 'Daily Returns %')].set_index('Date')
-        # adding ETL 5% df column
-        sliced_stock_df['ETL_5'] = round(cf.etl_5_percent_daily_returns(sliced_stock_df), 2)
+        sliced_stock_df = data_index.get(ticker, start_date, end_date)
+        # ETL line, constant over the date range or rolling
+        etl_dates, etl_values, etl_name = _etl_line(data_index, ticker, start_date, end_date, tail_percent, etl_window)
         
         # creating returns figure
-        returns_figure = go.Figure()
-        returns_figure.add_trace(go.Scatter(x = sliced_stock_df.index, y = sliced_stock_df['Daily Returns %'], name = f'{ticker} Daily Returns %', line = dict(color = 'dodgerblue')))
-        returns_figure.add_trace(go.Scatter(x = sliced_stock_df.index, y = sliced_stock_df['ETL_5'], name = f'{ticker} Expected Tail Loss of 5%', line = dict(dash = 'longdash', color = 'limegreen')))
-    
-        # updating figure titles and labels
-        returns_figure.update_layout(
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="left",
-                x=0
-            ),
-            yaxis_title="Returns %",
-            template="plotly_white",
-            font=dict( 
-                size=14,
-                color='Navy'
-            ),
-            autosize=True, #graph size adjusts with screen
-            margin=dict(l=10, r=10, t=30, b=0) #margins within figure
-            )
+        return fs.skeleton_figure('returns_line', [
+            _line_trace(sliced_stock_df['Date'], sliced_stock_df['Daily Returns %'], max_points, name = f'{ticker} Daily Returns %', line = dict(color = 'dodgerblue')),
+            _line_trace(etl_dates, etl_values, max_points, name = etl_name, line = dict(dash = 'longdash', color = 'limegreen')),
+        ])
     
-    else:
-        ticker_df = stock_df.loc[stock_df['Ticker'] == ticker, ('Ticker', 'Date', 'Daily Returns %')].set_index('Date')
-        benchmark_df = stock_df.loc[stock_df['Ticker'] == benchmark_ticker, ('Ticker', 'Date', 'Daily Returns %')].set_index('Date')
-        
-        # calculating ETL 5% for tikcer & benchmark
-        ETL_5_ticker = round(cf.etl_5_percent_daily_returns(ticker_df), 2)
-        ETL_5_benchmark = round(cf.etl_5_percent_daily_returns(benchmark_df), 2)
-        
-        # creating a merged dataframe using copies of the individual ticker dataframes. This ensures the same date range (inner merge)
-        merged_df = pd.merge(
-            ticker_df,
-            benchmark_df,     
-            on = 'Date',
-            how = 'inner'
-        )
-        # adding ETL columns for ticker and benchmark (now referred to as '..._x' and '..._y' respectively since pandas merging)
-        merged_df['ETL_x'] = ETL_5_ticker
-        merged_df['ETL_y'] = ETL_5_benchmark
-        
-        # creating returns figure
-        returns_figure = go.Figure()
-        returns_figure.add_trace(go.Scatter(x = merged_df.index, y = merged_df['Daily Returns %_x'], name = f'{ticker} Daily Returns %', line = dict(color = 'dodgerblue')))
-        returns_figure.add_trace(go.Scatter(x = merged_df.index, y = merged_df['Daily Returns %_y'], name = f'{benchmark_ticker} Daily Returns %', line = dict(color = 'limegreen')))
-        returns_figure.add_trace(go.Scatter(x = merged_df.index, y = merged_df['ETL_x'], name = f'{ticker} Expected Tail Loss of 5%', line = dict(dash = 'longdash', color = 'dodgerblue')))
-        returns_figure.add_trace(go.Scatter(x = merged_df.index, y = merged_df['ETL_y'], name = f'{benchmark_ticker} Expected Tail Loss of 5%', line = dict(dash = 'longdash', color = 'limegreen')))
-    
-        # updating figure titles and labels
-        returns_figure.update_layout(
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="left",
-                x=0
-            ),
-            yaxis_title="Returns %",
-            template="plotly_white",
-            font=dict( 
-                size=14,
-                color='Navy'
-            ),
-            autosize=True, #graph size adjusts with screen
-            margin=dict(l=10, r=10, t=30, b=0) #margins within figure
-            )
-    # update gridlines and automargin scaling
-    returns_figure.update_xaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
-    returns_figure.update_yaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
+    # aligning the ticker and benchmark rows on the dates they both traded. This ensures the same date range (inner join)
+    ticker_df, benchmark_df = data_index.align(ticker, benchmark_ticker, start_date, end_date)
+    dates = ticker_df['Date']
     
-    return returns_figure
+    # ETL lines for ticker & benchmark over each ticker's own rows. A constant ETL line is drawn over the shared dates
+    ticker_etl_dates, ticker_etl_values, ticker_etl_name = _etl_line(data_index, ticker, start_date, end_date, tail_percent, etl_window)
+    benchmark_etl_dates, benchmark_etl_values, benchmark_etl_name = _etl_line(data_index, benchmark_ticker, start_date, end_date, tail_percent, etl_window)
+    if etl_window is None:
+        ticker_etl_dates, ticker_etl_values = dates, np.full(len(dates), ticker_etl_values[0] if len(ticker_etl_values) else np.nan)
+        benchmark_etl_dates, benchmark_etl_values = dates, np.full(len(dates), benchmark_etl_values[0] if len(benchmark_etl_values) else np.nan)
+    
+    # creating returns figure
+    return fs.skeleton_figure('returns_line', [
+        _line_trace(dates, ticker_df['Daily Returns %'], max_points, name = f'{ticker} Daily Returns %', line = dict(color = 'dodgerblue')),
+        _line_trace(dates, benchmark_df['Daily Returns %'], max_points, name = f'{benchmark_ticker} Daily Returns %', line = dict(color = 'limegreen')),
+        _line_trace(ticker_etl_dates, ticker_etl_values, max_points, name = ticker_etl_name, line = dict(dash = 'longdash', color = 'dodgerblue')),
+        _line_trace(benchmark_etl_dates, benchmark_etl_values, max_points, name = benchmark_etl_name, line = dict(dash = 'longdash', color = 'limegreen')),
+    ])
+
+
+# pre-binned histogram trace: one bar per bin, centred in the bin. Grouped bars share the bin width between traces
+def _histogram_bar(right_edges: np.ndarray, counts: np.ndarray, bin_size: float, grouped: bool = False, **trace_kwargs) -> dict:
+    if grouped:
+        return dict(type = 'bar', x = right_edges - bin_size/2, y = counts, **trace_kwargs)
+    return dict(type = 'bar', x = right_edges - bin_size/2, y = counts, width = bin_size, **trace_kwargs)
 
 
 # returns histogram graph
-def create_returns_histogram(stock_df: pd.DataFrame, ticker: str, benchmark_ticker: str) -> go.Histogram:
+def create_returns_histogram(data_index: DatasetIndex, ticker: str, benchmark_ticker: str, start_date = None, end_date = None, tail_percent: float = 5, etl_window: int = None, bin_rule = 1.0) -> dict:
+    '''
+    tail_percent sets the ETL tail. If etl_window (number of trading days) is given then the distribution of the rolling ETL
+    over the date range is overlaid on the returns distribution.
+    
+    returns are binned server-side (cf.histogram_bins) and sent as one bar per bin, so the payload depends on the number of bins
+    rather than the number of days. bin_rule is a bin width in % (default 1% bins), 'fd' or 'sturges'.
+    '''
     
     if benchmark_ticker is None:
         # slicing df for plotting
-        sliced_stock_df = stock_df.loc[stock_df['Ticker'] == ticker, ('Ticker', 'Date', 'Daily Returns %')].set_index('Date')
-        
-        # Calculating ETL 5%
-        ETL_5 = round(cf.etl_5_percent_daily_returns(sliced_stock_df), 2)
+        sliced_stock_df = data_index.get(ticker, start_date, end_date)
+        daily_returns = sliced_stock_df['Daily Returns %'].to_numpy()
+        bin_size = cf.histogram_bin_size(daily_returns, bin_rule)
         
-        # create histogram
-        histogram_figure = go.Figure()
+        # Calculating ETL
+        ETL = round(cf.etl_daily_returns(sliced_stock_df, tail_percent), 2)
         
-        # colour trace for <= ETL 5%, rounded (so histogram boundary is conitinuous)
-        histogram_figure.add_trace(go.Histogram(
-            x = sliced_stock_df.loc[sliced_stock_df['Daily Returns %'] <= round(ETL_5, 0), 'Daily Returns %'],
-            marker_color= 'limegreen',
-            xbins = dict(size = 1),
-            legendgroup='1',
-            name = f"{ticker} lowest 5%",
-            showlegend=True
-        ))
+        # binning once, then splitting the bins at the ETL, rounded to a bin edge (so histogram boundary is conitinuous)
+        right_edges, counts = cf.histogram_bins(daily_returns, bin_size)
+        if np.isnan(ETL):
+            # no returns in the date range (or too few for an ETL), so no bins are shaded as the tail
+            lowest_bins = np.zeros(len(right_edges), dtype = bool)
+        else:
+            lowest_bins = right_edges <= round(ETL / bin_size) * bin_size
         
-        # colour trace for > ETL 5%, rounded (so histogram boundary is conitinuous)
-        histogram_figure.add_trace(go.Histogram(
-            x = sliced_stock_df.loc[sliced_stock_df['Daily Returns %'] > round(ETL_5, 0), 'Daily Returns %'],
-            marker_color= 'dodgerblue',
-            xbins = dict(size = 1),
-            legendgroup='1',
-            name = f"{ticker} highest 95%",
-            showlegend=True
-        ))
-        
-        
-        # updating histogram titles and labels
-        histogram_figure.update_layout(
-            xaxis_title=f"{ticker} Daily Returns %",
-            yaxis_title="Frequency",
-            template="plotly_white",
-            font=dict( 
-                size=14,
-                color='Navy'
+        histogram_traces = [
+            # colour trace for <= ETL
+            _histogram_bar(
+                right_edges[lowest_bins], 
+                counts[lowest_bins],
+                bin_size,
+                marker = dict(color = 'limegreen'),
+                legendgroup='1',
+                name = f"{ticker} lowest {tail_percent:g}%",
+                showlegend=True
             ),
-            autosize=True, #graph size adjusts with screen
-            margin=dict(l=10, r=10, t=30, b=0) #margins within figure
-            )
-        
-        
-    else:
-        # slicing dataframes for plotting
-        ticker_df = stock_df.loc[stock_df['Ticker'] == ticker, ('Ticker', 'Date', 'Daily Returns %')].set_index('Date')
-        benchmark_df = stock_df.loc[stock_df['Ticker'] == benchmark_ticker, ('Ticker', 'Date', 'Daily Returns %')].set_index('Date')
+            # colour trace for > ETL
+            _histogram_bar(
+                right_edges[~lowest_bins], 
+                counts[~lowest_bins],
+                bin_size,
+                marker = dict(color = 'dodgerblue'),
+                legendgroup='1',
+                name = f"{ticker} highest {100 - tail_percent:g}%",
+                showlegend=True
+            ),
+        ]
         
-        # calculating ETL 5% for ticker & benchmark
-        ETL_5_ticker = round(cf.etl_5_percent_daily_returns(ticker_df), 2)
-        ETL_5_benchmark = round(cf.etl_5_percent_daily_returns(benchmark_df), 2)
+        # rolling ETL distribution
+        if etl_window is not None:
+            _, rolling_etl, rolling_etl_name = _etl_line(data_index, ticker, start_date, end_date, tail_percent, etl_window)
+            histogram_traces.append(_histogram_bar(*cf.histogram_bins(rolling_etl, bin_size), bin_size, name = rolling_etl_name, marker = dict(color = 'navy'), opacity = 0.6))
         
-        # creating a merged dataframe using copies of the individual ticker dataframes. This ensures the same date range (inner merge)
-        merged_df = pd.merge(
-            ticker_df,
-            benchmark_df,     
-            on = 'Date',
-            how = 'inner'
-        )
+        # the x axis title names the ticker
+        return fs.skeleton_figure('returns_histogram', histogram_traces, {'xaxis': {'title': {'text': f"{ticker} Daily Returns %"}}})
+    
+    # aligning the ticker and benchmark rows on the dates they both traded. This ensures the same date range (inner join)
+    ticker_df, benchmark_df = data_index.align(ticker, benchmark_ticker, start_date, end_date)
+    ticker_returns = ticker_df['Daily Returns %'].to_numpy()
+    benchmark_returns = benchmark_df['Daily Returns %'].to_numpy()
+    bin_size = cf.histogram_bin_size(np.concatenate((ticker_returns, benchmark_returns)), bin_rule)
+    
+    # bars grouped side by side within each bin
+    histogram_traces = [
+        _histogram_bar(*cf.histogram_bins(ticker_returns, bin_size), bin_size, grouped = True, name = f'{ticker} Daily Returns Frequency', marker = dict(color = 'dodgerblue')),
+        _histogram_bar(*cf.histogram_bins(benchmark_returns, bin_size), bin_size, grouped = True, name = f'{benchmark_ticker} Daily Returns Frequency', marker = dict(color = 'limegreen')),
+    ]
+    
+    # rolling ETL distributions
+    if etl_window is not None:
+        for etl_ticker, etl_colour in ((ticker, 'navy'), (benchmark_ticker, 'darkgreen')):
+            _, rolling_etl, rolling_etl_name = _etl_line(data_index, etl_ticker, start_date, end_date, tail_percent, etl_window)
+            histogram_traces.append(_histogram_bar(*cf.histogram_bins(rolling_etl, bin_size), bin_size, grouped = True, name = rolling_etl_name, marker = dict(color = etl_colour), opacity = 0.6))
+    
+    return fs.skeleton_figure('returns_histogram_benchmark', histogram_traces)
+
+
+# correlation heatmap graph
+def create_correlation_heatmap(data_index: DatasetIndex, ticker: str, start_date = None, end_date = None, max_tickers: int = MAX_HEATMAP_TICKERS) -> go.Figure:
+    '''
+    correlation of every pair of tickers over the date range, from the cached all-pairs matrices (cs.cross_section).
+    Hovering a cell also shows the covariance, the beta of the row ticker against the column ticker and the shared trading days.
+    
+    universes larger than max_tickers are cut down to the ticker and the tickers most (positively or negatively) correlated with it.
+    '''
+    
+    cross_section = cs.cross_section(data_index, start_date, end_date)
+    shown = np.arange(len(cross_section.tickers))
+    if len(shown) > max_tickers and ticker in data_index:
+        ticker_position = cross_section.tickers.index(ticker)
+        strength = np.nan_to_num(np.abs(cross_section.correlation[ticker_position]), nan = -1.0)
+        strength[ticker_position] = np.inf
+        shown = np.sort(np.argsort(-strength, kind = 'stable')[:max_tickers])
+    elif len(shown) > max_tickers:
+        shown = shown[:max_tickers]
+    
+    shown_tickers = [cross_section.tickers[position] for position in shown]
+    cells = np.ix_(shown, shown)
+    hover_data = np.dstack((cross_section.covariance[cells], cross_section.beta[cells], cross_section.trading_days[cells]))
+    
+    heatmap_figure = go.Figure(go.Heatmap(
+        z = cross_section.correlation[cells],
+        x = shown_tickers,
+        y = shown_tickers,
+        zmin = -1,
+        zmax = 1,
+        colorscale = 'RdBu',
+        reversescale = True,
+        customdata = hover_data,
+        hovertemplate = (
+            "%{y} vs %{x}<br>Correlation: %{z:.4f}<br>Covariance: %{customdata[0]:.4f}"
+            "<br>Beta: %{customdata[1]:.4f}<br>Trading days: %{customdata[2]}<extra></extra>"
+        ),
+        colorbar = dict(title = 'Correlation')
+    ))
+    
+    # first ticker at the top left
+    return _decorate(heatmap_figure, yaxis=dict(autorange='reversed'))
+
+
+# first row of a rolling series that falls in the date range. Rolling series start from the beginning of the history so the first visible windows are full
+def _first_visible(dates: pd.Series, start_date) -> int:
+    if start_date is None:
+        return 0
+    return int(np.searchsorted(dates.to_numpy().view(np.int64), to_nanoseconds(start_date), side = 'left'))
+
+
+# rolling statistics graph
+def create_rolling_statistics_graph(data_index: DatasetIndex, ticker: str, benchmark_ticker: str, start_date = None, end_date = None, window: int = DEFAULT_ROLLING_WINDOW, max_points: int = dsp.DEFAULT_POINT_BUDGET) -> go.Figure:
+    '''
+    how the window statistics drift over time: each point is the statistic of the trailing window (number of trading days) ending that day.
+    the ticker's variance and mean volume, plus, with a benchmark, the benchmark's variance, the covariance, the beta and the correlation
+    (computed over the dates both traded).
+    '''
+    
+    history_df = data_index.get(ticker, None, end_date)
+    first_visible = _first_visible(history_df['Date'], start_date)
+    visible_dates = history_df['Date'].iloc[first_visible:]
+    rolling_variance = cf.rolling_variance_daily_returns(history_df, window)[first_visible:]
+    rolling_volume = cf.rolling_mean_volume(history_df, window)[first_visible:]
+    
+    num_rows = 2 if benchmark_ticker is None else 3
+    rolling_figure = make_subplots(
+                        rows=num_rows, 
+                        cols=1, 
+                        shared_xaxes=True, 
+                        vertical_spacing=0.05
+                    ) #shared x axis & distance between subplots 
+    
+    # first subplot, variances (and the covariance, which shares their units)
+    rolling_figure.add_trace(_line_trace(visible_dates, rolling_variance, max_points, name = f'{ticker} variance'), row=1, col=1)
+    
+    if benchmark_ticker is not None:
+        ticker_df, benchmark_df = data_index.align(ticker, benchmark_ticker, None, end_date)
+        pair_first_visible = _first_visible(ticker_df['Date'], start_date)
+        pair_dates = ticker_df['Date'].iloc[pair_first_visible:]
+        rolling_pair = cf.rolling_pair_statistics(ticker_df, benchmark_df, window)
         
-        # create histogram
-        histogram_figure = go.Figure()
-        histogram_figure.add_trace(go.Histogram(x = merged_df['Daily Returns %_x'], name = f'{ticker} Daily Returns Frequency', marker_color = 'dodgerblue', xbins = dict(size = 1)))
-        histogram_figure.add_trace(go.Histogram(x = merged_df['Daily Returns %_y'], name = f'{benchmark_ticker} Daily Returns Frequency', marker_color = 'limegreen', xbins = dict(size = 1)))
+        rolling_figure.add_trace(_line_trace(pair_dates, rolling_pair.benchmark_variance[pair_first_visible:], max_points, name = f'{benchmark_ticker} variance'), row=1, col=1)
+        rolling_figure.add_trace(_line_trace(pair_dates, rolling_pair.covariance[pair_first_visible:], max_points, name = 'Covariance'), row=1, col=1)
         
-        # updating histogram titles and labels
-        histogram_figure.update_layout(
-            xaxis_title="Daily Returns %",
-            yaxis_title="Frequency",
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="left",
-                x=0
-            ),
-            template="plotly_white",
-            font=dict( 
-                size=14,
-                color='Navy'
-            ),
-            autosize=True, #graph size adjusts with screen
-            margin=dict(l=10, r=10, t=30, b=0) #margins within figure
-            )
-    # update gridlines and automargin scaling
-    histogram_figure.update_xaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
-    histogram_figure.update_yaxes(showgrid=True, gridcolor='Dark Blue', automargin=True)
+        # second subplot, beta and correlation
+        rolling_figure.add_trace(_line_trace(pair_dates, rolling_pair.beta[pair_first_visible:], max_points, name = f'Beta vs {benchmark_ticker}'), row=2, col=1)
+        rolling_figure.add_trace(_line_trace(pair_dates, rolling_pair.correlation[pair_first_visible:], max_points, name = f'Correlation with {benchmark_ticker}'), row=2, col=1)
+        rolling_figure.update_layout(yaxis2_title="Beta / Correlation")
+    
+    # last subplot, mean volume
+    rolling_figure.add_trace(_line_trace(visible_dates, rolling_volume, max_points, name = f'{ticker} mean volume'), row=num_rows, col=1)
     
-    return histogram_figure
+    #naming and decorating
+    return _decorate(rolling_figure, **{f'yaxis{num_rows}_title': "Mean Volume"}, yaxis1_title=f"{window}-day Variance", legend=TOP_LEGEND)
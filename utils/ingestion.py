@@ -0,0 +1,152 @@
+'''
+INGESTION
+
+Incremental updates of the data store. For each ticker only the rows after its last stored date are fetched from a source,
+the derived columns are computed on those new rows only, and the result is published as a new dataset version which a
+running app picks up without a restart (see LiveDataset in utils/data_store.py).
+
+A source is any object with fetch(ticker, start_date, end_date) returning rows in the master data schema (Date, Open, High,
+Low, Close, Adj Close, Volume, Ticker). YFinanceSource downloads from Yahoo Finance, as assets/data/data_download.ipynb does,
+and FileSource serves rows from a local CSV for offline use and testing. Sources may return daily or intraday (minute or
+hourly) bars; an intraday store gets its daily view rebuilt with every version (see utils/data_store.py).
+
+Running from the command line:
+    python -m utils.ingestion assets/data/master_data_store
+    python -m utils.ingestion assets/data/master_data_store --source-csv newer_master_data.csv --tickers ARVL,TSLA
+'''
+import argparse
+from typing import List, Optional
+import pandas as pd
+from utils import data_store as ds
+from utils import summary_table as st
+from utils.dataset_index import DatasetIndex
+
+
+# first date fetched for a ticker with no stored rows (the notebook downloads from the same date)
+DEFAULT_START_DATE = '2020-01-01'
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+
+
+class FileSource():
+    '''
+    Serves rows from a CSV in the master data schema, e.g. a fixture or a newer master data CSV.
+    '''
+
+    def __init__(self, csv_path: str):
+        self.data = pd.read_csv(csv_path, parse_dates = ['Date'])
+
+    def fetch(self, ticker: str, start_date: str, end_date: Optional[str] = None) -> pd.DataFrame:
+        rows = (self.data['Ticker'] == ticker) & (self.data['Date'] >= pd.Timestamp(start_date))
+        if end_date is not None:
+            rows &= self.data['Date'] < pd.Timestamp(end_date)
+        return self.data[rows]
+
+
+class YFinanceSource():
+    '''
+    Downloads bars from Yahoo Finance, daily by default or intraday with e.g. interval = '1m' or '1h'
+    (Yahoo only serves recent intraday history). yfinance is only imported when a download is made.
+    '''
+
+    def __init__(self, interval: str = '1d'):
+        self.interval = interval
+
+    def fetch(self, ticker: str, start_date: str, end_date: Optional[str] = None) -> pd.DataFrame:
+        import yfinance as yf
+
+        ticker_data = yf.download(ticker, start = start_date, end = end_date, interval = self.interval, auto_adjust = False, progress = False)
+        # newer yfinance versions return (field, ticker) columns even for a single ticker
+        if isinstance(ticker_data.columns, pd.MultiIndex):
+            ticker_data.columns = ticker_data.columns.get_level_values(0)
+        ticker_data = ticker_data.rename_axis('Date').reset_index()
+        # intraday bars come timezone aware, the store holds naive exchange local times
+        if getattr(ticker_data['Date'].dt, 'tz', None) is not None:
+            ticker_data['Date'] = ticker_data['Date'].dt.tz_localize(None)
+        ticker_data['Ticker'] = ticker
+        return ticker_data
+
+
+def add_derived_columns(rows: pd.DataFrame) -> pd.DataFrame:
+    # the same calculation as the notebook, vectorized over the appended rows only
+    rows = rows.copy()
+    rows['Daily Returns %'] = (rows['Close'] - rows['Open']) * 100 / rows['Open']
+    return rows
+
+
+def fetch_new_rows(data_index: DatasetIndex, source, tickers: List[str], end_date: Optional[str] = None, default_start_date: str = DEFAULT_START_DATE) -> pd.DataFrame:
+    '''
+    Fetches, for each ticker, the rows dated after its last stored date (or bar). Tickers not in the index are fetched from default_start_date.
+    '''
+    new_rows = []
+    for ticker in tickers:
+        stored_dates = data_index.dates(ticker)
+        if len(stored_dates) > 0:
+            last_date = pd.Timestamp(stored_dates[-1])
+            # fetching from the last stored day, so an intraday store also gets the rest of a partly stored session
+            start_date = last_date.strftime('%Y-%m-%d')
+        else:
+            last_date = None
+            start_date = default_start_date
+
+        ticker_rows = source.fetch(ticker, start_date, end_date)
+        if len(ticker_rows) == 0:
+            continue
+        ticker_rows = ticker_rows.assign(Date = pd.to_datetime(ticker_rows['Date']), Ticker = ticker)
+        # sources may return rows from the start date's session or earlier, which are already stored
+        if last_date is not None:
+            ticker_rows = ticker_rows[ticker_rows['Date'] > last_date]
+        new_rows.append(ticker_rows.dropna(subset = PRICE_COLUMNS))
+
+    if not new_rows:
+        return pd.DataFrame(columns = data_index.data.columns)
+    return pd.concat(new_rows, ignore_index = True)
+
+
+def prepare_version(store_path: str):
+    # builds a new version's derived data before it goes live: the daily view of intraday bars, then the summary table of the daily bars
+    ds.write_daily_view(store_path)
+    st.write_summary_table(ds.daily_view_path(store_path))
+
+
+def ingest(store_root: str, source, tickers: Optional[List[str]] = None, end_date: Optional[str] = None, default_start_date: str = DEFAULT_START_DATE) -> Optional[dict]:
+    '''
+    Appends every ticker's new rows from source to the live version of the store root and publishes the result as a new
+    version. Returns the new version's metadata, or None if there were no new rows (no version is published).
+    '''
+    store_path = ds.current_store_path(store_root)
+    if store_path is None:
+        raise FileNotFoundError(f'No published data store found at {store_root}. Publish one with utils.data_store first.')
+    meta = ds.read_meta(store_path)
+    data_index = DatasetIndex(ds.load_store(store_path))
+
+    tickers = list(data_index.tickers) if tickers is None else tickers
+    new_rows = fetch_new_rows(data_index, source, tickers, end_date = end_date, default_start_date = default_start_date)
+    if len(new_rows) == 0:
+        return None
+    new_rows = add_derived_columns(new_rows)[list(data_index.data.columns)]
+
+    stored_rows = data_index.data.assign(Ticker = data_index.data['Ticker'].astype(str))
+    updated_data = pd.concat([stored_rows, new_rows], ignore_index = True)
+
+    # keeping the CSV source, so the app doesn't treat the appended version as stale and reconvert the CSV over it.
+    # The daily view and summary table are computed before the version goes live, so the app never has to compute them in a request
+    return ds.publish(updated_data, store_root, source = meta.get('source'), prepare = prepare_version)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Append new rows to the data store and publish a new dataset version.')
+    parser.add_argument('store_root')
+    parser.add_argument('--source-csv', help = 'read new rows from a master data schema CSV instead of Yahoo Finance')
+    parser.add_argument('--tickers', help = 'comma separated tickers (defaults to every stored ticker)')
+    parser.add_argument('--end-date', help = 'exclusive end date of the rows fetched')
+    parser.add_argument('--interval', default = '1d', help = "Yahoo Finance bar interval, e.g. '1d', '1h' or '1m' (default '1d')")
+    arguments = parser.parse_args()
+
+    ingestion_source = FileSource(arguments.source_csv) if arguments.source_csv else YFinanceSource(arguments.interval)
+    ingestion_tickers = arguments.tickers.split(',') if arguments.tickers else None
+    new_meta = ingest(arguments.store_root, ingestion_source, tickers = ingestion_tickers, end_date = arguments.end_date)
+    if new_meta is None:
+        print('No new rows, the store is up to date.')
+    else:
+        print(f"Published {new_meta['rows']} rows to {arguments.store_root} (dataset version {new_meta['dataset_version']})")
@@ -0,0 +1,332 @@
+'''
+INSTRUMENTATION
+
+Latency histograms, payload sizes and call counts for the app's Dash callbacks and the graph and calculation functions,
+served in the Prometheus text format at /metrics on the Flask server.
+
+Every time is recorded under a stage, so a slow callback can be broken down:
+    callback               - the whole callback request: the callback function plus encoding its response
+    json_encode            - encoding the callback's response to JSON
+    graph_functions        - building Plotly figures (utils/graph_functions.py, figure cache misses only)
+    calculation_functions  - the calculations in utils/calculation_functions.py
+    figure_encoding        - converting figures to their compact form (utils/figure_encoding.py)
+Callbacks are labelled with the inputs that triggered them (e.g. "date_picker.end_date,date_picker.start_date"), and
+function calls with the callback they ran in, so each callback and input combination has its own histograms.
+
+Setting CALLBACK_PROFILE_DIR starts a sampling profiler which records, every CALLBACK_PROFILE_INTERVAL seconds, the stack
+of each thread running a callback, and writes one folded stack file per callback and process to that directory
+(<callback>.<pid>.folded, readable by flamegraph.pl or speedscope).
+
+Metrics are kept per process, and every series is labelled with the pid of the process that recorded it. Behind a
+multi-worker server each scrape of /metrics reports the worker that answered it, so each worker's counters only ever go
+up and Prometheus aggregates them with e.g. sum without (pid) (rate(stock_app_calls_total[5m])). A forked worker starts
+with an empty registry, so calls made in the master before forking (wsgi.py's warm-up) aren't counted again by every worker.
+'''
+import atexit
+import bisect
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import wraps
+from types import ModuleType
+from typing import Callable, Dict, Optional, Tuple
+import flask
+from dash.exceptions import PreventUpdate
+
+
+METRIC_PREFIX = 'stock_app'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PAYLOAD_BUCKETS = (1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7)
+
+DEFAULT_PROFILE_INTERVAL = 0.005
+PROFILE_DUMP_INTERVAL = 30.0
+
+# the callback running on this thread, which function calls are labelled with
+_current = threading.local()
+
+
+class Histogram():
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry():
+    '''
+    Thread-safe store of the histograms and counters, keyed by their label values.
+    '''
+
+    def __init__(self):
+        self._gauge_sources = []
+        self.reset()
+
+    def reset(self):
+        # clearing every histogram and counter. A new lock too, as a forked child can inherit the lock held
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._payload = {}
+        self._calls = Counter()
+
+    def observe_latency(self, stage: str, name: str, labels: str, seconds: float):
+        key = (stage, name, labels)
+        with self._lock:
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def observe_payload(self, name: str, labels: str, num_bytes: int):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._payload.get(key)
+            if histogram is None:
+                histogram = self._payload[key] = Histogram(PAYLOAD_BUCKETS)
+            histogram.observe(num_bytes)
+
+    def count_call(self, stage: str, name: str, labels: str, outcome: str):
+        with self._lock:
+            self._calls[(stage, name, labels, outcome)] += 1
+
+    def add_gauges(self, gauge_source: Callable[[], Dict[str, float]]):
+        # gauge_source returns {metric name: value}, read at every scrape (e.g. the figure cache's hit counts)
+        self._gauge_sources.append(gauge_source)
+
+    def render(self) -> str:
+        with self._lock:
+            latency = {key: _copy_histogram(histogram) for key, histogram in self._latency.items()}
+            payload = {key: _copy_histogram(histogram) for key, histogram in self._payload.items()}
+            calls = dict(self._calls)
+        pid = os.getpid()
+
+        lines = [
+            f'# HELP {METRIC_PREFIX}_latency_seconds Time spent per stage, callback or function, and triggering inputs or calling callback.',
+            f'# TYPE {METRIC_PREFIX}_latency_seconds histogram',
+        ]
+        for (stage, name, labels), histogram in sorted(latency.items()):
+            lines += _histogram_lines(f'{METRIC_PREFIX}_latency_seconds', {'stage': stage, 'name': name, 'labels': labels, 'pid': pid}, histogram)
+
+        lines += [
+            f'# HELP {METRIC_PREFIX}_payload_bytes Size of the callback responses sent to the browser.',
+            f'# TYPE {METRIC_PREFIX}_payload_bytes histogram',
+        ]
+        for (name, labels), histogram in sorted(payload.items()):
+            lines += _histogram_lines(f'{METRIC_PREFIX}_payload_bytes', {'name': name, 'labels': labels, 'pid': pid}, histogram)
+
+        lines += [
+            f'# HELP {METRIC_PREFIX}_calls_total Calls per stage, callback or function, labels and outcome (ok, prevented or error).',
+            f'# TYPE {METRIC_PREFIX}_calls_total counter',
+        ]
+        for (stage, name, labels, outcome), count in sorted(calls.items()):
+            lines.append(f"{METRIC_PREFIX}_calls_total{_label_text({'stage': stage, 'name': name, 'labels': labels, 'outcome': outcome, 'pid': pid})} {count}")
+
+        for gauge_source in self._gauge_sources:
+            for gauge_name, value in gauge_source().items():
+                lines.append(f'# TYPE {METRIC_PREFIX}_{gauge_name} gauge')
+                lines.append(f"{METRIC_PREFIX}_{gauge_name}{_label_text({'pid': pid})} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _copy_histogram(histogram: Histogram) -> Histogram:
+    copied = Histogram(histogram.buckets)
+    copied.bucket_counts = list(histogram.bucket_counts)
+    copied.count = histogram.count
+    copied.sum = histogram.sum
+    return copied
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(labels: dict) -> str:
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _histogram_lines(metric: str, labels: dict, histogram: Histogram) -> list:
+    # prometheus buckets are cumulative
+    lines = []
+    cumulative_count = 0
+    for upper_bound, bucket_count in zip(histogram.buckets + (float('inf'),), histogram.bucket_counts):
+        cumulative_count += bucket_count
+        bound_text = '+Inf' if upper_bound == float('inf') else f'{upper_bound:g}'
+        lines.append(f"{metric}_bucket{_label_text({**labels, 'le': bound_text})} {cumulative_count}")
+    lines.append(f'{metric}_sum{_label_text(labels)} {histogram.sum}')
+    lines.append(f'{metric}_count{_label_text(labels)} {histogram.count}')
+    return lines
+
+
+metrics = MetricsRegistry()
+
+# a forked worker (gunicorn with preload_app) counts only its own calls, not the ones the master made before forking
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child = metrics.reset)
+
+
+class SamplingProfiler():
+    '''
+    Samples the stack of every thread running an instrumented callback and counts the folded stacks per callback.
+    The sampling thread is started lazily in each process, so forked server workers each run their own.
+    '''
+
+    def __init__(self, dump_dir: str, interval: float = DEFAULT_PROFILE_INTERVAL, dump_interval: float = PROFILE_DUMP_INTERVAL):
+        self.dump_dir = dump_dir
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self._lock = threading.Lock()
+        self._stacks = defaultdict(Counter)
+        self._running_callbacks = {}
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stacks = defaultdict(Counter)
+                threading.Thread(target = self._sample, name = 'callback-profiler', daemon = True).start()
+                atexit.register(self.dump)
+
+    def callback_started(self, callback_name: str):
+        self._ensure_started()
+        self._running_callbacks[threading.get_ident()] = callback_name
+
+    def callback_finished(self):
+        self._running_callbacks.pop(threading.get_ident(), None)
+
+    def _sample(self):
+        last_dump = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for thread_id, callback_name in list(self._running_callbacks.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                with self._lock:
+                    self._stacks[callback_name][';'.join(reversed(stack))] += 1
+            if time.monotonic() - last_dump >= self.dump_interval:
+                self.dump()
+                last_dump = time.monotonic()
+
+    def dump(self):
+        # writing each callback's folded stacks ("frame;frame;frame count" per line) to <dump_dir>/<callback>.<pid>.folded
+        os.makedirs(self.dump_dir, exist_ok = True)
+        with self._lock:
+            stacks = {callback_name: dict(counts) for callback_name, counts in self._stacks.items()}
+        for callback_name, counts in stacks.items():
+            profile_path = os.path.join(self.dump_dir, f'{callback_name}.{os.getpid()}.folded')
+            with open(f'{profile_path}.tmp', 'w') as profile_file:
+                profile_file.writelines(f'{stack} {count}\n' for stack, count in counts.items())
+            os.replace(f'{profile_path}.tmp', profile_path)
+
+
+profiler = SamplingProfiler(os.environ['CALLBACK_PROFILE_DIR'], float(os.environ.get('CALLBACK_PROFILE_INTERVAL', DEFAULT_PROFILE_INTERVAL))) if os.environ.get('CALLBACK_PROFILE_DIR') else None
+
+
+def instrument_function(function: Callable, stage: str) -> Callable:
+    '''
+    Wraps a function so each call's time is recorded under the stage, labelled with the callback it runs in.
+    '''
+    name = function.__name__
+
+    @wraps(function)
+    def instrumented_function(*args, **kwargs):
+        callback_name = getattr(_current, 'callback', '')
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = function(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            metrics.observe_latency(stage, name, callback_name, time.perf_counter() - start)
+            metrics.count_call(stage, name, callback_name, outcome)
+
+    instrumented_function.instrumented = True
+    return instrumented_function
+
+
+def instrument_module(module: ModuleType, stage: Optional[str] = None):
+    '''
+    Replaces the module's public functions with instrumented ones. Callers that look the functions up through the module
+    (gf.create_price_line_graph, cf.mean) are then timed; references taken before this call are not.
+    '''
+    stage = stage or module.__name__.rsplit('.', 1)[-1]
+    for name, member in list(vars(module).items()):
+        if inspect.isfunction(member) and member.__module__ == module.__name__ and not name.startswith('_') and not getattr(member, 'instrumented', False):
+            setattr(module, name, instrument_function(member, stage))
+
+
+def _instrument_callback(callback: Callable) -> Callable:
+    name = callback.__name__
+
+    @wraps(callback)
+    def instrumented_callback(*args, **kwargs):
+        callback_context = kwargs.get('callback_context')
+        triggered_inputs = getattr(callback_context, 'triggered_inputs', None) or []
+        labels = ','.join(sorted(triggered_input['prop_id'] for triggered_input in triggered_inputs))
+
+        _current.callback = name
+        if profiler is not None:
+            profiler.callback_started(name)
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = callback(*args, **kwargs)
+            outcome = 'ok'
+            metrics.observe_payload(name, labels, len(response) if isinstance(response, (str, bytes)) else 0)
+            return response
+        except PreventUpdate:
+            outcome = 'prevented'
+            raise
+        finally:
+            metrics.observe_latency('callback', name, labels, time.perf_counter() - start)
+            metrics.count_call('callback', name, labels, outcome)
+            _current.callback = ''
+            if profiler is not None:
+                profiler.callback_finished()
+
+    instrumented_callback.instrumented = True
+    return instrumented_callback
+
+
+def _instrument_json_encoding():
+    # Dash encodes callback responses with dash._callback.to_json. Only wrapped where that module-level function exists
+    import dash._callback as dash_callback
+
+    to_json = getattr(dash_callback, 'to_json', None)
+    if to_json is None or getattr(to_json, 'instrumented', False):
+        return
+    dash_callback.to_json = instrument_function(to_json, 'json_encode')
+
+
+def instrument_app(app, path: str = '/metrics'):
+    '''
+    Instruments every callback registered on the Dash app so far and serves the metrics at path on its Flask server.
+    Call once, after the callbacks are defined.
+    '''
+    for callback_spec in app.callback_map.values():
+        # clientside callbacks have no server function
+        if callback_spec.get('callback') is not None and not getattr(callback_spec['callback'], 'instrumented', False):
+            callback_spec['callback'] = _instrument_callback(callback_spec['callback'])
+    _instrument_json_encoding()
+
+    if path not in {rule.rule for rule in app.server.url_map.iter_rules()}:
+        app.server.add_url_rule(path, 'metrics', lambda: flask.Response(metrics.render(), mimetype = 'text/plain; version=0.0.4'))
@@ -0,0 +1,218 @@
+'''
+MOMENT ENGINE
+
+Prefix sums (cumulative moments) of a ticker's daily returns and volume, and of a ticker/benchmark pair's aligned daily returns.
+Any [start, end] window statistic - mean, variance, covariance, correlation, beta and the up/down day counts - is then a
+difference of two prefix sums found by binary search, so it costs the same however long the underlying series is.
+
+Values are shifted by their full-history mean before summing and the prefix sums use compensated (block + Neumaier) summation,
+so window results agree with cf.mean, cf.variance and np.cov to within floating point tolerance.
+'''
+import math
+from typing import Tuple
+import numpy as np
+from utils.dataset_index import DatasetIndex, index_cache, to_nanoseconds
+
+
+# size of the blocks summed with np.cumsum before the block totals are carried over with compensation
+COMPENSATION_BLOCK_SIZE = 256
+
+# number of ticker and pair engines kept per process
+MOMENT_CACHE_SIZE = 512
+
+
+def compensated_cumsum(values: np.ndarray, block_size: int = COMPENSATION_BLOCK_SIZE) -> np.ndarray:
+    '''
+    Returns the prefix sums of values with a leading 0 (length n + 1), so sum(values[i:j]) = prefix[j] - prefix[i].
+    Each block is summed exactly with math.fsum and the running total across blocks is carried with Neumaier compensation,
+    which keeps the error of long prefixes close to that of a single block rather than growing with the series length.
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    prefix = np.zeros(len(values) + 1)
+    if len(values) == 0:
+        return prefix
+
+    num_blocks = -(len(values) // -block_size)
+    padded = np.zeros(num_blocks * block_size)
+    padded[:len(values)] = values
+    blocks = padded.reshape(num_blocks, block_size)
+
+    # running total before each block, carried with Neumaier compensation
+    block_offsets = np.empty(num_blocks)
+    total = 0.0
+    compensation = 0.0
+    for block_number, block in enumerate(blocks):
+        block_offsets[block_number] = total + compensation
+        block_sum = math.fsum(block)
+        new_total = total + block_sum
+        if abs(total) >= abs(block_sum):
+            compensation += (total - new_total) + block_sum
+        else:
+            compensation += (block_sum - new_total) + total
+        total = new_total
+
+    prefix[1:] = (np.cumsum(blocks, axis = 1) + block_offsets[:, None]).ravel()[:len(values)]
+    return prefix
+
+
+class _PrefixWindow():
+    '''
+    Shared date window lookup: rows of [start_date, end_date] (inclusive) are [first, last) of the sorted dates.
+    '''
+
+    def __init__(self, dates: np.ndarray):
+        self.dates = np.asarray(dates, dtype = np.int64)
+
+    def window(self, start_date = None, end_date = None) -> Tuple[int, int]:
+        first = 0 if start_date is None else int(np.searchsorted(self.dates, to_nanoseconds(start_date), side = 'left'))
+        last = len(self.dates) if end_date is None else int(np.searchsorted(self.dates, to_nanoseconds(end_date, end_of_range = True), side = 'right'))
+        return first, max(first, last)
+
+
+class TickerMoments(_PrefixWindow):
+    '''
+    Window mean and variance of a ticker's daily returns, and window mean of its volume.
+    '''
+
+    def __init__(self, dates: np.ndarray, daily_returns: np.ndarray, volume: np.ndarray):
+        super().__init__(dates)
+        daily_returns = np.asarray(daily_returns, dtype = np.float64)
+        volume = np.asarray(volume, dtype = np.float64)
+
+        # shifting by the full-history mean keeps the squared sums small and avoids cancellation in the variance
+        self._returns_shift = daily_returns.mean() if len(daily_returns) else 0.0
+        self._volume_shift = volume.mean() if len(volume) else 0.0
+        shifted_returns = daily_returns - self._returns_shift
+
+        self._sum_returns = compensated_cumsum(shifted_returns)
+        self._sum_returns_squared = compensated_cumsum(shifted_returns * shifted_returns)
+        self._sum_volume = compensated_cumsum(volume - self._volume_shift)
+
+    def count(self, start_date = None, end_date = None) -> int:
+        first, last = self.window(start_date, end_date)
+        return last - first
+
+    def mean_daily_return(self, start_date = None, end_date = None) -> float:
+        first, last = self.window(start_date, end_date)
+        if last == first:
+            return np.nan
+        return self._returns_shift + (self._sum_returns[last] - self._sum_returns[first]) / (last - first)
+
+    def variance_daily_return(self, start_date = None, end_date = None, ddof: int = 0) -> float:
+        # ddof = 0 by default to match cf.variance
+        first, last = self.window(start_date, end_date)
+        count = last - first
+        if count - ddof <= 0:
+            return np.nan
+        window_sum = self._sum_returns[last] - self._sum_returns[first]
+        window_sum_squared = self._sum_returns_squared[last] - self._sum_returns_squared[first]
+        return max(window_sum_squared - window_sum * window_sum / count, 0.0) / (count - ddof)
+
+    def mean_volume(self, start_date = None, end_date = None) -> float:
+        first, last = self.window(start_date, end_date)
+        if last == first:
+            return np.nan
+        return self._volume_shift + (self._sum_volume[last] - self._sum_volume[first]) / (last - first)
+
+
+class PairMoments(_PrefixWindow):
+    '''
+    Window covariance, correlation and beta of a ticker's daily returns (x) against a benchmark's (y),
+    over the dates both traded on, plus the up/down day counts of cf.pair_statistics.
+    '''
+
+    def __init__(self, dates: np.ndarray, ticker_returns: np.ndarray, benchmark_returns: np.ndarray):
+        super().__init__(dates)
+        x = np.asarray(ticker_returns, dtype = np.float64)
+        y = np.asarray(benchmark_returns, dtype = np.float64)
+
+        x_shifted = x - (x.mean() if len(x) else 0.0)
+        y_shifted = y - (y.mean() if len(y) else 0.0)
+        self._sum_x = compensated_cumsum(x_shifted)
+        self._sum_y = compensated_cumsum(y_shifted)
+        self._sum_xx = compensated_cumsum(x_shifted * x_shifted)
+        self._sum_yy = compensated_cumsum(y_shifted * y_shifted)
+        self._sum_xy = compensated_cumsum(x_shifted * y_shifted)
+
+        # integer prefix counts are exact, so the quadrant counts need no compensation
+        ticker_high = x > 0
+        benchmark_high = y > 0
+        self._count_both_high = np.concatenate(([0], np.cumsum(ticker_high & benchmark_high)))
+        self._count_both_low = np.concatenate(([0], np.cumsum(~ticker_high & ~benchmark_high)))
+        self._count_ticker_high_benchmark_low = np.concatenate(([0], np.cumsum(ticker_high & ~benchmark_high)))
+
+    def _centred_sums(self, first: int, last: int) -> Tuple[float, float, float]:
+        # window sums of squared and cross deviations from the window means
+        count = last - first
+        sum_x = self._sum_x[last] - self._sum_x[first]
+        sum_y = self._sum_y[last] - self._sum_y[first]
+        sum_xx = max((self._sum_xx[last] - self._sum_xx[first]) - sum_x * sum_x / count, 0.0)
+        sum_yy = max((self._sum_yy[last] - self._sum_yy[first]) - sum_y * sum_y / count, 0.0)
+        sum_xy = (self._sum_xy[last] - self._sum_xy[first]) - sum_x * sum_y / count
+        return sum_xx, sum_yy, sum_xy
+
+    def trading_days(self, start_date = None, end_date = None) -> int:
+        first, last = self.window(start_date, end_date)
+        return last - first
+
+    def covariance(self, start_date = None, end_date = None) -> float:
+        # sample covariance (ddof = 1), matching np.cov
+        first, last = self.window(start_date, end_date)
+        if last - first < 2:
+            return np.nan
+        return self._centred_sums(first, last)[2] / (last - first - 1)
+
+    def benchmark_variance(self, start_date = None, end_date = None) -> float:
+        first, last = self.window(start_date, end_date)
+        if last - first < 2:
+            return np.nan
+        return self._centred_sums(first, last)[1] / (last - first - 1)
+
+    def correlation(self, start_date = None, end_date = None) -> float:
+        first, last = self.window(start_date, end_date)
+        if last - first < 2:
+            return np.nan
+        sum_xx, sum_yy, sum_xy = self._centred_sums(first, last)
+        if sum_xx <= 0 or sum_yy <= 0:
+            return np.nan
+        return sum_xy / math.sqrt(sum_xx * sum_yy)
+
+    def beta(self, start_date = None, end_date = None) -> float:
+        first, last = self.window(start_date, end_date)
+        if last - first < 2:
+            return np.nan
+        _, sum_yy, sum_xy = self._centred_sums(first, last)
+        if sum_yy <= 0:
+            return np.nan
+        return sum_xy / sum_yy
+
+    def quadrant_counts(self, start_date = None, end_date = None) -> Tuple[int, int, int, int]:
+        '''
+        Returns the (both high, both low or even, ticker high benchmark low, ticker low benchmark high) day counts.
+        '''
+        first, last = self.window(start_date, end_date)
+        both_high = int(self._count_both_high[last] - self._count_both_high[first])
+        both_low = int(self._count_both_low[last] - self._count_both_low[first])
+        ticker_high_benchmark_low = int(self._count_ticker_high_benchmark_low[last] - self._count_ticker_high_benchmark_low[first])
+        return both_high, both_low, ticker_high_benchmark_low, (last - first) - both_high - both_low - ticker_high_benchmark_low
+
+
+# engines are built from a ticker's (or pair's) full history on first use and cached per dataset index
+@index_cache(maxsize = MOMENT_CACHE_SIZE)
+def ticker_moments(data_index: DatasetIndex, ticker: str) -> TickerMoments:
+    ticker_df = data_index.get(ticker)
+    return TickerMoments(
+        data_index.dates(ticker),
+        ticker_df['Daily Returns %'].to_numpy(),
+        ticker_df['Volume'].to_numpy()
+    )
+
+
+@index_cache(maxsize = MOMENT_CACHE_SIZE)
+def pair_moments(data_index: DatasetIndex, ticker: str, benchmark_ticker: str) -> PairMoments:
+    ticker_df, benchmark_df = data_index.align(ticker, benchmark_ticker)
+    return PairMoments(
+        ticker_df['Date'].to_numpy().view(np.int64),
+        ticker_df['Daily Returns %'].to_numpy(),
+        benchmark_df['Daily Returns %'].to_numpy()
+    )
@@ -0,0 +1,223 @@
+'''
+PORTFOLIO
+
+A weighted portfolio of tickers, shown in the app as a pseudo-ticker so every graph, the data table and the benchmark
+dropdown work on it as they do on a single ticker.
+
+The constituents' daily returns, prices and volumes are pivoted once into date-aligned dates x tickers matrices
+(cs.column_matrices), and each day's portfolio return is the product of that day's row of constituent returns with the
+day's weights, so the whole history costs a few array operations instead of one merge per constituent:
+    - weights are set to the target weights on the first trading day of each rebalancing period (every day, week, month,
+      quarter or year) or only on the first day (buy and hold), and in between drift with each constituent's Adj Close
+    - a constituent is held at its last price (a 0% return) on dates it has no row, e.g. before it listed
+    - Daily Returns % is the weighted sum of the constituents' Daily Returns % (Close against Open, as for a ticker)
+    - Close and Adj Close are the portfolio's value, starting at 100. Open is the Close less the day's return, and High
+      and Low are the weighted constituents' highs and lows relative to their closes. Volume is the constituents' total
+
+with_portfolio() returns the daily index extended with the portfolio's pseudo-ticker. Only the portfolio's rows are
+built, the index's own rows are looked up in place. constant_weight_moments() gives the mean and variance (w'Σw, from the
+covariance matrix) of holding the target weights every day.
+'''
+import hashlib
+import math
+import re
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+import pandas as pd
+from utils import cross_section as cs
+from utils.dataset_index import DatasetIndex, index_cache
+
+
+# rebalancing frequencies, None being buy and hold
+REBALANCE_LABELS = {'D': 'Daily', 'W': 'Weekly', 'M': 'Monthly', 'Q': 'Quarterly', 'Y': 'Yearly'}
+
+PORTFOLIO_TICKER_PREFIX = 'PORTFOLIO'
+
+STARTING_VALUE = 100.0
+
+# portfolio indexes kept, each holding its portfolio's daily rows
+PORTFOLIO_CACHE_SIZE = 4
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+
+NANOSECONDS_PER_DAY = 24 * 60 * 60 * 10**9
+
+
+class Portfolio(NamedTuple):
+    tickers: Tuple[str, ...]
+    weights: Tuple[float, ...]      # normalised to sum to 1
+    rebalance: Optional[str] = None
+
+    @property
+    def ticker(self) -> str:
+        # the pseudo-ticker's name is unique to the holdings and rebalancing, so cached figures and values of one
+        # portfolio are never served for another
+        definition = repr((self.tickers, self.weights, self.rebalance)).encode()
+        return f'{PORTFOLIO_TICKER_PREFIX}-{hashlib.sha1(definition).hexdigest()[:6]}'
+
+    def to_dict(self) -> dict:
+        # JSON form for a dcc.Store
+        return {'tickers': list(self.tickers), 'weights': list(self.weights), 'rebalance': self.rebalance}
+
+
+def from_dict(portfolio_data: Optional[dict]) -> Optional[Portfolio]:
+    if not portfolio_data:
+        return None
+    return Portfolio(tuple(portfolio_data['tickers']), tuple(portfolio_data['weights']), portfolio_data.get('rebalance'))
+
+
+def parse_portfolio(definition: str, data_index: DatasetIndex, rebalance: Optional[str] = None) -> Portfolio:
+    '''
+    Parses holdings written as 'AAPL:0.5, MSFT:0.3, SPY:0.2' (weights are normalised to sum to 1) or 'AAPL, MSFT, SPY'
+    (equal weights). Raises ValueError for unknown tickers, repeated tickers or weights that aren't positive finite numbers.
+    '''
+    if rebalance is not None and rebalance not in REBALANCE_LABELS:
+        raise ValueError(f"Unknown rebalancing frequency '{rebalance}'.")
+    holdings = [holding.strip() for holding in re.split(r'[,\n;]', definition or '') if holding.strip()]
+    if not holdings:
+        raise ValueError('A portfolio needs at least one ticker.')
+
+    tickers, weights = [], []
+    for holding in holdings:
+        ticker, _, weight = holding.partition(':')
+        tickers.append(ticker.strip().upper())
+        try:
+            weights.append(float(weight) if weight.strip() else None)
+        except ValueError:
+            raise ValueError(f"'{weight.strip()}' isn't a number (holding '{holding}').")
+
+    unknown_tickers = [ticker for ticker in tickers if ticker not in data_index]
+    if unknown_tickers:
+        raise ValueError(f"Tickers not in the dataset: {', '.join(unknown_tickers)}")
+    if len(set(tickers)) != len(tickers):
+        raise ValueError('Each ticker can only be held once.')
+    if all(weight is None for weight in weights):
+        weights = [1.0] * len(tickers)
+    elif any(weight is None or not math.isfinite(weight) or not weight > 0 for weight in weights):
+        raise ValueError('Give every ticker a positive weight, or none for equal weights.')
+
+    total_weight = sum(weights)
+    if not math.isfinite(total_weight):
+        raise ValueError('The weights are too large to add up. Give them as fractions or percentages.')
+    return Portfolio(tuple(tickers), tuple(weight / total_weight for weight in weights), rebalance)
+
+
+def _period_starts(dates: np.ndarray, rebalance: Optional[str]) -> np.ndarray:
+    # position of the first date of each date's rebalancing period
+    if rebalance is None:
+        return np.zeros(len(dates), dtype = np.int64)
+    days = dates // NANOSECONDS_PER_DAY
+    if rebalance == 'D':
+        periods = days
+    elif rebalance == 'W':
+        # weeks starting on Monday (the epoch was a Thursday)
+        periods = (days + 3) // 7
+    else:
+        months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        periods = {'M': months, 'Q': months // 3, 'Y': months // 12}[rebalance]
+    new_period = np.concatenate(([True], np.diff(periods) != 0))
+    return np.maximum.accumulate(np.where(new_period, np.arange(len(dates)), 0))
+
+
+def daily_weights(price_relatives: np.ndarray, target_weights: np.ndarray, period_starts: np.ndarray) -> np.ndarray:
+    '''
+    Returns the dates x tickers weights held at the start of each day: the target weights on the first day of each period,
+    drifted by the constituents' growth since then (the product of their price relatives up to the previous day).
+    '''
+    growth = np.cumprod(price_relatives, axis = 0)
+    growth_before = np.vstack((np.ones((1, growth.shape[1])), growth[:-1]))
+    # growth since the period's first day = growth before today / growth before the period's first day
+    drifted = target_weights * growth_before / growth_before[period_starts]
+    return drifted / drifted.sum(axis = 1, keepdims = True)
+
+
+def portfolio_rows(data_index: DatasetIndex, portfolio: Portfolio) -> pd.DataFrame:
+    '''
+    The portfolio's full history of daily rows in the master data schema, dated on every date a constituent traded.
+    '''
+    dates, matrices = cs.column_matrices(data_index, PRICE_COLUMNS + ['Volume', 'Daily Returns %'], tickers = list(portfolio.tickers))
+    target_weights = np.asarray(portfolio.weights, dtype = np.float64)
+
+    # day on day Adj Close growth, 1 on dates a constituent has no row (held at its last price) and on its first row
+    adjusted_close = pd.DataFrame(matrices['Adj Close']).ffill().to_numpy()
+    price_relatives = np.ones_like(adjusted_close)
+    price_relatives[1:] = adjusted_close[1:] / adjusted_close[:-1]
+    price_relatives[~np.isfinite(price_relatives)] = 1.0
+    weights = daily_weights(price_relatives, target_weights, _period_starts(dates, portfolio.rebalance))
+
+    # the date-aligned products of the weights with the constituents' returns and growth
+    daily_returns = np.einsum('ij,ij->i', weights, np.nan_to_num(matrices['Daily Returns %']))
+    value = STARTING_VALUE * np.cumprod(np.einsum('ij,ij->i', weights, price_relatives))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        high_relatives = np.nan_to_num(matrices['High'] / matrices['Close'], nan = 1.0)
+        low_relatives = np.nan_to_num(matrices['Low'] / matrices['Close'], nan = 1.0)
+    open_value = value / (1 + daily_returns / 100)
+
+    return pd.DataFrame({
+        'Date': dates.view('datetime64[ns]'),
+        'Open': open_value,
+        'High': np.maximum(value * np.einsum('ij,ij->i', weights, high_relatives), np.maximum(open_value, value)),
+        'Low': np.minimum(value * np.einsum('ij,ij->i', weights, low_relatives), np.minimum(open_value, value)),
+        'Close': value,
+        'Adj Close': value,
+        'Volume': np.nansum(matrices['Volume'], axis = 1).astype(np.int64),
+        'Ticker': portfolio.ticker,
+        'Daily Returns %': daily_returns,
+    })
+
+
+class PortfolioIndex(DatasetIndex):
+    '''
+    A DatasetIndex of base_index's tickers followed by the portfolio's pseudo-ticker. It indexes only the portfolio's
+    rows, and every other ticker's lookups go to base_index, so the base rows (memory-mapped and shared between workers)
+    are never copied. It keeps the base dataset version, since the pseudo-ticker's name already identifies the portfolio.
+    '''
+
+    def __init__(self, base_index: DatasetIndex, portfolio: Portfolio):
+        rows = portfolio_rows(base_index, portfolio)[list(base_index.data.columns)]
+        rows.attrs = {'dataset_version': base_index.dataset_version, 'sorted_by_ticker_and_date': True}
+        super().__init__(rows)
+        self.base_index = base_index
+        self.portfolio = portfolio
+        self.tickers = list(base_index.tickers) + [portfolio.ticker]
+        self.min_date = min((date for date in (base_index.min_date, self.min_date) if date is not None), default = None)
+        self.max_date = max((date for date in (base_index.max_date, self.max_date) if date is not None), default = None)
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker == self.portfolio.ticker or ticker in self.base_index
+
+    # row positions of the pseudo-ticker are into the portfolio's rows, any other ticker's into the base rows
+    def bounds(self, ticker: str, start_date = None, end_date = None) -> Tuple[int, int]:
+        if ticker == self.portfolio.ticker:
+            return super().bounds(ticker, start_date, end_date)
+        return self.base_index.bounds(ticker, start_date, end_date)
+
+    def get(self, ticker: str, start_date = None, end_date = None) -> pd.DataFrame:
+        if ticker == self.portfolio.ticker:
+            return super().get(ticker, start_date, end_date)
+        return self.base_index.get(ticker, start_date, end_date)
+
+    def dates(self, ticker: str, start_date = None, end_date = None) -> np.ndarray:
+        if ticker == self.portfolio.ticker:
+            return super().dates(ticker, start_date, end_date)
+        return self.base_index.dates(ticker, start_date, end_date)
+
+
+@index_cache(maxsize = PORTFOLIO_CACHE_SIZE)
+def with_portfolio(data_index: DatasetIndex, portfolio: Portfolio) -> PortfolioIndex:
+    if portfolio.ticker in data_index:
+        raise ValueError(f'{portfolio.ticker} is already a ticker in the dataset.')
+    return PortfolioIndex(data_index, portfolio)
+
+
+def constant_weight_moments(data_index: DatasetIndex, portfolio: Portfolio, start_date = None, end_date = None) -> dict:
+    '''
+    Mean daily return (w'μ) and variance (w'Σw) of holding the target weights every day over the date range, from the
+    constituents' mean returns and pairwise covariance matrix (cs.pairwise_moments).
+    '''
+    _, matrix = cs.returns_matrix(data_index, start_date, end_date, list(portfolio.tickers))
+    weights = np.asarray(portfolio.weights, dtype = np.float64)
+    with np.errstate(invalid = 'ignore'):
+        mean_returns = np.nanmean(matrix, axis = 0) if len(matrix) else np.full(len(weights), np.nan)
+    covariance = cs.pairwise_moments(matrix).covariance
+    return {'mean_daily_return': float(weights @ mean_returns), 'var_daily_return': float(weights @ covariance @ weights)}
@@ -0,0 +1,108 @@
+'''
+REQUEST COALESCING
+
+Drops callback requests that a newer request from the same browser session has superseded. Dragging over a graph
+changes the date range many times a second, and each change fans out to every data callback. Without coalescing the
+server computes every intermediate range in turn, so latency grows with how fast the user drags.
+
+Each request takes the next generation number for its (session, callback) channel. If no other request on the channel
+is in flight it starts straight away, so single clicks aren't delayed. Otherwise (e.g. mid-drag) it waits out the
+debounce window, and then only goes on to slice data and build figures if no newer request has taken a generation in
+the meantime. Superseded requests raise PreventUpdate, so the browser keeps its figure until the latest request answers.
+
+Sessions are identified by a cookie set on the first response, and requests without one are never coalesced (behind a
+reverse proxy different users can share an address). Generations are kept per process, so requests from one session
+are only coalesced within the worker process that receives them.
+'''
+import secrets
+import threading
+import time
+from collections import OrderedDict
+import flask
+from dash.exceptions import PreventUpdate
+
+
+SESSION_COOKIE_NAME = 'stock_app_session'
+
+# seconds a request waits for a newer one before starting work, when an earlier request on its channel is still in flight
+DEFAULT_DEBOUNCE_SECONDS = 0.05
+
+# flask.g key of the channel a request is in flight on
+IN_FLIGHT_CHANNEL = 'coalescing_channel'
+
+# (session, callback) channels remembered. The least recently used are forgotten first
+MAX_CHANNELS = 10000
+
+
+class RequestCoalescer():
+
+    def __init__(self, debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS, max_channels: int = MAX_CHANNELS):
+        self.debounce_seconds = debounce_seconds
+        self.max_channels = max_channels
+        self.superseded = 0
+        self._generations = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, server: flask.Flask):
+        # giving each browser a session id, which the callback requests it makes then carry
+        @server.after_request
+        def set_session_cookie(response):
+            if SESSION_COOKIE_NAME not in flask.request.cookies:
+                response.set_cookie(SESSION_COOKIE_NAME, secrets.token_hex(16), httponly = True, samesite = 'Lax')
+            return response
+
+        # a request is in flight on its channel until it has been answered (or dropped)
+        @server.teardown_request
+        def release_channel(exception):
+            channel = flask.g.pop(IN_FLIGHT_CHANNEL, None)
+            if channel is not None:
+                with self._lock:
+                    remaining = self._in_flight.pop(channel, 1) - 1
+                    if remaining > 0:
+                        self._in_flight[channel] = remaining
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'channels': len(self._generations), 'in_flight': sum(self._in_flight.values()), 'superseded': self.superseded}
+
+    def _start_request(self, channel: tuple) -> tuple:
+        # takes the channel's next generation and marks the request in flight. Returns the generation and whether an
+        # earlier request on the channel is still in flight
+        with self._lock:
+            generation = self._generations.pop(channel, 0) + 1
+            self._generations[channel] = generation
+            if len(self._generations) > self.max_channels:
+                self._generations.popitem(last = False)
+            in_flight = self._in_flight.get(channel, 0)
+            self._in_flight[channel] = in_flight + 1
+            return generation, in_flight > 0
+
+    def is_latest(self, callback_name: str) -> bool:
+        '''
+        Registers the current request on its (session, callback) channel and returns whether it is still the channel's
+        latest request, after waiting out the debounce window if an earlier request on the channel is in flight.
+        Always True outside a request (e.g. callbacks called directly) and for requests without a session cookie.
+        '''
+        if not flask.has_request_context():
+            return True
+        session_id = flask.request.cookies.get(SESSION_COOKIE_NAME)
+        if session_id is None:
+            return True
+        channel = (session_id, callback_name)
+        generation, channel_busy = self._start_request(channel)
+        setattr(flask.g, IN_FLIGHT_CHANNEL, channel)
+
+        if channel_busy and self.debounce_seconds > 0:
+            time.sleep(self.debounce_seconds)
+        with self._lock:
+            latest = self._generations.get(channel, generation) == generation
+            if not latest:
+                self.superseded += 1
+        return latest
+
+    def raise_if_superseded(self, callback_name: str):
+        # called by a callback once it knows it has work to do, before it slices any data
+        if not self.is_latest(callback_name):
+            raise PreventUpdate
+
@@ -0,0 +1,186 @@
+'''
+OHLCV RESAMPLING
+
+Vectorized resampling of OHLCV bars to coarser intervals (first open, max high, min low, last close, summed volume) and a
+per-ticker aggregation pyramid (minute -> hourly -> daily -> weekly -> monthly, from whatever the finest stored interval is).
+The candlestick graph picks the finest pyramid level that fits the selected date span into a few thousand candles.
+
+When the store holds intraday bars, resample_dataset() builds the daily view of the whole dataset (one group reduction over
+every ticker at once), and the daily metrics are calculated from that view rather than from the intraday rows.
+'''
+from collections import OrderedDict
+from typing import Optional, Tuple
+import numpy as np
+import pandas as pd
+from utils.dataset_index import DatasetIndex, index_cache, to_nanoseconds
+
+
+# the candlestick never renders more candles than this
+MAX_CANDLES = 3000
+
+# pyramid levels, finest first, and the level each one is aggregated from (weeks straddle months, so months come from days)
+PYRAMID_LEVELS = OrderedDict([
+    ('1min', None),
+    ('1h', '1min'),
+    ('1D', '1h'),
+    ('1W', '1D'),
+    ('1M', '1D'),
+])
+
+INTERVAL_LABELS = {'1min': 'Minute', '1h': 'Hourly', '1D': 'Daily', '1W': 'Weekly', '1M': 'Monthly'}
+
+NANOSECONDS_PER_MINUTE = 60 * 10**9
+NANOSECONDS_PER_HOUR = 60 * NANOSECONDS_PER_MINUTE
+NANOSECONDS_PER_DAY = 24 * NANOSECONDS_PER_HOUR
+
+
+def interval_labels(dates: np.ndarray, interval: str) -> np.ndarray:
+    '''
+    Returns, for each int64 nanosecond date, the int64 label of the interval it falls in. Rows with equal labels form one bar.
+    '''
+    dates = np.asarray(dates, dtype = np.int64)
+    if interval == '1min':
+        return dates // NANOSECONDS_PER_MINUTE
+    if interval == '1h':
+        return dates // NANOSECONDS_PER_HOUR
+    if interval == '1D':
+        return dates // NANOSECONDS_PER_DAY
+    if interval == '1W':
+        # weeks start on Monday. 1970-01-01 was a Thursday, so day + 3 counts from a Monday
+        days = dates // NANOSECONDS_PER_DAY
+        return days - (days + 3) % 7
+    if interval == '1M':
+        return dates.view('datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError(f'Interval {interval} is not supported. Choose from {list(PYRAMID_LEVELS)}.')
+
+
+def interval_starts(labels: np.ndarray, interval: str) -> np.ndarray:
+    # int64 nanosecond start of each interval label from interval_labels()
+    if interval == '1min':
+        return labels * NANOSECONDS_PER_MINUTE
+    if interval == '1h':
+        return labels * NANOSECONDS_PER_HOUR
+    if interval in ('1D', '1W'):
+        return labels * NANOSECONDS_PER_DAY
+    if interval == '1M':
+        return labels.astype('datetime64[M]').astype('datetime64[ns]').astype(np.int64)
+    raise ValueError(f'Interval {interval} is not supported. Choose from {list(PYRAMID_LEVELS)}.')
+
+
+def resample_ohlcv(bars: dict, interval: str) -> dict:
+    '''
+    Resamples a dict of date-sorted OHLCV arrays ('Date' as int64 nanoseconds, 'Open', 'High', 'Low', 'Close', 'Volume')
+    to interval. Each output bar is dated by its first input bar. Uses reduceat over the bar boundaries, with no Python loop.
+    '''
+    labels = interval_labels(bars['Date'], interval)
+    if len(labels) == 0:
+        return {column: values[:0] for column, values in bars.items()}
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(labels)) + 1))
+    ends = np.concatenate((starts[1:], [len(labels)])) - 1
+    return {
+        'Date': bars['Date'][starts],
+        'Open': bars['Open'][starts],
+        'High': np.maximum.reduceat(bars['High'], starts),
+        'Low': np.minimum.reduceat(bars['Low'], starts),
+        'Close': bars['Close'][ends],
+        'Volume': np.add.reduceat(bars['Volume'].astype(np.int64), starts)
+    }
+
+
+def base_interval(dates: np.ndarray, ticker_codes: Optional[np.ndarray] = None) -> str:
+    '''
+    The finest pyramid level the stored bars support, from the typical spacing between consecutive bars.
+    With ticker_codes (rows grouped by ticker) the gaps between one ticker's last bar and the next ticker's first are ignored.
+    '''
+    spacing = np.diff(np.asarray(dates, dtype = np.int64))
+    if ticker_codes is not None:
+        spacing = spacing[np.diff(ticker_codes) == 0]
+    if len(spacing) == 0:
+        return '1D'
+    typical_spacing = np.median(spacing)
+    if typical_spacing < NANOSECONDS_PER_HOUR:
+        return '1min'
+    if typical_spacing < NANOSECONDS_PER_DAY:
+        return '1h'
+    return '1D'
+
+
+def resample_dataset(data: pd.DataFrame, interval: str) -> pd.DataFrame:
+    '''
+    Resamples every ticker's bars in a master data schema frame, sorted by (Ticker, Date) with a categorical Ticker, to interval.
+    Bars are dated by the start of their interval, Adj Close and any other columns take the last bar's value,
+    and Daily Returns % is recalculated from the resampled open and close.
+    '''
+    dates = data['Date'].to_numpy().view(np.int64)
+    ticker_codes = data['Ticker'].cat.codes.to_numpy()
+    labels = interval_labels(dates, interval)
+    if len(labels) == 0:
+        return data.iloc[:0]
+
+    # a new bar starts wherever the ticker or the interval changes, so one reduceat covers every ticker
+    new_bar = (np.diff(labels) != 0) | (np.diff(ticker_codes) != 0)
+    starts = np.concatenate(([0], np.flatnonzero(new_bar) + 1))
+    ends = np.concatenate((starts[1:], [len(labels)])) - 1
+
+    columns = {}
+    for column in data.columns:
+        if column == 'Date':
+            columns[column] = interval_starts(labels[starts], interval).view('datetime64[ns]')
+        elif column == 'Ticker':
+            columns[column] = pd.Categorical.from_codes(ticker_codes[starts], categories = data['Ticker'].cat.categories)
+        elif column == 'Open':
+            columns[column] = data[column].to_numpy()[starts]
+        elif column == 'High':
+            columns[column] = np.maximum.reduceat(data[column].to_numpy(), starts)
+        elif column == 'Low':
+            columns[column] = np.minimum.reduceat(data[column].to_numpy(), starts)
+        elif column == 'Volume':
+            columns[column] = np.add.reduceat(data[column].to_numpy().astype(np.int64), starts)
+        else:
+            columns[column] = data[column].to_numpy()[ends]
+
+    resampled = pd.DataFrame(columns)
+    if 'Daily Returns %' in resampled.columns:
+        resampled['Daily Returns %'] = (resampled['Close'].astype(np.float64) - resampled['Open']) * 100 / resampled['Open']
+    return resampled
+
+
+class OHLCVPyramid():
+
+    def __init__(self, bars: dict):
+        self.base_interval = base_interval(bars['Date'])
+        self.levels = OrderedDict()
+
+        # each level is aggregated from a finer one, so the pyramid costs about one pass over the stored bars
+        for interval, source_interval in PYRAMID_LEVELS.items():
+            if interval == self.base_interval:
+                self.levels[interval] = bars
+            elif self.levels and source_interval in self.levels:
+                self.levels[interval] = resample_ohlcv(self.levels[source_interval], interval)
+
+    def select(self, start_date = None, end_date = None, max_candles: int = MAX_CANDLES, interval: Optional[str] = None) -> Tuple[str, dict]:
+        '''
+        Returns the finest level (and its bars within the date range) that fits the range into max_candles candles.
+        Falls back to the coarsest level if none fit. An interval limits the search to that level and coarser ones.
+        '''
+        levels = list(self.levels)
+        if interval is not None:
+            pyramid_order = list(PYRAMID_LEVELS)
+            levels = [level for level in levels if pyramid_order.index(level) >= pyramid_order.index(interval)]
+
+        for level in levels:
+            bars = self.levels[level]
+            first = 0 if start_date is None else int(np.searchsorted(bars['Date'], to_nanoseconds(start_date), side = 'left'))
+            last = len(bars['Date']) if end_date is None else int(np.searchsorted(bars['Date'], to_nanoseconds(end_date, end_of_range = True), side = 'right'))
+            if max_candles is None or last - first <= max_candles or level == levels[-1]:
+                return level, {column: values[first:max(first, last)] for column, values in bars.items()}
+
+
+@index_cache(maxsize = 512)
+def ohlcv_pyramid(data_index: DatasetIndex, ticker: str) -> OHLCVPyramid:
+    ticker_df = data_index.get(ticker)
+    bars = {'Date': data_index.dates(ticker)}
+    for column in ('Open', 'High', 'Low', 'Close', 'Volume'):
+        bars[column] = ticker_df[column].to_numpy()
+    return OHLCVPyramid(bars)
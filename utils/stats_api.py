@@ -0,0 +1,143 @@
+'''
+STATS API
+
+JSON endpoints on the app's Flask server for services that need the dashboard's numbers without scraping it:
+    GET /api/stats?tickers=AAPL,TSLA&start_date=2021-01-01&end_date=2022-01-01
+        each ticker's table values (mean and variance of daily returns, mean volume, 5% ETL)
+    GET /api/pair_stats?tickers=AAPL,TSLA&benchmark=SPY&start_date=2021-01-01&end_date=2022-01-01
+        each ticker's pair values against the benchmark (covariance, correlation, beta, days traded, up/down day counts)
+    GET /api/ohlcv?tickers=AAPL&start_date=2022-01-01&end_date=2022-02-01
+        each ticker's stored bars (daily, or intraday for an intraday store)
+tickers takes one or more comma separated tickers, and the dates are optional (the ticker's whole history). The values
+are calculated by utils/table_metrics.py, as the app's data table's are, and returned unrounded (NaN as null).
+
+Responses are cached by dataset version, and carry an ETag of the dataset version and the normalised query. A client
+polling with If-None-Match gets a 304 without anything being calculated or read until a new version is published.
+'''
+import hashlib
+from typing import Callable, List, Optional
+import flask
+import pandas as pd
+from plotly.io.json import to_json_plotly
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound
+from utils import figure_cache as fc
+from utils import table_metrics as tm
+from utils.dataset_index import DatasetIndex, to_nanoseconds
+
+
+API_PREFIX = '/api'
+
+# most tickers in one request
+MAX_TICKERS_PER_REQUEST = 1000
+
+# most bars in one OHLCV response, over all its tickers
+MAX_OHLCV_ROWS = 1000000
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+
+class StatsApi():
+
+    def __init__(self, live_dataset, cache_size: int = 1024):
+        self.live_dataset = live_dataset
+        self.not_modified = 0
+        # the figure cache's LRU, holding serialized response bodies. Cleared when the dataset version changes
+        self.cache = fc.FigureCache(max_size = cache_size)
+
+    def init_app(self, server: flask.Flask, url_prefix: str = API_PREFIX):
+        for name, view in (('stats', self.stats_view), ('pair_stats', self.pair_stats_view), ('ohlcv', self.ohlcv_view)):
+            server.add_url_rule(f'{url_prefix}/{name}', f'api_{name}', view, methods = ['GET'])
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), 'not_modified': self.not_modified}
+
+    # query parameters. Dates are normalised to nanoseconds, so equal dates in different formats share a cache entry and ETag
+    def _tickers(self, data_index: DatasetIndex, name: str = 'tickers') -> List[str]:
+        tickers = [ticker.strip() for ticker in flask.request.args.get(name, '').split(',') if ticker.strip()]
+        if not tickers:
+            raise BadRequest(f"'{name}' is required.")
+        if len(tickers) > MAX_TICKERS_PER_REQUEST:
+            raise BadRequest(f'At most {MAX_TICKERS_PER_REQUEST} tickers can be requested at once.')
+        unknown_tickers = [ticker for ticker in tickers if ticker not in data_index]
+        if unknown_tickers:
+            raise NotFound(f"Tickers not in the dataset: {', '.join(unknown_tickers)}")
+        return tickers
+
+    def _date_range(self) -> tuple:
+        start_date, end_date = flask.request.args.get('start_date'), flask.request.args.get('end_date')
+        try:
+            start_nanoseconds = None if start_date is None else to_nanoseconds(start_date)
+            end_nanoseconds = None if end_date is None else to_nanoseconds(end_date, end_of_range = True)
+        except ValueError:
+            raise BadRequest(f"Dates must be ISO dates or datetimes, got start_date={start_date!r} and end_date={end_date!r}.")
+        return start_nanoseconds, end_nanoseconds
+
+    def _respond(self, data_index: DatasetIndex, key: tuple, build: Callable[[], dict]) -> flask.Response:
+        # the ETag is known before anything is calculated, so unchanged results are answered from the headers alone.
+        # Compressed responses have the encoding appended to their ETag (flask_compress), which still matches
+        dataset_version = data_index.dataset_version if data_index.dataset_version is not None else str(id(data_index))
+        etag = hashlib.sha1(repr((dataset_version, key)).encode()).hexdigest()[:32]
+        if_none_match = flask.request.if_none_match
+        if if_none_match.star_tag or any(candidate == etag or candidate.startswith(f'{etag}:') for candidate in if_none_match.as_set(include_weak = True)):
+            self.not_modified += 1
+            response = flask.Response(status = 304)
+        else:
+            body = self.cache.get_or_build(key, dataset_version, lambda: to_json_plotly({'dataset_version': dataset_version, **build()}).encode())
+            response = flask.Response(body, mimetype = 'application/json')
+        response.set_etag(etag)
+        # clients may keep the response but must check it is still current (a cheap 304) before using it
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def _view(self, respond: Callable[[], flask.Response]) -> flask.Response:
+        try:
+            return respond()
+        except HTTPException as error:
+            return flask.Response(to_json_plotly({'error': error.description}), status = error.code, mimetype = 'application/json')
+
+    def stats_view(self) -> flask.Response:
+        def respond():
+            data_index = self.live_dataset.index()
+            tickers = self._tickers(data_index)
+            start_date, end_date = self._date_range()
+            build = lambda: {'stats': {ticker: tm.ticker_metrics(data_index, ticker, _timestamp(start_date), _timestamp(end_date)) for ticker in tickers}}
+            return self._respond(data_index, ('stats', tuple(tickers), start_date, end_date), build)
+        return self._view(respond)
+
+    def pair_stats_view(self) -> flask.Response:
+        def respond():
+            data_index = self.live_dataset.index()
+            tickers = self._tickers(data_index)
+            benchmark_ticker = self._tickers(data_index, 'benchmark')
+            if len(benchmark_ticker) != 1:
+                raise BadRequest("'benchmark' takes one ticker.")
+            benchmark_ticker = benchmark_ticker[0]
+            start_date, end_date = self._date_range()
+            build = lambda: {
+                'benchmark_ticker': benchmark_ticker,
+                'pair_stats': {ticker: tm.pair_metrics(data_index, ticker, benchmark_ticker, _timestamp(start_date), _timestamp(end_date)) for ticker in tickers},
+            }
+            return self._respond(data_index, ('pair_stats', tuple(tickers), benchmark_ticker, start_date, end_date), build)
+        return self._view(respond)
+
+    def ohlcv_view(self) -> flask.Response:
+        def respond():
+            bars_index = self.live_dataset.bars_index()
+            tickers = self._tickers(bars_index)
+            start_date, end_date = self._date_range()
+            rows = sum(len(range(*bars_index.bounds(ticker, _timestamp(start_date), _timestamp(end_date)))) for ticker in tickers)
+            if rows > MAX_OHLCV_ROWS:
+                raise BadRequest(f'The request covers {rows} bars, more than the {MAX_OHLCV_ROWS} allowed. Request fewer tickers or a shorter date range.')
+            build = lambda: {'ohlcv': {ticker: _ohlcv(bars_index, ticker, _timestamp(start_date), _timestamp(end_date)) for ticker in tickers}}
+            return self._respond(bars_index, ('ohlcv', tuple(tickers), start_date, end_date), build)
+        return self._view(respond)
+
+
+def _timestamp(nanoseconds: Optional[int]) -> Optional[pd.Timestamp]:
+    # the range functions take dates, and a Timestamp of a normalised end date still covers the end date's whole day
+    return None if nanoseconds is None else pd.Timestamp(nanoseconds)
+
+
+def _ohlcv(bars_index: DatasetIndex, ticker: str, start_date, end_date) -> dict:
+    bars = bars_index.get(ticker, start_date, end_date)
+    return {column: bars[column].to_numpy() for column in ['Date'] + [column for column in OHLCV_COLUMNS if column in bars.columns]}
@@ -0,0 +1,120 @@
+'''
+SUMMARY TABLE
+
+Full-history summary statistics of every ticker (the single ticker rows of the app's data table), computed up front
+so the default full-range view is a lookup instead of a calculation.
+
+The table is a structured numpy array with one row per ticker, in the order of the store's ticker categories. It is
+computed with a process pool (each worker memory-maps the store itself, so no data is pickled to the workers), saved
+in the store version directory next to the columns, and loaded from there by every later process.
+'''
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+import numpy as np
+from utils import calculation_functions as cf
+from utils import data_store as ds
+from utils.dataset_index import DatasetIndex, index_cache
+
+
+SUMMARY_FILE_NAME = 'summary_statistics.npy'
+
+SUMMARY_DTYPE = np.dtype([
+    ('mean_daily_return', np.float64),
+    ('var_daily_return', np.float64),
+    ('mean_volume', np.float64),
+    ('etl_5_percent', np.float64),
+    ('trading_days', np.int64),
+])
+
+# below this many tickers starting worker processes costs more than it saves
+PARALLEL_MIN_TICKERS = 200
+
+# chunks per worker, so workers that finish early pick up more work
+CHUNKS_PER_WORKER = 4
+
+
+def _ticker_summaries(data_index: DatasetIndex, tickers: List[str]) -> np.ndarray:
+    summaries = np.zeros(len(tickers), dtype = SUMMARY_DTYPE)
+    for row, ticker in enumerate(tickers):
+        ticker_data = data_index.get(ticker)
+        if len(ticker_data) == 0:
+            summaries[row] = (np.nan, np.nan, np.nan, np.nan, 0)
+            continue
+        summaries[row] = (
+            cf.mean(ticker_data, 'Daily Returns %'),
+            cf.variance(ticker_data, 'Daily Returns %'),
+            cf.mean(ticker_data, 'Volume'),
+            cf.etl_5_percent_daily_returns(ticker_data),
+            len(ticker_data),
+        )
+    return summaries
+
+
+def _store_ticker_summaries(store_path: str, tickers: List[str]) -> np.ndarray:
+    # process pool worker: memory-maps the store rather than receiving the data
+    return _ticker_summaries(DatasetIndex(ds.load_store(store_path)), tickers)
+
+
+def compute_summary_table(data_index: DatasetIndex, store_path: Optional[str] = None, max_workers: Optional[int] = None) -> np.ndarray:
+    '''
+    Computes every ticker's summary row. With a store_path and enough tickers the tickers are split into chunks
+    computed by a process pool, so the wall time falls with the number of cores.
+    '''
+    tickers = data_index.tickers
+    max_workers = max_workers or os.cpu_count() or 1
+    if store_path is None or max_workers == 1 or len(tickers) < PARALLEL_MIN_TICKERS:
+        return _ticker_summaries(data_index, tickers)
+
+    chunk_size = math.ceil(len(tickers) / (max_workers * CHUNKS_PER_WORKER))
+    chunks = [tickers[first:first + chunk_size] for first in range(0, len(tickers), chunk_size)]
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        return np.concatenate(list(executor.map(_store_ticker_summaries, [store_path] * len(chunks), chunks)))
+
+
+def write_summary_table(store_path: str, data_index: Optional[DatasetIndex] = None, max_workers: Optional[int] = None) -> np.ndarray:
+    '''
+    Computes the summary table of a store version and saves it in the version directory.
+    Passed to ds.publish() as prepare, so a new version goes live with its table already saved.
+    '''
+    if data_index is None:
+        data_index = DatasetIndex(ds.load_store(store_path))
+    summaries = compute_summary_table(data_index, store_path, max_workers = max_workers)
+
+    # writing to a temporary file and renaming it, so other processes never load a partial table
+    tmp_path = os.path.join(store_path, f'{SUMMARY_FILE_NAME}.tmp')
+    with open(tmp_path, 'wb') as summary_file:
+        np.save(summary_file, summaries, allow_pickle = False)
+    os.replace(tmp_path, os.path.join(store_path, SUMMARY_FILE_NAME))
+    return summaries
+
+
+@index_cache(maxsize = 8)
+def summary_table(data_index: DatasetIndex) -> np.ndarray:
+    '''
+    The summary table of the index's dataset: loaded from its store version if saved there, otherwise computed
+    (and saved, when the index was loaded from a store). An index extending a base index only computes its extra rows.
+    '''
+    base_index = getattr(data_index, 'base_index', None)
+    if base_index is not None:
+        # an index extending another with extra tickers (a portfolio, see utils/portfolio.py) reuses the other's table
+        return np.concatenate((summary_table(base_index), _ticker_summaries(data_index, data_index.tickers[len(base_index.tickers):])))
+
+    store_path = data_index.data.attrs.get('store_path')
+    if store_path is not None:
+        try:
+            summaries = np.load(os.path.join(store_path, SUMMARY_FILE_NAME), allow_pickle = False)
+            if len(summaries) == len(data_index.tickers) and summaries.dtype == SUMMARY_DTYPE:
+                return summaries
+        except (FileNotFoundError, ValueError):
+            pass
+        return write_summary_table(store_path, data_index)
+    return compute_summary_table(data_index)
+
+
+def ticker_summary(data_index: DatasetIndex, ticker: str):
+    # the ticker's full-history row of the summary table, or an empty row for a ticker not in the dataset
+    if ticker not in data_index:
+        return np.array((np.nan, np.nan, np.nan, np.nan, 0), dtype = SUMMARY_DTYPE)
+    return summary_table(data_index)[data_index.tickers.index(ticker)]
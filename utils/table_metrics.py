@@ -0,0 +1,62 @@
+'''
+TABLE METRICS
+
+The values of the app's data table (components/html_table.py) for a ticker, and for a ticker against a benchmark, over a
+date range. The app's table callback, the batch report (utils/batch_report.py) and anything else reporting the table's
+numbers calculate them here, so they always agree.
+
+Values are returned unrounded, the table rounds them for display. Full-history ticker values are read from the
+precomputed summary table (utils/summary_table.py), other ranges come from the moment engine's prefix sums (utils/moment_engine.py).
+'''
+from utils import calculation_functions as cf
+from utils import moment_engine as me
+from utils import summary_table as st
+from utils.dataset_index import DatasetIndex
+
+
+# table values of a ticker, then of a ticker against a benchmark, in the table's row order
+TICKER_METRICS = ['mean_daily_return', 'var_daily_return', 'mean_volume', 'etl_5_percent']
+PAIR_METRICS = [
+    'covariance', 'correlation', 'beta', 'trading_day_count',
+    'both_open_high', 'both_open_low', 'stock_high_benchmark_low', 'stock_low_benchmark_high',
+]
+
+
+def ticker_metrics(data_index: DatasetIndex, ticker: str, start_date = None, end_date = None) -> dict:
+    '''
+    Mean and variance of the ticker's daily returns, its mean volume and 5% ETL over the date range.
+    '''
+    if ticker in data_index and data_index.bounds(ticker, start_date, end_date) == data_index.bounds(ticker):
+        # the date range covers the ticker's whole history (the default view), so the values are read from the precomputed summary table
+        ticker_summary = st.ticker_summary(data_index, ticker)
+        return {metric: float(ticker_summary[metric]) for metric in TICKER_METRICS}
+
+    # window means and variances come from the ticker's prefix sums, so they cost the same for any date range.
+    # Only the ETL needs the rows themselves
+    ticker_moments = me.ticker_moments(data_index, ticker)
+    return {
+        'mean_daily_return': ticker_moments.mean_daily_return(start_date, end_date),
+        'var_daily_return': ticker_moments.variance_daily_return(start_date, end_date),
+        'mean_volume': ticker_moments.mean_volume(start_date, end_date),
+        'etl_5_percent': cf.etl_5_percent_daily_returns(data_index.get(ticker, start_date, end_date)),
+    }
+
+
+def pair_metrics(data_index: DatasetIndex, ticker: str, benchmark_ticker: str, start_date = None, end_date = None) -> dict:
+    '''
+    Covariance, correlation and beta of the ticker's daily returns against the benchmark's, the number of days both
+    traded and the up/down day counts, over the dates in the range both traded on.
+    '''
+    # all pair metrics come from the prefix sums of the aligned ticker and benchmark returns
+    pair_moments = me.pair_moments(data_index, ticker, benchmark_ticker)
+    both_open_high, both_open_low, stock_high_benchmark_low, stock_low_benchmark_high = pair_moments.quadrant_counts(start_date, end_date)
+    return {
+        'covariance': pair_moments.covariance(start_date, end_date),
+        'correlation': pair_moments.correlation(start_date, end_date),
+        'beta': pair_moments.beta(start_date, end_date),
+        'trading_day_count': pair_moments.trading_days(start_date, end_date),
+        'both_open_high': both_open_high,
+        'both_open_low': both_open_low,
+        'stock_high_benchmark_low': stock_high_benchmark_low,
+        'stock_low_benchmark_high': stock_low_benchmark_high,
+    }
@@ -0,0 +1,42 @@
+'''
+WSGI ENTRY POINT
+
+Production entry point for WSGI servers, e.g.
+    gunicorn -c gunicorn.conf.py wsgi:server
+
+Importing this module loads the app without starting the development server. With gunicorn's preload_app (set in
+gunicorn.conf.py) it is imported once in the master process before the workers are forked, so:
+    - the dataset columns are read-only memory maps of the store files, which every worker shares through the page cache
+    - the dataset index and the per-ticker derived indexes warmed below are built once and shared copy-on-write
+Memory therefore stays roughly flat as workers are added, instead of every worker parsing and holding its own copy.
+'''
+import gc
+import os
+from app import server, live_dataset
+from utils import moment_engine as me
+from utils import resampling as rs
+
+
+def warm_derived_indexes():
+    '''
+    builds every ticker's prefix sums and OHLCV pyramid up front, so forked workers inherit them instead of each building their own.
+    Skipped when there are more tickers than the caches hold.
+    '''
+    data_index = live_dataset.index()
+    bars_index = live_dataset.bars_index()
+    if len(data_index.tickers) > me.MOMENT_CACHE_SIZE:
+        return
+    for ticker in data_index.tickers:
+        me.ticker_moments(data_index, ticker)
+        rs.ohlcv_pyramid(bars_index, ticker)
+
+
+# the name uwsgi and mod_wsgi look for by default
+application = server
+
+if os.environ.get('WARM_DERIVED_INDEXES', '1') == '1':
+    warm_derived_indexes()
+
+# moving everything loaded so far out of the garbage collector's generations, so collections in the workers don't
+# write to (and so copy) the pages shared with the master process
+gc.freeze()